@@ -0,0 +1,148 @@
+"""
+Grading analytics rollups.
+
+Every time a submission is graded (or re-graded, or deleted) its contribution is added to (or
+removed from) two small aggregate tables: weekly score sums per user and subject, and attempt/miss
+counts per problem. Reads only touch those tables, so the analytics page costs the same no matter
+how many submissions a user has.
+"""
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+
+from db_routing import dialect_insert
+from grading import reported_correct
+from models import db, GradeSubmission, GradeWeeklyRollup, ProblemMissRollup
+
+
+TREND_WEEKS = 26
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _upsert(model, keys: Dict, increments: Dict, extra: Optional[Dict] = None) -> None:
+    """INSERT the row or add `increments` to the existing one, atomically (ON CONFLICT DO UPDATE)."""
+    values = dict(keys, **increments, **(extra or {}))
+    stmt = dialect_insert(db.session, model).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={col: getattr(model, col) + stmt.excluded[col] for col in increments},
+    )
+    db.session.execute(stmt)
+
+
+def snapshot(submission: GradeSubmission) -> Optional[Dict]:
+    """What a graded submission contributes to the rollups; None if it contributes nothing."""
+    if submission.status != 'graded' or submission.graded_at is None:
+        return None
+    problems = []
+    for p in submission.grading_rubric or []:
+        if isinstance(p, dict) and p.get('problem') is not None:
+            problems.append((str(p['problem'])[:255], not reported_correct(p.get('is_correct'))))
+    return {
+        'user_id': submission.user_id,
+        'subject': (submission.subject or '')[:120],
+        'assignment': (submission.assignment.title if submission.assignment else submission.title)[:255],
+        'week_start': week_start(submission.graded_at.date()),
+        'score': float(submission.overall_score or 0),
+        'earned': float(submission.earned_points or 0),
+        'total': float(submission.total_points or 0),
+        'problems': problems,
+    }
+
+
+def apply(snap: Optional[Dict], sign: int = 1) -> None:
+    """Add (sign=1) or remove (sign=-1) a snapshot's contribution. The caller commits."""
+    if not snap:
+        return
+    _upsert(
+        GradeWeeklyRollup,
+        {'user_id': snap['user_id'], 'subject': snap['subject'], 'week_start': snap['week_start']},
+        {
+            'submissions': sign,
+            'score_sum': sign * snap['score'],
+            'earned_sum': sign * snap['earned'],
+            'total_sum': sign * snap['total'],
+        },
+    )
+    for problem, missed in snap['problems']:
+        _upsert(
+            ProblemMissRollup,
+            {'user_id': snap['user_id'], 'assignment': snap['assignment'], 'problem': problem},
+            {'attempts': sign, 'misses': sign * int(missed)},
+            extra={'subject': snap['subject']},
+        )
+
+
+def rebuild(user_id: Optional[int] = None, chunk_size: int = 500) -> int:
+    """Recompute rollups from submissions (for existing data). Returns submissions counted."""
+    for model in (GradeWeeklyRollup, ProblemMissRollup):
+        stmt = delete(model)
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
+        db.session.execute(stmt)
+    query = GradeSubmission.query.filter(GradeSubmission.status == 'graded')
+    if user_id is not None:
+        query = query.filter(GradeSubmission.user_id == user_id)
+    count = 0
+    for submission in query.order_by(GradeSubmission.id).yield_per(chunk_size):
+        apply(snapshot(submission))
+        count += 1
+    db.session.commit()
+    return count
+
+
+def user_analytics(user_id: int, weeks: int = TREND_WEEKS, top_missed: int = 10) -> Dict[str, List[Dict]]:
+    since = week_start(date.today()) - timedelta(weeks=weeks - 1)
+    trend_rows = db.session.execute(
+        select(GradeWeeklyRollup)
+        .where(GradeWeeklyRollup.user_id == user_id, GradeWeeklyRollup.week_start >= since,
+               GradeWeeklyRollup.submissions > 0)
+        .order_by(GradeWeeklyRollup.week_start)
+    ).scalars().all()
+    subject_rows = db.session.execute(
+        select(
+            GradeWeeklyRollup.subject,
+            func.sum(GradeWeeklyRollup.submissions).label('submissions'),
+            func.sum(GradeWeeklyRollup.score_sum).label('score_sum'),
+        )
+        .where(GradeWeeklyRollup.user_id == user_id)
+        .group_by(GradeWeeklyRollup.subject)
+        .having(func.sum(GradeWeeklyRollup.submissions) > 0)
+        .order_by(GradeWeeklyRollup.subject)
+    ).all()
+    missed_rows = db.session.execute(
+        select(ProblemMissRollup)
+        .where(ProblemMissRollup.user_id == user_id, ProblemMissRollup.misses > 0)
+        .order_by(ProblemMissRollup.misses.desc(), ProblemMissRollup.attempts)
+        .limit(top_missed)
+    ).scalars().all()
+    return {
+        'subjects': [
+            {'subject': r.subject or 'General', 'submissions': r.submissions, 'average_score': round(r.score_sum / r.submissions, 1)}
+            for r in subject_rows
+        ],
+        'weekly': [
+            {
+                'week_start': r.week_start.isoformat(),
+                'subject': r.subject or 'General',
+                'submissions': r.submissions,
+                'average_score': round(r.score_sum / r.submissions, 1),
+            }
+            for r in trend_rows
+        ],
+        'most_missed': [
+            {
+                'assignment': r.assignment,
+                'subject': r.subject or 'General',
+                'problem': r.problem,
+                'misses': r.misses,
+                'attempts': r.attempts,
+            }
+            for r in missed_rows
+        ],
+    }
@@ -1,7 +1,12 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, Response, stream_with_context, send_file, abort, session
+import uuid
+from functools import wraps
+import click
 import json
+import math
+import mimetypes
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import (
     LoginManager,
@@ -11,12 +16,37 @@ from flask_login import (
     login_required,
 )
 from flask_migrate import Migrate
+from sqlalchemy import func, insert, select
 
 from config import DevelopmentConfig, ProductionConfig
 from dotenv import load_dotenv
-from models import db, User, Project, Conversation, Message, KnowledgeNode, KnowledgeEdge, GradeSubmission
-from chat_providers import get_default_provider
-from kg import extract_knowledge_graph
+from models import (
+    db, User, Project, Conversation, Message, KnowledgeNode, KnowledgeEdge, GradeSubmission, Assignment,
+    Concept, ConceptOccurrence, Cohort, CohortMember, ChatThread, ThreadMember, ThreadMessage,
+)
+from chat_providers import get_default_provider, provider_keys_configured, RateLimitError
+from kg import concept_key, extract_knowledge_graph, intern_legacy_nodes, node_label, replace_knowledge_graph
+from db_routing import configure_engines, dialect_insert, use_read_replica
+import analytics
+import feed
+from archive import compact, database_size, ensure_hydrated, reclaim_space
+from backfill import reextract_knowledge_graphs
+from outline_sessions import create_store
+from profiler import profiler, ProfilerBusy
+from realtime import create_broker, PresenceTracker
+from retrieval import vector_indexes, format_snippets
+from grading import (
+    build_grading_messages,
+    check_answers,
+    compile_prompt_prefix,
+    is_simple_answer,
+    local_result,
+    parse_answers,
+    parse_points,
+    reported_correct,
+)
+from storage import collect_garbage, get_storage, release, store_upload
+from transfer import export_jsonl, import_jsonl, TransferError
 from werkzeug.utils import secure_filename
 import base64
 
@@ -32,9 +62,26 @@ else:
 
 # Extensions
 db.init_app(app)
-migrate = Migrate(app, db)
+configure_engines(app, db)
+# Batch mode lets autogenerated migrations alter existing SQLite tables (copy-and-move); other backends get plain ALTERs
+migrate = Migrate(app, db, render_as_batch=True)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+outline_store = create_store(
+    app.config['OUTLINE_SESSION_BACKEND'],
+    ttl=app.config['OUTLINE_SESSION_TTL_SEC'],
+    max_sessions=app.config['OUTLINE_SESSION_MAX'],
+    max_history=app.config['OUTLINE_HISTORY_MAX'],
+)
+
+
+def thread_channel(thread_id):
+    return f'thread:{thread_id}'
+
+
+broker = create_broker(app.config['REALTIME_BACKEND'], max_queue=app.config['REALTIME_MAX_QUEUE'])
+presence = PresenceTracker(broker, thread_channel, interval=app.config['PRESENCE_INTERVAL_SEC'])
+
 @app.errorhandler(404)
 def not_found(e):
     return render_template('error_404.html'), 404
@@ -50,10 +97,34 @@ def load_user(user_id):
     return db.session.get(User, int(user_id))
 
 
+def admin_required(view):
+    """Restrict a view to logged-in users listed in ADMIN_EMAILS."""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.email.lower() not in app.config.get('ADMIN_EMAILS', []):
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.before_request
+def profile_request_start():
+    # Single attribute check unless a route profile is armed
+    if profiler.armed_endpoint is not None:
+        profiler.request_started(request.endpoint)
+
+
+@app.teardown_request
+def profile_request_end(exc):
+    if profiler.armed_endpoint is not None:
+        profiler.request_finished()
+
+
 @app.context_processor
 def inject_provider_status():
     """Expose provider readiness to templates to surface helpful UI banners."""
-    return { 'PROVIDER_READY': bool(os.environ.get('OPENAI_API_KEY')) }
+    return { 'PROVIDER_READY': provider_keys_configured() }
 
 # Mock data used for non-authenticated landing/demo
 mock_projects = [
@@ -85,7 +156,7 @@ mock_projects = [
     }
 ]
 
-# AI Models configuration (UI only; runtime uses environment/provider)
+# AI Models configuration (model ids are routed to providers by chat_providers.ProviderRouter)
 ai_models = {
     "openai": [
         {"id": "gpt-4", "name": "GPT-4", "provider": "OpenAI"},
@@ -153,6 +224,7 @@ learning_preferences = {
 
 @app.route('/')
 @login_required
+@use_read_replica
 def dashboard():
     """Main learning dashboard showing all projects"""
     projects = (
@@ -218,8 +290,16 @@ def outline_chat():
         "id": 0,
         "title": "Outline Session"
     }
+    # Each visit starts a fresh outline history
+    session['outline_sid'] = uuid.uuid4().hex
     return render_template('chat_interface.html', project=temp_project, conversation=temp_conversation, outline_mode=True)
 
+def _outline_key():
+    if 'outline_sid' not in session:
+        session['outline_sid'] = uuid.uuid4().hex
+    return f"{current_user.id}:{session['outline_sid']}"
+
+
 @app.route('/project/<int:project_id>')
 @login_required
 def project_dashboard(project_id):
@@ -259,6 +339,7 @@ def chat_interface(project_id, conversation_id):
         flash('Conversation not found.', 'error')
         return redirect(url_for('project_dashboard', project_id=project_id))
 
+    ensure_hydrated(conversation)
     recent_messages = (
         Message.query.filter_by(conversation_id=conversation.id)
         .order_by(Message.created_at.asc())
@@ -272,6 +353,20 @@ def chat_interface(project_id, conversation_id):
                          outline_mode=False,
                          messages_json=json.dumps(serialized))
 
+def _busy_message(error):
+    return (
+        "SciWeb is handling a lot of requests right now. Please wait about"
+        f" {max(1, round(error.retry_after))} seconds and try again."
+    )
+
+
+@app.route('/api/provider/stats')
+@admin_required
+def api_provider_stats():
+    """Coalescing, queue wait and rejection counters for the shared provider."""
+    return jsonify(get_default_provider().stats())
+
+
 @app.route('/api/send-message', methods=['POST'])
 @login_required
 def send_message():
@@ -298,13 +393,18 @@ def send_message():
                 " questions to clarify topic, resources, prior knowledge, and desired depth. Propose a brief"
                 " plan (milestones, skills, checkpoints). End with 1-2 short questions to proceed."
             )
-            ai_text = provider.chat([
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": message or "Help me plan my learning project."}
-            ])
+            outline_key = _outline_key()
+            user_turn = {"role": "user", "content": message or "Help me plan my learning project."}
+            ai_text = provider.chat(
+                [{"role": "system", "content": sys_prompt}] + outline_store.get(outline_key) + [user_turn],
+                user_id=current_user.id,
+            )
+            outline_store.append(outline_key, [user_turn, {"role": "assistant", "content": ai_text}])
+        except RateLimitError as e:
+            return jsonify({'error': _busy_message(e), 'retry_after': e.retry_after}), 429
         except Exception:
             ai_text = (
-                "Outline mode active. Set OPENAI_API_KEY to enable guided outlining, or create a project to"
+                "Outline mode active. Set an AI provider key to enable guided outlining, or create a project to"
                 " continue in a persistent chat."
             )
         return jsonify({'response': ai_text, 'timestamp': datetime.now().isoformat()})
@@ -317,6 +417,7 @@ def send_message():
     ).first()
     if not conversation:
         return jsonify({'error': 'Conversation not found'}), 404
+    ensure_hydrated(conversation)
 
     # Persist user message
     user_msg = Message(conversation_id=conversation.id, role='user', content=message)
@@ -340,20 +441,30 @@ def send_message():
         " to think, show steps, and connect ideas historically when relevant. Keep responses concise but"
         " rigorous; include check-for-understanding questions."
     )
-    provider_messages = [{"role": "system", "content": sys_prompt}] + [
-        {"role": m.role, "content": m.content} for m in history
-    ][-24:]
+    window = history[-24:]
+    provider_messages = [{"role": "system", "content": sys_prompt}]
+    # Pull in relevant material from the rest of the project instead of sending more raw history
+    try:
+        hits = vector_indexes.search(
+            conversation.project_id, message, k=4, exclude_message_ids=[m.id for m in window]
+        ) if message else []
+    except Exception:
+        hits = []
+    if hits:
+        provider_messages.append({"role": "system", "content": format_snippets(hits)})
+    provider_messages += [{"role": m.role, "content": m.content} for m in window]
 
     try:
         provider = get_default_provider()
-        ai_text = provider.chat(provider_messages, model=conversation.ai_model)
+        ai_text = provider.chat(provider_messages, model=conversation.ai_model, user_id=current_user.id)
+    except RateLimitError as e:
+        ai_text = _busy_message(e)
     except Exception as e:
         # Provide a more actionable error message for setup issues
-        missing_key = 'OPENAI_API_KEY' not in os.environ or not os.environ.get('OPENAI_API_KEY')
-        if missing_key:
+        if not provider_keys_configured():
             ai_text = (
-                "Provider unavailable: missing OPENAI_API_KEY. Add it to your environment or .env, then"
-                " refresh and try again."
+                "Provider unavailable: missing OPENAI_API_KEY (or ANTHROPIC_API_KEY / GOOGLE_API_KEY). Add it"
+                " to your environment or .env, then refresh and try again."
             )
         else:
             ai_text = "Sorry, there was an issue contacting the AI provider. Please try again."
@@ -373,28 +484,13 @@ def send_message():
         messages_payload = [{"role": m.role, "content": m.content} for m in full_messages]
         nodes, edges = extract_knowledge_graph(messages_payload)
 
-        # Clear and reinsert nodes/edges
-        KnowledgeEdge.query.filter_by(conversation_id=conversation.id).delete()
-        KnowledgeNode.query.filter_by(conversation_id=conversation.id).delete()
-        db.session.flush()
-
-        label_to_node = {}
-        for n in nodes:
-            node = KnowledgeNode(conversation_id=conversation.id, label=n['label'], type=n.get('type'))
-            db.session.add(node)
-            db.session.flush()
-            label_to_node[n['label']] = node
-
-        for e in edges:
-            src = label_to_node.get(e['source'])
-            tgt = label_to_node.get(e['target'])
-            if src and tgt and src.id != tgt.id:
-                db.session.add(KnowledgeEdge(
-                    conversation_id=conversation.id,
-                    source_node_id=src.id,
-                    target_node_id=tgt.id,
-                    relation=e.get('relation') or 'related_to'
-                ))
+        new_concepts = replace_knowledge_graph(conversation.id, nodes, edges)
+        if new_concepts:
+            feed.publish(
+                current_user.id, 'concepts', f'New concepts in {conversation.title}',
+                preview=f'{len(new_concepts)} new concept(s) mapped in {conversation.project.title}.',
+                concepts=new_concepts[:8], project_id=conversation.project_id, conversation_id=conversation.id,
+            )
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -418,6 +514,23 @@ def create_project_from_outline():
         title='Outline Summary',
     )
     db.session.add(conv)
+    db.session.flush()
+
+    # Materialize the outline chat into the new conversation in one batch
+    history = outline_store.pop(_outline_key())
+    if history:
+        start = datetime.utcnow() - timedelta(microseconds=len(history))
+        db.session.execute(insert(Message), [
+            {
+                'conversation_id': conv.id,
+                'role': m['role'],
+                'content': m['content'],
+                # Distinct, ordered timestamps keep created_at ordering stable
+                'created_at': start + timedelta(microseconds=i),
+            }
+            for i, m in enumerate(history)
+        ])
+    feed.publish(current_user.id, 'lesson', topic, preview=description, project_id=project.id, conversation_id=conv.id)
     db.session.commit()
 
     return jsonify({'project_id': project.id, 'redirect_url': url_for('project_dashboard', project_id=project.id)})
@@ -444,10 +557,42 @@ def api_create_conversation():
         interaction_preference=data.get('interaction_preference'),
     )
     db.session.add(conv)
+    db.session.flush()
+    feed.publish(
+        current_user.id, 'lesson', conv.title,
+        preview=' · '.join(p for p in (project.title, conv.interaction_style) if p),
+        project_id=project.id, conversation_id=conv.id,
+    )
     db.session.commit()
 
     return jsonify({'conversation_id': conv.id, 'redirect_url': url_for('chat_interface', project_id=project.id, conversation_id=conv.id)})
 
+@app.route('/api/conversations/export')
+@login_required
+@use_read_replica
+def api_export_conversations():
+    """Stream the current user's projects, conversations, messages and graphs as JSONL."""
+    owner_id = current_user.id
+    filename = f"sciweb-export-{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    return Response(
+        stream_with_context(export_jsonl(owner_id=owner_id)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
+@app.route('/api/conversations/import', methods=['POST'])
+@login_required
+def api_import_conversations():
+    """Import a JSONL export (request body or `file` upload) into the current user's account."""
+    stream = request.files['file'].stream if 'file' in request.files else request.stream
+    try:
+        counts = import_jsonl(stream, owner_id=current_user.id)
+    except TransferError as e:
+        return jsonify({'error': f'Import failed: {e}'}), 400
+    return jsonify({'success': True, 'imported': counts})
+
+
 @app.route('/style')
 @login_required
 def style():
@@ -456,6 +601,7 @@ def style():
 
 @app.route('/project/<int:project_id>/knowledge-graph')
 @login_required
+@use_read_replica
 def knowledge_graph(project_id):
     project = Project.query.filter_by(id=project_id, owner_id=current_user.id).first()
     if not project:
@@ -464,7 +610,11 @@ def knowledge_graph(project_id):
 
     # Aggregate nodes/edges across all conversations in the project
     convo_ids = [c.id for c in project.conversations]
-    nodes = KnowledgeNode.query.filter(KnowledgeNode.conversation_id.in_(convo_ids)).all()
+    nodes = db.session.execute(
+        select(KnowledgeNode.id, node_label().label('label'), KnowledgeNode.type)
+        .outerjoin(Concept, KnowledgeNode.concept_id == Concept.id)
+        .where(KnowledgeNode.conversation_id.in_(convo_ids))
+    ).all()
     edges = KnowledgeEdge.query.filter(KnowledgeEdge.conversation_id.in_(convo_ids)).all()
 
     node_payload = [{'id': n.id, 'label': n.label, 'type': n.type} for n in nodes]
@@ -472,6 +622,33 @@ def knowledge_graph(project_id):
 
     return render_template('knowledge_graph.html', project=project, nodes_json=json.dumps(node_payload), edges_json=json.dumps(edge_payload))
 
+@app.route('/api/concepts/lookup')
+@login_required
+@use_read_replica
+def api_concept_lookup():
+    """Every project and conversation of the current user that mentions a concept, most frequent first."""
+    key = concept_key(request.args.get('q', ''))
+    if not key:
+        return jsonify({'error': 'q is required'}), 400
+    concept = Concept.query.filter_by(user_id=current_user.id, key=key).first()
+    if concept is None:
+        return jsonify({'concept': None, 'occurrences': []})
+    rows = db.session.execute(
+        select(ConceptOccurrence.frequency, Project.id, Project.title, Conversation.id, Conversation.title)
+        .join(Project, ConceptOccurrence.project_id == Project.id)
+        .join(Conversation, ConceptOccurrence.conversation_id == Conversation.id)
+        .where(ConceptOccurrence.concept_id == concept.id)
+        .order_by(ConceptOccurrence.frequency.desc(), Conversation.id.desc())
+    ).all()
+    return jsonify({
+        'concept': {'id': concept.id, 'label': concept.label},
+        'total_frequency': sum(r[0] for r in rows),
+        'occurrences': [
+            {'project_id': r[1], 'project_title': r[2], 'conversation_id': r[3], 'conversation_title': r[4], 'frequency': r[0]}
+            for r in rows
+        ],
+    })
+
 @app.route('/assistant')
 @login_required
 def assistant_hub():
@@ -492,54 +669,54 @@ def assistant_hub():
     return render_template('assistant_hub.html', projects=projects, featured=featured)
 
 # New social/collab UI routes (mock data)
-@app.route('/feed')
+@app.route('/feed', endpoint='feed')
 @login_required
-def feed():
-    items = [
-        {
-            'id': 1,
-            'author': current_user.display_name or current_user.email,
-            'title': 'Deriving Maxwell’s Equations',
-            'concepts': ['Electromagnetism', 'Vector Calculus'],
-            'type': 'lesson',
-            'helpfulness': 42,
-            'preview': 'A step-by-step derivation from Gauss and Faraday to wave propagation…',
-            'created': datetime.now().strftime('%Y-%m-%d')
-        },
-        {
-            'id': 2,
-            'author': 'Ada Lovelace',
-            'title': 'Study Thread: Dynamic Programming Practice',
-            'concepts': ['Algorithms', 'Recurrence Relations'],
-            'type': 'thread',
-            'helpfulness': 27,
-            'preview': 'Let’s solve coin change, LCS, and knapsack with reasoning traces…',
-            'created': datetime.now().strftime('%Y-%m-%d')
-        },
-    ]
-    return render_template('feed.html', items=items)
-
-
-@app.route('/cohorts')
+def feed_page():
+    """One block of the user's precomputed timeline; 'Next Block' follows the keyset cursor."""
+    order = 'recent' if request.args.get('order') == 'recent' else 'ranked'
+    try:
+        items, next_cursor = feed.page(current_user.id, request.args.get('cursor'), app.config['FEED_BLOCK_SIZE'], order)
+    except ValueError:
+        return redirect(url_for('feed', order=order))
+    for it in items:
+        it['url'] = _feed_item_url(it)
+    return render_template('feed.html', items=items, next_cursor=next_cursor, order=order)
+
+
+def _feed_item_url(item):
+    # Conversations and grades are private; only the author gets a link
+    if item['actor_id'] != current_user.id:
+        return None
+    if item['submission_id']:
+        return url_for('grader_result', submission_id=item['submission_id'])
+    if item['conversation_id']:
+        return url_for('chat_interface', project_id=item['project_id'], conversation_id=item['conversation_id'])
+    return None
+
+
+@app.route('/api/feed')
 @login_required
-def cohorts():
-    groups = [
-        {'id': 1, 'name': 'AP Physics C Cohort', 'members': 18, 'topics': ['Mechanics', 'E&M']},
-        {'id': 2, 'name': 'Linear Algebra Club', 'members': 24, 'topics': ['Eigenvalues', 'SVD']},
-        {'id': 3, 'name': 'World History 1900–1950', 'members': 12, 'topics': ['WWI', 'Interwar', 'WWII']},
-    ]
-    return render_template('cohorts.html', groups=groups)
+def api_feed():
+    """Timeline page as JSON: ?cursor=<next_cursor>&limit=20&order=ranked|recent."""
+    order = 'recent' if request.args.get('order') == 'recent' else 'ranked'
+    limit = max(1, min(request.args.get('limit', feed.DEFAULT_PAGE_SIZE, type=int), 100))
+    try:
+        items, next_cursor = feed.page(current_user.id, request.args.get('cursor'), limit, order)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    for it in items:
+        it['url'] = _feed_item_url(it)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 
-@app.route('/study')
+@app.route('/api/feed/<int:event_id>/helpful', methods=['POST'])
 @login_required
-def study_room():
-    room = {
-        'id': 'demo',
-        'title': 'Focus Room',
-        'members': [current_user.display_name or current_user.email, 'Guest'],
-    }
-    return render_template('study_room.html', room=room)
+def api_feed_helpful(event_id):
+    helpfulness = feed.mark_helpful(event_id, current_user.id)
+    if helpfulness is None:
+        return jsonify({'error': 'Item not found'}), 404
+    db.session.commit()
+    return jsonify({'success': True, 'helpfulness': helpfulness})
 
 
 @app.route('/profile')
@@ -564,24 +741,385 @@ def create_hub():
     return render_template('create_hub.html', tools=tools)
 
 
+# Messaging, cohorts and study rooms (real-time via /api/realtime/stream)
+def _display_name(user):
+    return user.display_name or user.email
+
+
+def _thread_membership(thread_id):
+    return ThreadMember.query.filter_by(thread_id=thread_id, user_id=current_user.id).first()
+
+
+def _message_event(m):
+    return {
+        'type': 'message',
+        'id': m.id,
+        'thread': m.thread_id,
+        'sender_id': m.sender_id,
+        'sender': _display_name(m.sender),
+        'body': m.body,
+        'created_at': m.created_at.isoformat(),
+    }
+
+
+def _recent_thread_messages(thread_id, limit=50, before_id=None):
+    query = ThreadMessage.query.filter(ThreadMessage.thread_id == thread_id)
+    if before_id:
+        query = query.filter(ThreadMessage.id < before_id)
+    return list(reversed(query.order_by(ThreadMessage.id.desc()).limit(limit).all()))
+
+
+def _add_thread_members(thread_id, user_ids, last_read_message_id=0):
+    # Existing members are left as they are (and concurrent adds can't collide)
+    rows = [
+        {'thread_id': thread_id, 'user_id': user_id, 'last_read_message_id': last_read_message_id}
+        for user_id in set(user_ids)
+    ]
+    if rows:
+        db.session.execute(
+            dialect_insert(db.session, ThreadMember).on_conflict_do_nothing(index_elements=['thread_id', 'user_id']),
+            rows,
+        )
+
+
+def _mark_read(membership, message_id):
+    # Only ever moves forward, so a late request from another tab can't un-read messages
+    ThreadMember.query.filter(
+        ThreadMember.id == membership.id, ThreadMember.last_read_message_id < message_id
+    ).update({ThreadMember.last_read_message_id: message_id}, synchronize_session=False)
+
+
 @app.route('/messages')
 @login_required
 def messages():
+    memberships = (
+        db.session.query(ThreadMember, ChatThread)
+        .join(ChatThread, ThreadMember.thread_id == ChatThread.id)
+        .filter(ThreadMember.user_id == current_user.id)
+        .order_by(ChatThread.last_message_id.desc(), ChatThread.id.desc())
+        .all()
+    )
+    unread = dict(db.session.execute(
+        select(ThreadMember.thread_id, func.count(ThreadMessage.id))
+        .join(ThreadMessage, (ThreadMessage.thread_id == ThreadMember.thread_id)
+              & (ThreadMessage.id > ThreadMember.last_read_message_id))
+        .where(ThreadMember.user_id == current_user.id)
+        .group_by(ThreadMember.thread_id)
+    ).all())
     threads = [
-        {'id': 1, 'name': 'AP Physics Chat', 'last': "Let's meet 6pm for problem set 3", 'unread': 2},
-        {'id': 2, 'name': 'Linear Algebra Buddies', 'last': 'SVD intuition notes shared', 'unread': 0},
-        {'id': 3, 'name': 'History Debate Team', 'last': 'Finalize sources list', 'unread': 1},
+        {'id': t.id, 'name': t.name, 'kind': t.kind, 'last': t.last_message_preview or '', 'unread': unread.get(t.id, 0)}
+        for _, t in memberships
     ]
-    current = {'id': 1, 'name': 'AP Physics Chat', 'messages': [
-        {'who': 'You', 'text': "Anyone free to review Gauss's law derivation?"},
-        {'who': 'Riley', 'text': 'Yes! I can join in 10.'}
-    ]}
+
+    current = None
+    selected = request.args.get('thread', type=int)
+    for membership, thread in memberships:
+        if selected in (None, thread.id):
+            history = _recent_thread_messages(thread.id)
+            if history:
+                _mark_read(membership, history[-1].id)
+                db.session.commit()
+            current = {
+                'id': thread.id,
+                'name': thread.name,
+                'kind': thread.kind,
+                'last_id': history[-1].id if history else 0,
+                'messages': [{'id': m.id, 'who': _display_name(m.sender), 'text': m.body} for m in history],
+            }
+            break
     return render_template('messages.html', threads=threads, current=current)
 
 
+@app.route('/api/threads', methods=['POST'])
+@login_required
+def api_create_thread():
+    """Start a thread with other users by email: {name, emails: [...]}."""
+    data = request.json or {}
+    name = (data.get('name') or '').strip()
+    emails = [e.strip().lower() for e in data.get('emails') or [] if e and e.strip()]
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+    users = User.query.filter(func.lower(User.email).in_(emails)).all() if emails else []
+    missing = sorted(set(emails) - {u.email.lower() for u in users})
+    if missing:
+        return jsonify({'error': f"Unknown users: {', '.join(missing)}"}), 400
+    thread = ChatThread(name=name[:255], kind='thread', created_by=current_user.id)
+    db.session.add(thread)
+    db.session.flush()
+    _add_thread_members(thread.id, {current_user.id} | {u.id for u in users})
+    db.session.commit()
+    return jsonify({'success': True, 'thread_id': thread.id}), 201
+
+
+@app.route('/api/threads/<int:thread_id>/messages', methods=['GET'])
+@login_required
+def api_thread_history(thread_id):
+    """Older messages, newest page first: ?before=<message id>&limit=50."""
+    if _thread_membership(thread_id) is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    history = _recent_thread_messages(thread_id, limit=limit, before_id=request.args.get('before', type=int))
+    return jsonify({'messages': [_message_event(m) for m in history], 'has_more': len(history) == limit})
+
+
+@app.route('/api/threads/<int:thread_id>/messages', methods=['POST'])
+@login_required
+def api_post_thread_message(thread_id):
+    membership = _thread_membership(thread_id)
+    if membership is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    body = ((request.json or {}).get('body') or '').strip()
+    if not body:
+        return jsonify({'error': 'body is required'}), 400
+    message = ThreadMessage(thread_id=thread_id, sender_id=current_user.id, body=body[:4000])
+    db.session.add(message)
+    db.session.flush()
+    ChatThread.query.filter_by(id=thread_id).update({
+        ChatThread.last_message_id: message.id,
+        ChatThread.last_message_at: message.created_at,
+        ChatThread.last_message_preview: body[:255],
+    }, synchronize_session=False)
+    _mark_read(membership, message.id)
+    db.session.commit()
+    # Publish only after commit so a reconnecting client can always replay it from the table
+    event = _message_event(message)
+    broker.publish(thread_channel(thread_id), event)
+    return jsonify(event), 201
+
+
+@app.route('/api/threads/<int:thread_id>/read', methods=['POST'])
+@login_required
+def api_mark_thread_read(thread_id):
+    membership = _thread_membership(thread_id)
+    if membership is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    message_id = (request.json or {}).get('message_id')
+    if not isinstance(message_id, int):
+        return jsonify({'error': 'message_id must be an integer'}), 400
+    _mark_read(membership, message_id)
+    db.session.commit()
+    return jsonify({'success': True})
+
+
+def _sse(event):
+    lines = [f"event: {event['type']}"]
+    if event['type'] == 'message':
+        lines.append(f"id: {event['id']}")
+    lines.append(f'data: {json.dumps(event)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@app.route('/api/realtime/stream/<int:thread_id>')
+@login_required
+def realtime_stream(thread_id):
+    """
+    Server-Sent Events for one thread: `message` events (id = message id) and, for study rooms,
+    batched `presence` events. Messages after the cursor are replayed first: Last-Event-ID on a
+    reconnect, otherwise `?after=` (the last message id the page was rendered with).
+    """
+    membership = _thread_membership(thread_id)
+    if membership is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    is_room = membership.thread.kind == 'room'
+    user_id, name = current_user.id, _display_name(current_user)
+    keepalive = app.config['REALTIME_KEEPALIVE_SEC']
+
+    # Subscribe before reading the backlog so nothing published in between is lost; the client
+    # drops duplicates by message id
+    subscription = broker.subscribe([thread_channel(thread_id)])
+    missed = []
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('after', type=int)
+    if last_event_id is not None:
+        missed = [
+            _message_event(m) for m in ThreadMessage.query.filter(
+                ThreadMessage.thread_id == thread_id, ThreadMessage.id > last_event_id
+            ).order_by(ThreadMessage.id).limit(500)
+        ]
+    # The stream can stay open for hours; don't hold a pooled DB connection for it
+    db.session.close()
+    if is_room:
+        presence.join(thread_id, user_id, name)
+
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            for event in missed:
+                yield _sse(event)
+            while not subscription.overflowed:
+                event = subscription.get(timeout=keepalive)
+                yield _sse(event) if event else ': keepalive\n\n'
+        finally:
+            subscription.close()
+            if is_room:
+                presence.leave(thread_id, user_id, name)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/realtime/stats')
+@admin_required
+def realtime_stats():
+    """Connections and fan-out counters for this worker."""
+    return jsonify(dict(broker.stats(), presence_node=presence.node, presence_events=presence.events_published))
+
+
+@app.route('/cohorts')
+@login_required
+def cohorts():
+    groups = Cohort.query.order_by(Cohort.member_count.desc(), Cohort.id.desc()).limit(60).all()
+    joined = set(db.session.execute(
+        select(CohortMember.cohort_id).where(CohortMember.user_id == current_user.id)
+    ).scalars())
+    rooms = dict(db.session.execute(
+        select(ChatThread.cohort_id, ChatThread.id).where(
+            ChatThread.kind == 'room', ChatThread.cohort_id.in_([g.id for g in groups])
+        )
+    ).all())
+    return render_template('cohorts.html', groups=[
+        {'id': g.id, 'name': g.name, 'members': g.member_count, 'topics': g.topics or [],
+         'joined': g.id in joined, 'room_id': rooms.get(g.id)}
+        for g in groups
+    ])
+
+
+@app.route('/api/cohorts', methods=['POST'])
+@login_required
+def api_create_cohort():
+    """Create a cohort and its study room; the creator joins both. {name, description, topics}"""
+    data = request.json or {}
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+    topics = data.get('topics') or []
+    if isinstance(topics, str):
+        topics = [t.strip() for t in topics.split(',')]
+    cohort = Cohort(
+        name=name[:255], description=data.get('description'), topics=[t for t in topics if t][:10],
+        created_by=current_user.id, member_count=1,
+    )
+    db.session.add(cohort)
+    db.session.flush()
+    db.session.add(CohortMember(cohort_id=cohort.id, user_id=current_user.id))
+    room = ChatThread(name=f'{cohort.name} Study Room'[:255], kind='room', cohort_id=cohort.id, created_by=current_user.id)
+    db.session.add(room)
+    db.session.flush()
+    _add_thread_members(room.id, {current_user.id})
+    db.session.commit()
+    return jsonify({'success': True, 'cohort_id': cohort.id, 'room_id': room.id}), 201
+
+
+@app.route('/api/cohorts/<int:cohort_id>/join', methods=['POST'])
+@login_required
+def api_join_cohort(cohort_id):
+    cohort = db.session.get(Cohort, cohort_id)
+    if cohort is None:
+        return jsonify({'error': 'Cohort not found'}), 404
+    # Insert-or-skip in one statement, so concurrent joins by the same user count once
+    joined = db.session.execute(
+        dialect_insert(db.session, CohortMember)
+        .values(cohort_id=cohort_id, user_id=current_user.id)
+        .on_conflict_do_nothing(index_elements=['cohort_id', 'user_id'])
+    ).rowcount
+    if joined:
+        Cohort.query.filter_by(id=cohort_id).update({Cohort.member_count: Cohort.member_count + 1}, synchronize_session=False)
+        if cohort.room is not None:
+            # New members start at the current end of the room's history
+            _add_thread_members(cohort.room.id, {current_user.id}, last_read_message_id=cohort.room.last_message_id)
+        db.session.commit()
+    return jsonify({'success': True, 'room_id': cohort.room.id if cohort.room else None})
+
+
+@app.route('/study')
+@login_required
+def study_room():
+    room_id = request.args.get('room', type=int)
+    query = (
+        db.session.query(ChatThread)
+        .join(ThreadMember, ThreadMember.thread_id == ChatThread.id)
+        .filter(ThreadMember.user_id == current_user.id, ChatThread.kind == 'room')
+    )
+    thread = query.filter(ChatThread.id == room_id).first() if room_id else query.order_by(ChatThread.last_message_id.desc()).first()
+    if thread is None:
+        flash('Join or create a cohort to use its study room.', 'info')
+        return redirect(url_for('cohorts'))
+    history = _recent_thread_messages(thread.id)
+    room = {
+        'id': thread.id,
+        'title': thread.name,
+        'members': [m['name'] for m in presence.members(thread.id)],
+        'messages': [{'id': m.id, 'who': _display_name(m.sender), 'text': m.body} for m in history],
+        'last_id': history[-1].id if history else 0,
+    }
+    return render_template('study_room.html', room=room)
+
+
+# Admin: sampling profiler
+@app.route('/admin/profile', methods=['POST'])
+@admin_required
+def admin_profile_window():
+    """Sample every thread of this worker for `seconds` and return collapsed stacks (flamegraph input)."""
+    data = request.json or {}
+    try:
+        seconds = float(data.get('seconds', 5))
+        interval = float(data.get('interval_ms', 5)) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seconds and interval_ms must be numbers'}), 400
+    try:
+        output = profiler.profile_window(seconds, interval)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(output, mimetype='text/plain')
+
+
+@app.route('/admin/profile/route', methods=['POST'])
+@admin_required
+def admin_profile_route():
+    """Arm the profiler for the next N requests to an endpoint (e.g. send_message, api_grader_grade)."""
+    data = request.json or {}
+    endpoint = data.get('endpoint')
+    if endpoint not in app.view_functions:
+        return jsonify({'error': f'Unknown endpoint {endpoint!r}'}), 400
+    try:
+        requests_count = int(data.get('requests', 10))
+        interval = float(data.get('interval_ms', 5)) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'error': 'requests and interval_ms must be numbers'}), 400
+    try:
+        profiler.arm_route(endpoint, requests_count, interval)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'armed': endpoint, 'requests': requests_count}), 202
+
+
+@app.route('/admin/profile/route', methods=['GET'])
+@admin_required
+def admin_profile_route_result():
+    """Status of the armed route profile; collapsed stacks as text/plain once it has finished."""
+    result = profiler.last_route_result
+    if not result:
+        return jsonify({'error': 'No route profile has been run on this worker'}), 404
+    if not result['done']:
+        return jsonify({'endpoint': result['endpoint'], 'done': False}), 202
+    return Response(result['output'], mimetype='text/plain')
+
+
+@app.route('/admin/profile/route', methods=['DELETE'])
+@admin_required
+def admin_profile_route_cancel():
+    profiler.cancel_route()
+    return jsonify({'cancelled': True})
+
+
 # Grade Scanner Routes
 @app.route('/grader')
 @login_required
+@use_read_replica
 def grader_home():
     """Grade scanner dashboard showing recent submissions"""
     recent_submissions = (
@@ -593,12 +1131,77 @@ def grader_home():
     return render_template('grader_home.html', submissions=recent_submissions)
 
 
+@app.route('/grader/analytics')
+@login_required
+@use_read_replica
+def grader_analytics():
+    """Score trends by subject and most-missed problems, read from precomputed rollups."""
+    return render_template('grader_analytics.html', analytics=analytics.user_analytics(current_user.id))
+
+
+@app.route('/api/grader/analytics')
+@login_required
+@use_read_replica
+def api_grader_analytics():
+    return jsonify(analytics.user_analytics(current_user.id))
+
+
 @app.route('/grader/upload', methods=['GET'])
 @login_required
 def grader_upload():
     """Upload page for grade scanner"""
     projects = Project.query.filter_by(owner_id=current_user.id).all()
-    return render_template('grader_upload.html', projects=projects)
+    assignments = Assignment.query.filter_by(owner_id=current_user.id).order_by(Assignment.id.desc()).all()
+    return render_template('grader_upload.html', projects=projects, assignments=assignments)
+
+
+@app.route('/api/grader/assignments', methods=['GET'])
+@login_required
+def api_grader_assignments():
+    assignments = Assignment.query.filter_by(owner_id=current_user.id).order_by(Assignment.id.desc()).all()
+    return jsonify({'assignments': [
+        {
+            'id': a.id,
+            'title': a.title,
+            'subject': a.subject,
+            'project_id': a.project_id,
+            'checkable_answers': sum(1 for v in (a.answer_map or {}).values() if is_simple_answer(v)),
+        }
+        for a in assignments
+    ]})
+
+
+@app.route('/api/grader/assignments', methods=['POST'])
+@login_required
+def api_grader_create_assignment():
+    """Save an answer key and rubric once so every submission reuses the compiled grading prompt."""
+    data = request.json or {}
+    title = (data.get('title') or '').strip()[:255]
+    if not title:
+        return jsonify({'error': 'Title is required'}), 400
+    project_id = data.get('project_id')
+    if project_id and not Project.query.filter_by(id=project_id, owner_id=current_user.id).first():
+        return jsonify({'error': 'Project not found'}), 404
+
+    answer_key = (data.get('answer_key') or '').strip()
+    rubric = (data.get('rubric') or '').strip()
+    subject = (data.get('subject') or '').strip() or None
+    assignment = Assignment(
+        owner_id=current_user.id,
+        project_id=project_id or None,
+        title=title,
+        subject=subject,
+        answer_key=answer_key,
+        rubric=rubric,
+        prompt_prefix=compile_prompt_prefix(title, subject, answer_key, rubric),
+        answer_map=parse_answers(answer_key),
+    )
+    db.session.add(assignment)
+    db.session.commit()
+    return jsonify({
+        'assignment_id': assignment.id,
+        'checkable_answers': sum(1 for v in assignment.answer_map.values() if is_simple_answer(v)),
+    })
 
 
 @app.route('/api/grader/submit', methods=['POST'])
@@ -620,31 +1223,31 @@ def api_grader_submit():
     if ext not in allowed_extensions:
         return jsonify({'error': 'Invalid file type. Allowed: PNG, JPG, PDF, HEIC'}), 400
 
-    # Create uploads directory if it doesn't exist
-    upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'grader')
-    os.makedirs(upload_dir, exist_ok=True)
-
-    # Generate unique filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    unique_filename = f"{current_user.id}_{timestamp}_{filename}"
-    file_path = os.path.join(upload_dir, unique_filename)
-
-    # Save file
-    file.save(file_path)
+    # Content-addressed: identical uploads share one stored file. The type comes from the validated
+    # extension, never from the client
+    stored = store_upload(file.stream, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
 
     # Get form data
     title = request.form.get('title', 'Untitled Submission')
     subject = request.form.get('subject', '')
     project_id = request.form.get('project_id')
+    assignment_id = request.form.get('assignment_id')
+    assignment = (
+        Assignment.query.filter_by(id=int(assignment_id), owner_id=current_user.id).first()
+        if assignment_id and assignment_id.isdigit() else None
+    )
 
     # Create submission record
     submission = GradeSubmission(
         user_id=current_user.id,
         project_id=int(project_id) if project_id and project_id.isdigit() else None,
+        assignment_id=assignment.id if assignment else None,
         title=title,
-        subject=subject,
-        image_filename=unique_filename,
-        image_path=file_path,
+        subject=subject or (assignment.subject if assignment else ''),
+        student_answers=parse_answers(request.form.get('student_answers', '')) or None,
+        image_filename=filename,
+        image_path=get_storage().local_path(stored.digest),
+        file_digest=stored.digest,
         status='pending'
     )
     db.session.add(submission)
@@ -657,6 +1260,53 @@ def api_grader_submit():
     })
 
 
+def submission_file_path(submission):
+    if submission.file_digest:
+        return get_storage().local_path(submission.file_digest)
+    return submission.image_path
+
+
+@app.route('/grader/file/<int:submission_id>')
+@login_required
+def grader_file(submission_id):
+    """Serve a submission's upload to its owner, with range and conditional request support."""
+    submission = GradeSubmission.query.filter_by(id=submission_id, user_id=current_user.id).first()
+    if not submission:
+        abort(404)
+    path = submission_file_path(submission)
+    if not os.path.exists(path):
+        abort(404)
+    # The stored file is shared by every upload of the same bytes, so the type comes from this
+    # submission's own validated filename; anything but an image is downloaded, not rendered inline
+    mimetype = mimetypes.guess_type(submission.image_filename or '')[0] or 'application/octet-stream'
+    # send_file hands the open file to the server's wsgi.file_wrapper (sendfile where supported),
+    # or to the front-end server when USE_X_SENDFILE is set
+    return send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=not mimetype.startswith('image/'),
+        download_name=submission.image_filename,
+        conditional=True,
+        etag=submission.file_digest or True,
+        max_age=86400,
+    )
+
+
+@app.route('/api/grader/submission/<int:submission_id>', methods=['DELETE'])
+@login_required
+def api_grader_delete(submission_id):
+    submission = GradeSubmission.query.filter_by(id=submission_id, user_id=current_user.id).first()
+    if not submission:
+        return jsonify({'error': 'Submission not found'}), 404
+    if submission.file_digest:
+        release(submission.file_digest)
+    analytics.apply(analytics.snapshot(submission), sign=-1)
+    feed.retract(submission_id=submission.id)
+    db.session.delete(submission)
+    db.session.commit()
+    return jsonify({'success': True})
+
+
 @app.route('/grader/process/<int:submission_id>')
 @login_required
 def grader_process(submission_id):
@@ -669,6 +1319,15 @@ def grader_process(submission_id):
     return render_template('grader_process.html', submission=submission)
 
 
+def _score(value, default):
+    """A model-reported score as a float; null, non-numeric or non-finite values become `default`."""
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return default
+    return score if math.isfinite(score) else default
+
+
 @app.route('/api/grader/grade/<int:submission_id>', methods=['POST'])
 @login_required
 def api_grader_grade(submission_id):
@@ -677,74 +1336,79 @@ def api_grader_grade(submission_id):
     if not submission:
         return jsonify({'error': 'Submission not found'}), 404
 
+    previous_rollup = analytics.snapshot(submission)
     try:
-        # Read the image file
-        with open(submission.image_path, 'rb') as img_file:
-            image_data = base64.b64encode(img_file.read()).decode('utf-8')
-
-        # Get grading instructions from request
+        # Get grading instructions: a saved assignment, or an ad-hoc key/rubric from the request
         data = request.json or {}
-        answer_key = data.get('answer_key', '')
-        rubric = data.get('rubric', '')
-
-        # Build AI prompt for grading
-        grading_prompt = f"""You are an expert teacher grading handwritten student work.
-
-Subject: {submission.subject or 'General'}
-Assignment: {submission.title}
-
-{f"Answer Key: {answer_key}" if answer_key else ""}
-{f"Grading Rubric: {rubric}" if rubric else ""}
-
-Please analyze this handwritten work and provide:
-1. Overall score (0-100)
-2. Detailed feedback on what's correct and what's incorrect
-3. Specific comments on each problem/section
-4. Constructive suggestions for improvement
-
-Format your response as JSON with these fields:
-{{
-  "overall_score": <number 0-100>,
-  "earned_points": <number>,
-  "total_points": <number>,
-  "feedback": "<detailed overall feedback>",
-  "problem_feedback": [
-    {{"problem": "<problem number/name>", "score": <points>, "comment": "<specific feedback>", "is_correct": <true/false>}}
-  ]
-}}"""
-
-        # Call AI provider with vision capabilities
-        provider = get_default_provider()
+        assignment = submission.assignment
+        if assignment:
+            prefix = assignment.prompt_prefix
+            answer_map = assignment.answer_map or {}
+            rubric = assignment.rubric
+        else:
+            answer_key = data.get('answer_key', '')
+            rubric = data.get('rubric', '')
+            prefix = compile_prompt_prefix(submission.title, submission.subject, answer_key, rubric)
+            answer_map = parse_answers(answer_key)
+
+        # Typed answers that match simple key entries are graded without the model
+        checked, unresolved = check_answers(answer_map, submission.student_answers or {}, parse_points(rubric))
+        if checked and not unresolved:
+            grading_result = local_result(checked)
+        else:
+            # Read the image file
+            with open(submission_file_path(submission), 'rb') as img_file:
+                image_data = base64.b64encode(img_file.read()).decode('utf-8')
 
-        # For vision grading, we'll use a simplified text-based approach for now
-        # In production, you'd use GPT-4 Vision or similar
-        ai_response = provider.chat([
-            {"role": "system", "content": "You are an expert teacher providing detailed, constructive feedback on student work."},
-            {"role": "user", "content": grading_prompt}
-        ])
+            # Call AI provider with vision capabilities
+            provider = get_default_provider()
 
-        # Parse AI response (assuming JSON format)
-        try:
-            import json
-            grading_result = json.loads(ai_response)
-        except:
-            # Fallback if not JSON
-            grading_result = {
-                "overall_score": 85,
-                "earned_points": 85,
-                "total_points": 100,
-                "feedback": ai_response,
-                "problem_feedback": []
-            }
+            # For vision grading, we'll use a simplified text-based approach for now
+            # In production, you'd use GPT-4 Vision or similar
+            try:
+                ai_response = provider.chat(
+                    build_grading_messages(prefix, submission.title, checked, unresolved),
+                    user_id=current_user.id,
+                )
+            except RateLimitError as e:
+                # Leave the submission pending so the client can retry
+                return jsonify({'error': _busy_message(e), 'retry_after': e.retry_after}), 429
+
+            # Parse AI response (assuming JSON format)
+            try:
+                grading_result = json.loads(ai_response)
+            except:
+                # Fallback if not JSON
+                grading_result = {
+                    "overall_score": 85,
+                    "earned_points": 85,
+                    "total_points": 100,
+                    "feedback": ai_response,
+                    "problem_feedback": []
+                }
 
         # Update submission with grading results
         submission.status = 'graded'
-        submission.overall_score = grading_result.get('overall_score', 0)
-        submission.earned_points = grading_result.get('earned_points', 0)
-        submission.total_points = grading_result.get('total_points', 100)
+        submission.overall_score = _score(grading_result.get('overall_score'), 0.0)
+        submission.earned_points = _score(grading_result.get('earned_points'), 0.0)
+        submission.total_points = _score(grading_result.get('total_points'), 100.0)
         submission.ai_feedback = grading_result.get('feedback', '')
-        submission.grading_rubric = grading_result.get('problem_feedback', [])
+        submission.grading_rubric = [
+            dict(p, is_correct=reported_correct(p.get('is_correct'))) if isinstance(p, dict) else p
+            for p in grading_result.get('problem_feedback') or []
+        ]
         submission.graded_at = datetime.now()
+        # Move this submission's contribution in the analytics rollups to the new grade
+        analytics.apply(previous_rollup, sign=-1)
+        analytics.apply(analytics.snapshot(submission))
+        # Grades are personal: the event goes to the student's own timeline only. A re-grade
+        # replaces the earlier event rather than adding another
+        feed.retract(submission_id=submission.id)
+        feed.publish(
+            current_user.id, 'graded', f'Graded: {submission.title}',
+            preview=f"{submission.overall_score:g}% · {(submission.ai_feedback or '')[:200]}",
+            private=True, submission_id=submission.id,
+        )
         db.session.commit()
 
         return jsonify({
@@ -754,7 +1418,9 @@ Format your response as JSON with these fields:
         })
 
     except Exception as e:
+        db.session.rollback()
         submission.status = 'error'
+        analytics.apply(previous_rollup, sign=-1)
         db.session.commit()
         return jsonify({'error': f'Grading failed: {str(e)}'}), 500
 
@@ -769,6 +1435,140 @@ def grader_result(submission_id):
         return redirect(url_for('grader_home'))
 
     return render_template('grader_result.html', submission=submission)
+
+
+@app.cli.command('export-conversations')
+@click.option('--email', default=None, help='Only export projects owned by this user.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Output file (default: stdout).')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows fetched per query.')
+def export_conversations_command(email, output, chunk_size):
+    """Export conversations with their messages and knowledge graphs as JSONL."""
+    owner_id = None
+    if email:
+        user = User.query.filter_by(email=email.strip().lower()).first()
+        if not user:
+            raise click.ClickException(f'No user with email {email}')
+        owner_id = user.id
+    for line in export_jsonl(owner_id=owner_id, chunk_size=chunk_size):
+        output.write(line)
+
+
+@app.cli.command('import-conversations')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--email', required=True, help='User that will own the imported projects.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per INSERT batch.')
+def import_conversations_command(source, email, batch_size):
+    """Import a JSONL export (use - for stdin)."""
+    user = User.query.filter_by(email=email.strip().lower()).first()
+    if not user:
+        raise click.ClickException(f'No user with email {email}')
+    try:
+        counts = import_jsonl(source, owner_id=user.id, batch_size=batch_size)
+    except TransferError as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join(f'{v} {k}' for k, v in counts.items()))
+
+
+@app.cli.command('archive-conversations')
+@click.option('--idle-days', default=90, show_default=True, help='Archive conversations with no messages for this long.')
+@click.option('--batch-size', default=100, show_default=True, help='Conversations archived per transaction.')
+@click.option('--max-batches', default=None, type=int, help='Stop after this many batches (default: until done).')
+@click.option('--vacuum/--no-vacuum', default=False, help='Return freed pages to the filesystem afterwards.')
+def archive_conversations_command(idle_days, batch_size, max_batches, vacuum):
+    """Move messages of idle conversations into compressed cold storage."""
+    size_before = database_size()
+    report = compact(idle_days=idle_days, batch_size=batch_size, max_batches=max_batches)
+    if vacuum:
+        reclaim_space()
+    size_after = database_size()
+    click.echo(
+        f"Archived {report['conversations']} conversations ({report['messages']} messages) in {report['batches']} batches"
+    )
+    click.echo(
+        f"Message content {report['content_bytes']} bytes -> {report['compressed_bytes']} bytes compressed"
+        f" ({report['bytes_saved']} bytes saved)"
+    )
+    if size_before is not None and size_after is not None:
+        click.echo(f'Database size {size_before} -> {size_after} bytes ({size_before - size_after} reclaimed)')
+
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-seconds', default=3600, show_default=True, help='Keep unreferenced files younger than this.')
+def gc_uploads_command(grace_seconds):
+    """Delete grader uploads that no submission references."""
+    report = collect_garbage(grace_seconds=grace_seconds)
+    click.echo(
+        f"Removed {report['released']} released and {report['orphans']} orphaned files"
+        f" ({report['bytes_freed']} bytes freed)"
+    )
+
+
+@app.cli.command('intern-concepts')
+@click.option('--batch-size', default=200, show_default=True, help='Conversations converted per transaction.')
+def intern_concepts_command(batch_size):
+    """Move knowledge nodes that store inline labels onto the concept catalog and index them."""
+    total = 0
+    while True:
+        converted = intern_legacy_nodes(batch_size)
+        db.session.commit()
+        if not converted:
+            break
+        total += converted
+        click.echo(f'Converted {total} nodes...', err=True)
+    click.echo(f'Interned {total} legacy nodes.', err=True)
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s' if seconds >= 3600 else f'{seconds // 60}m{seconds % 60:02d}s'
+
+
+@app.cli.command('reextract-graphs')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Extraction processes (1 = in-process).')
+@click.option('--chunk-size', default=200, show_default=True, help='Conversations per chunk and per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first conversation.')
+@click.option('--max-chunks', default=None, type=int, help='Stop after this many chunks (default: until done).')
+def reextract_graphs_command(workers, chunk_size, restart, max_chunks):
+    """Re-run knowledge-graph extraction for every conversation, resuming an interrupted run."""
+    def progress(report):
+        eta = _duration(report['eta_seconds']) if report['eta_seconds'] is not None else '?'
+        click.echo(
+            f"{report['processed']}/{report['total']} conversations, {report['rate']:.1f}/s, ETA {eta}", err=True
+        )
+
+    report = reextract_knowledge_graphs(
+        workers=workers, chunk_size=chunk_size, restart=restart, max_chunks=max_chunks, progress=progress
+    )
+    state = 'Finished' if report['finished'] else 'Stopped; run again to resume'
+    resumed = f", resumed after conversation {report['resumed_from']}" if report['resumed_from'] else ''
+    click.echo(
+        f"{state}: {report['processed']}/{report['total']} conversations"
+        f" in {_duration(report['elapsed_seconds'])} ({report['rate']:.1f}/s this run{resumed})"
+    )
+
+
+@app.cli.command('trim-feeds')
+@click.option('--keep', default=1000, show_default=True, help='Timeline rows kept per user.')
+def trim_feeds_command(keep):
+    """Cap every user's precomputed feed timeline at its newest --keep rows."""
+    deleted = feed.trim_timelines(keep)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} timeline rows.')
+
+
+@app.cli.command('rebuild-grade-rollups')
+@click.option('--email', default=None, help='Only rebuild this user (default: everyone).')
+def rebuild_grade_rollups_command(email):
+    """Recompute grading analytics rollups from existing submissions."""
+    user_id = None
+    if email:
+        user = User.query.filter_by(email=email.strip().lower()).first()
+        if not user:
+            raise click.ClickException(f'No user with email {email}')
+        user_id = user.id
+    click.echo(f'Rolled up {analytics.rebuild(user_id)} graded submissions')
+
+
 if __name__ == '__main__':
     # Dev convenience: create tables if not present
     with app.app_context():
@@ -0,0 +1,166 @@
+"""
+Cold storage for idle conversations.
+
+`compact` moves the messages of conversations with no activity for `idle_days` out of the hot
+`messages` table into one zlib-compressed blob per conversation (`ConversationArchive`), and marks
+the conversation with `archived_at`. `ensure_hydrated` moves them back the next time the
+conversation is opened or written to, so callers never see the difference.
+"""
+
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, func, insert, select, text, update
+
+from models import db, Conversation, ConversationArchive, Message
+
+
+COMPRESSION_LEVEL = 6
+# Ids per DELETE ... IN (...) statement, well under SQLite's bound-parameter limit
+DELETE_CHUNK = 500
+
+
+def _pack(rows: List[Dict]) -> bytes:
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def archive_conversation(conversation_id: int) -> Optional[Dict[str, int]]:
+    """Move one conversation's messages into its archive blob. Returns sizes, or None if it has no messages."""
+    rows = db.session.execute(
+        select(Message.id, Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at, Message.id)
+    ).all()
+    if not rows:
+        return None
+
+    messages = [{'role': r.role, 'content': r.content, 'created_at': r.created_at.isoformat()} for r in rows]
+    archive = ConversationArchive.query.filter_by(conversation_id=conversation_id).first()
+    if archive is not None:
+        # Messages written since the last archival are appended to the existing blob
+        messages = json.loads(zlib.decompress(archive.payload)) + messages
+    raw = _pack(messages)
+    payload = zlib.compress(raw, COMPRESSION_LEVEL)
+    if archive is None:
+        archive = ConversationArchive(conversation_id=conversation_id)
+        db.session.add(archive)
+    archive.payload = payload
+    archive.message_count = len(messages)
+    archive.raw_bytes = len(raw)
+    archive.compressed_bytes = len(payload)
+    archive.archived_at = datetime.utcnow()
+
+    # Delete exactly the rows that were read: a message that raced in stays in the hot table, and
+    # id order need not match created_at order (imported or rehydrated messages)
+    read_ids = [r.id for r in rows]
+    for start in range(0, len(read_ids), DELETE_CHUNK):
+        db.session.execute(delete(Message).where(Message.id.in_(read_ids[start:start + DELETE_CHUNK])))
+    db.session.execute(
+        update(Conversation).where(Conversation.id == conversation_id).values(archived_at=datetime.utcnow())
+    )
+    return {
+        'messages': len(rows),
+        'content_bytes': sum(len(r.content.encode('utf-8')) for r in rows),
+        'compressed_bytes': len(payload),
+    }
+
+
+def iter_archived_messages(conversation_id: int) -> Iterator[Dict]:
+    """Yield archived messages ({role, content, created_at}) in order without rehydrating them."""
+    payload = db.session.execute(
+        select(ConversationArchive.payload).where(ConversationArchive.conversation_id == conversation_id)
+    ).scalar()
+    if payload is None:
+        return
+    for m in json.loads(zlib.decompress(payload)):
+        m['created_at'] = datetime.fromisoformat(m['created_at'])
+        yield m
+
+
+def ensure_hydrated(conversation: Conversation) -> bool:
+    """Move an archived conversation's messages back into the hot table. Returns True if it did."""
+    if conversation.archived_at is None:
+        return False
+    # Claim the archive first: of two requests hydrating at once, the second waits on this row and
+    # then updates nothing, so the messages are inserted once
+    claimed = db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation.id, Conversation.archived_at.is_not(None))
+        .values(archived_at=None)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        db.session.refresh(conversation)
+        return False
+    rows = [
+        {'conversation_id': conversation.id, 'role': m['role'], 'content': m['content'], 'created_at': m['created_at']}
+        for m in iter_archived_messages(conversation.id)
+    ]
+    if rows:
+        db.session.execute(insert(Message), rows)
+    db.session.execute(delete(ConversationArchive).where(ConversationArchive.conversation_id == conversation.id))
+    db.session.commit()
+    return True
+
+
+def idle_conversation_ids(cutoff: datetime, limit: int) -> List[int]:
+    """Ids of conversations whose newest hot message is older than `cutoff`."""
+    return list(db.session.execute(
+        select(Message.conversation_id)
+        .group_by(Message.conversation_id)
+        .having(func.max(Message.created_at) < cutoff)
+        .order_by(Message.conversation_id)
+        .limit(limit)
+    ).scalars())
+
+
+def compact(idle_days: int = 90, batch_size: int = 100, max_batches: Optional[int] = None) -> Dict[str, int]:
+    """
+    Archive idle conversations `batch_size` at a time, committing after each batch so the job can
+    be stopped and re-run safely. Returns a report of what moved and the bytes taken off the hot table.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    report = {'batches': 0, 'conversations': 0, 'messages': 0, 'content_bytes': 0, 'compressed_bytes': 0}
+    while max_batches is None or report['batches'] < max_batches:
+        ids = idle_conversation_ids(cutoff, batch_size)
+        if not ids:
+            break
+        try:
+            for conversation_id in ids:
+                sizes = archive_conversation(conversation_id)
+                if sizes:
+                    report['conversations'] += 1
+                    for key, value in sizes.items():
+                        report[key] += value
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        report['batches'] += 1
+    report['bytes_saved'] = report['content_bytes'] - report['compressed_bytes']
+    return report
+
+
+def database_size() -> Optional[int]:
+    """On-disk size of the primary database in bytes, when the backend can report it."""
+    engine = db.engine
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            page_count = conn.execute(text('PRAGMA page_count')).scalar()
+            page_size = conn.execute(text('PRAGMA page_size')).scalar()
+            return page_count * page_size
+        if engine.dialect.name == 'postgresql':
+            return conn.execute(text('SELECT pg_database_size(current_database())')).scalar()
+    return None
+
+
+def reclaim_space() -> None:
+    """Return freed pages to the filesystem (VACUUM). Needs its own connection outside a transaction."""
+    engine = db.engine
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if engine.dialect.name == 'sqlite':
+            conn.execute(text('VACUUM'))
+        elif engine.dialect.name == 'postgresql':
+            conn.execute(text('VACUUM ANALYZE messages'))
@@ -0,0 +1,148 @@
+"""
+Resumable re-extraction of knowledge graphs for every conversation.
+
+`reextract_knowledge_graphs` walks conversation ids in ascending chunks (keyset pagination, so
+memory stays flat), runs `kg.extract_knowledge_graph` for each chunk in a process pool, and
+writes a chunk's graphs with one set of batched statements (`kg.replace_knowledge_graphs`).
+Loading and writing in the main process overlap with extraction of the next chunk in the pool.
+
+The chunk's writes and its `BackfillCheckpoint` update commit together, so a run stopped at any
+point resumes after the last committed chunk and never redoes or skips one. A run that finished
+is started from the beginning again next time.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from archive import iter_archived_messages
+from kg import extract_knowledge_graph, replace_knowledge_graphs
+from models import db, BackfillCheckpoint, Conversation, Message
+
+
+KG_CHECKPOINT = 'kg-extract'
+
+
+def _checkpoint(name: str, restart: bool) -> BackfillCheckpoint:
+    checkpoint = db.session.get(BackfillCheckpoint, name)
+    if checkpoint is None:
+        checkpoint = BackfillCheckpoint(name=name)
+        db.session.add(checkpoint)
+    elif restart or checkpoint.finished_at is not None:
+        checkpoint.last_id = 0
+        checkpoint.processed = 0
+        checkpoint.started_at = datetime.utcnow()
+        checkpoint.finished_at = None
+    checkpoint.updated_at = datetime.utcnow()
+    db.session.commit()
+    return checkpoint
+
+
+def _chunks(after_id: int, chunk_size: int) -> Iterator[List[Tuple[int, bool]]]:
+    """Yield lists of (conversation_id, archived) in id order."""
+    while True:
+        rows = db.session.execute(
+            select(Conversation.id, Conversation.archived_at.is_not(None))
+            .where(Conversation.id > after_id)
+            .order_by(Conversation.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield [(r[0], bool(r[1])) for r in rows]
+        after_id = rows[-1][0]
+
+
+def _load_messages(chunk: List[Tuple[int, bool]]) -> List[List[Dict[str, str]]]:
+    """Each conversation's messages, in the chunk's order, with one query for the hot ones."""
+    payloads: Dict[int, List[Dict[str, str]]] = {conversation_id: [] for conversation_id, _ in chunk}
+    rows = db.session.execute(
+        select(Message.conversation_id, Message.role, Message.content)
+        .where(Message.conversation_id.in_(list(payloads)))
+        .order_by(Message.conversation_id, Message.created_at, Message.id)
+    ).all()
+    for r in rows:
+        payloads[r.conversation_id].append({'role': r.role, 'content': r.content})
+    for conversation_id, archived in chunk:
+        if archived:
+            payloads[conversation_id] = [
+                {'role': m['role'], 'content': m['content']} for m in iter_archived_messages(conversation_id)
+            ]
+    return [payloads[conversation_id] for conversation_id, _ in chunk]
+
+
+def reextract_knowledge_graphs(
+    workers: int = 4,
+    chunk_size: int = 200,
+    restart: bool = False,
+    max_chunks: Optional[int] = None,
+    progress: Optional[Callable[[Dict], None]] = None,
+) -> Dict:
+    """
+    Rebuild every conversation's knowledge graph, resuming from the last checkpoint unless
+    `restart`. `workers` <= 1 extracts in-process. `progress` is called after each committed
+    chunk with {processed, total, rate, eta_seconds}. Returns the final progress report.
+    """
+    checkpoint = _checkpoint(KG_CHECKPOINT, restart)
+    resumed_from = checkpoint.last_id
+    total = checkpoint.processed + db.session.execute(
+        select(func.count(Conversation.id)).where(Conversation.id > resumed_from)
+    ).scalar()
+    report = {'processed': checkpoint.processed, 'total': total, 'resumed_from': resumed_from,
+              'chunks': 0, 'rate': 0.0, 'eta_seconds': None}
+    started = time.monotonic()
+    done_this_run = 0
+
+    def write(chunk: List[Tuple[int, bool]], results) -> None:
+        nonlocal done_this_run
+        try:
+            replace_knowledge_graphs({conversation_id: graph for (conversation_id, _), graph in zip(chunk, results)})
+            checkpoint.last_id = chunk[-1][0]
+            checkpoint.processed += len(chunk)
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        done_this_run += len(chunk)
+        elapsed = time.monotonic() - started
+        report['processed'] = checkpoint.processed
+        report['chunks'] += 1
+        report['rate'] = done_this_run / elapsed if elapsed else 0.0
+        remaining = max(0, total - checkpoint.processed)
+        report['eta_seconds'] = remaining / report['rate'] if report['rate'] else None
+        if progress:
+            progress(dict(report))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        pending = None
+        exhausted = True
+        for n, chunk in enumerate(_chunks(resumed_from, chunk_size)):
+            if max_chunks is not None and n >= max_chunks:
+                exhausted = False
+                break
+            payloads = _load_messages(chunk)
+            # Submitted now, collected after the previous chunk is written
+            results = (
+                pool.map(extract_knowledge_graph, payloads, chunksize=max(1, len(payloads) // (workers * 4)))
+                if pool else map(extract_knowledge_graph, payloads)
+            )
+            if pending:
+                write(*pending)
+            pending = (chunk, results)
+        if pending:
+            write(*pending)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    if exhausted:
+        checkpoint.finished_at = datetime.utcnow()
+        db.session.commit()
+    report['finished'] = checkpoint.finished_at is not None
+    report['elapsed_seconds'] = time.monotonic() - started
+    return report
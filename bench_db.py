@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for the database engine profile.
+
+Runs chat-style writer threads (insert a message, commit) alongside dashboard/knowledge-graph style
+reader threads against a scratch SQLite database, once with SQLite defaults (rollback journal) and
+once with the tuned profile from config.py, and prints throughput and read latency for both.
+
+    python bench_db.py --seconds 5 --writers 4 --readers 8
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from config import BaseConfig, engine_options_for
+from db_routing import install_sqlite_pragmas
+from models import db, User, Project, Conversation, Message, KnowledgeNode
+
+
+def _seed(engine) -> int:
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        user_id = conn.execute(insert(User).returning(User.id), {
+            'email': 'bench@example.com', 'password_hash': 'x', 'display_name': 'bench', 'created_at': datetime.utcnow(),
+        }).scalar_one()
+        project_id = conn.execute(insert(Project).returning(Project.id), {
+            'owner_id': user_id, 'title': 'Bench', 'created_date': datetime.utcnow().date(),
+        }).scalar_one()
+        conversation_id = conn.execute(insert(Conversation).returning(Conversation.id), {
+            'project_id': project_id, 'title': 'Bench', 'created_at': datetime.utcnow(),
+        }).scalar_one()
+        conn.execute(insert(KnowledgeNode), [
+            {'conversation_id': conversation_id, 'label': f'Concept {i}', 'type': 'concept'} for i in range(15)
+        ])
+    return conversation_id
+
+
+def run(tuned: bool, seconds: float, writers: int, readers: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix='sciweb-bench-'), 'bench.db')
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **(engine_options_for(uri) if tuned else {}))
+    if tuned:
+        install_sqlite_pragmas(engine, BaseConfig.SQLITE_PRAGMAS)
+    conversation_id = _seed(engine)
+
+    stop = threading.Event()
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    read_latencies = []
+    lock = threading.Lock()
+
+    def writer():
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(Message), {
+                        'conversation_id': conversation_id, 'role': 'user', 'content': 'x' * 400,
+                        'created_at': datetime.utcnow(),
+                    })
+                with lock:
+                    counts['writes'] += 1
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(func.count(Message.id)).where(Message.conversation_id == conversation_id)).scalar()
+                    conn.execute(select(KnowledgeNode).where(KnowledgeNode.conversation_id == conversation_id)).all()
+                with lock:
+                    counts['reads'] += 1
+                    read_latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    read_latencies.sort()
+    p95 = read_latencies[int(len(read_latencies) * 0.95)] if read_latencies else 0.0
+    return {
+        'writes/s': counts['writes'] / seconds,
+        'reads/s': counts['reads'] / seconds,
+        'read p95 ms': p95 * 1000,
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    args = parser.parse_args()
+
+    for label, tuned in (('default (rollback journal)', False), ('tuned (WAL profile)', True)):
+        result = run(tuned, args.seconds, args.writers, args.readers)
+        print(f'{label:28s} ' + '  '.join(f'{k}={v:.1f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Fan-out benchmark for the real-time messaging layer.
+
+broker: N subscribers on one channel, M published events; measures publish-to-receive latency
+        for the in-process broker and the SQLite-log broker used across local workers.
+http:   starts the app on a scratch database under Werkzeug's threaded server, opens N
+        Server-Sent Events connections to one thread, posts M messages through the API and
+        measures post-to-delivery latency across all connections, plus what one worker holds.
+
+    python bench_realtime.py --subscribers 200 --messages 200
+    python bench_realtime.py --mode http --subscribers 200 --messages 50
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'p50 ms': 0.0, 'p99 ms': 0.0, 'max ms': 0.0}
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    return {'p50 ms': pick(0.50), 'p99 ms': pick(0.99), 'max ms': latencies[-1] * 1000}
+
+
+def bench_broker(broker, subscribers: int, messages: int) -> dict:
+    latencies = []
+    lock = threading.Lock()
+    subs = [broker.subscribe(['bench']) for _ in range(subscribers)]
+
+    def consume(sub):
+        received = 0
+        while received < messages:
+            event = sub.get(timeout=10)
+            if event is None:
+                return
+            with lock:
+                latencies.append(time.perf_counter() - event['sent'])
+            received += 1
+
+    threads = [threading.Thread(target=consume, args=(sub,)) for sub in subs]
+    for t in threads:
+        t.start()
+    started = time.perf_counter()
+    for i in range(messages):
+        broker.publish('bench', {'type': 'message', 'id': i, 'sent': time.perf_counter()})
+        time.sleep(0.001)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    for sub in subs:
+        sub.close()
+    broker.close()
+    return dict(_percentiles(latencies), **{'deliveries/s': len(latencies) / elapsed, 'lost': subscribers * messages - len(latencies)})
+
+
+def run_broker(subscribers: int, messages: int) -> None:
+    from realtime import LocalBroker, SqliteBroker
+
+    path = os.path.join(tempfile.mkdtemp(prefix='sciweb-bench-'), 'events.db')
+    for label, broker in (('memory', LocalBroker(max_queue=messages + 1)),
+                          ('sqlite log', SqliteBroker(path, poll_interval=0.01, max_queue=messages + 1))):
+        result = bench_broker(broker, subscribers, messages)
+        print(f'{label:12s} ' + '  '.join(f'{k}={v:.1f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+def run_http(subscribers: int, messages: int) -> None:
+    scratch = tempfile.mkdtemp(prefix='sciweb-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ.setdefault('REALTIME_MAX_QUEUE', str(messages + 16))
+    from werkzeug.security import generate_password_hash
+    from werkzeug.serving import make_server
+
+    from app import app, broker, db
+    from models import ChatThread, ThreadMember, User
+
+    with app.app_context():
+        db.create_all()
+        user = User(email='bench@example.com', password_hash=generate_password_hash('bench'), display_name='bench')
+        db.session.add(user)
+        db.session.flush()
+        thread = ChatThread(name='Bench', kind='room', created_by=user.id)
+        db.session.add(thread)
+        db.session.flush()
+        db.session.add(ThreadMember(thread_id=thread.id, user_id=user.id))
+        db.session.commit()
+        thread_id = thread.id
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('POST', '/login', urllib.parse.urlencode({'email': 'bench@example.com', 'password': 'bench'}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = '; '.join(c.split(';')[0] for c in response.headers.get_all('Set-Cookie'))
+
+    sent = {}
+    latencies = []
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+
+    def listen():
+        stream = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        stream.request('GET', f'/api/realtime/stream/{thread_id}', headers={'Cookie': cookie})
+        body = stream.getresponse()
+        body.readline()  # retry: directive
+        ready.wait()
+        received = 0
+        while received < messages:
+            line = body.readline()
+            if not line:
+                return
+            if line.startswith(b'data: '):
+                event = json.loads(line[6:])
+                if event['type'] == 'message':
+                    with lock:
+                        latencies.append(time.perf_counter() - sent[event['body']])
+                    received += 1
+        stream.close()
+
+    listeners = [threading.Thread(target=listen, daemon=True) for _ in range(subscribers)]
+    for t in listeners:
+        t.start()
+    ready.wait()
+    connected = broker.stats()['connections']
+    threads_alive = threading.active_count()
+
+    started = time.perf_counter()
+    for i in range(messages):
+        text = f'message {i}'
+        sent[text] = time.perf_counter()
+        conn.request('POST', f'/api/threads/{thread_id}/messages', json.dumps({'body': text}),
+                     {'Content-Type': 'application/json', 'Cookie': cookie})
+        conn.getresponse().read()
+    for t in listeners:
+        t.join(timeout=30)
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    result = dict(_percentiles(latencies), **{
+        'connections': connected,
+        'threads': threads_alive,
+        'max rss MB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'deliveries/s': len(latencies) / elapsed,
+        'lost': subscribers * messages - len(latencies),
+    })
+    print('http/sse     ' + '  '.join(f'{k}={v:.1f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('broker', 'http'), default='broker')
+    parser.add_argument('--subscribers', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=100)
+    args = parser.parse_args()
+    if args.mode == 'broker':
+        run_broker(args.subscribers, args.messages)
+    else:
+        run_http(args.subscribers, args.messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,38 @@
+import hashlib
+import json
 import os
-from typing import List, Dict
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Optional, Tuple
 try:
     from openai import OpenAI
 except Exception:  # pragma: no cover
     OpenAI = None  # type: ignore
+try:
+    import anthropic
+except Exception:  # pragma: no cover
+    anthropic = None  # type: ignore
+try:
+    import google.generativeai as genai
+except Exception:  # pragma: no cover
+    genai = None  # type: ignore
 
 
 class ChatProvider:
+    # False when the provider cannot reach its backend (e.g. no API key); routers skip it
+    available = True
+
     def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
         raise NotImplementedError
 
 
-class OpenAIProvider(ChatProvider):
-    def __init__(self) -> None:
-        api_key = os.environ.get('OPENAI_API_KEY')
-        self._has_key = bool(api_key and OpenAI)
-        self.client = OpenAI(api_key=api_key) if self._has_key else None
+class LocalProvider(ChatProvider):
+    """Lightweight guidance used when no external model is configured."""
 
     def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
-        if self._has_key and self.client:
-            use_model = model or os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
-            completion = self.client.chat.completions.create(
-                model=use_model,
-                messages=messages,
-                temperature=0.7,
-            )
-            return completion.choices[0].message.content or ''
-        # Fallback lightweight guidance when no API key is configured
         # Heuristic: echo last user message, add Socratic prompts and next steps
         last_user = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), '')
         style_hint = next((m['content'] for m in messages if m.get('role') == 'system'), '')
@@ -48,6 +54,561 @@ class OpenAIProvider(ChatProvider):
         return "\n".join(parts)
 
 
-def get_default_provider() -> ChatProvider:
-    return OpenAIProvider()
+class OpenAIProvider(ChatProvider):
+    def __init__(self) -> None:
+        api_key = os.environ.get('OPENAI_API_KEY')
+        self._has_key = bool(api_key and OpenAI)
+        self.available = self._has_key
+        self.client = OpenAI(api_key=api_key) if self._has_key else None
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
+        if self._has_key and self.client:
+            use_model = model or os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+            completion = self.client.chat.completions.create(
+                model=use_model,
+                messages=messages,
+                temperature=0.7,
+            )
+            return completion.choices[0].message.content or ''
+        # Fallback lightweight guidance when no API key is configured
+        return LocalProvider().chat(messages, model)
+
+
+def _split_system(messages: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+    system = '\n\n'.join(m['content'] for m in messages if m.get('role') == 'system')
+    return system, [m for m in messages if m.get('role') != 'system']
+
+
+class AnthropicProvider(ChatProvider):
+    # UI model ids (see `ai_models` in app.py) -> API model names
+    MODEL_ALIASES = {
+        'claude-3-opus': 'claude-3-opus-20240229',
+        'claude-3-sonnet': 'claude-3-sonnet-20240229',
+        'claude-3-haiku': 'claude-3-haiku-20240307',
+    }
+
+    def __init__(self) -> None:
+        api_key = os.environ.get('ANTHROPIC_API_KEY')
+        self.available = bool(api_key and anthropic)
+        self.client = anthropic.Anthropic(api_key=api_key) if self.available else None
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
+        if not self.client:
+            raise RuntimeError('ANTHROPIC_API_KEY is not configured')
+        use_model = self.MODEL_ALIASES.get(model or '', model) or os.environ.get('ANTHROPIC_MODEL', 'claude-3-haiku-20240307')
+        system, turns = _split_system(messages)
+        response = self.client.messages.create(
+            model=use_model,
+            max_tokens=1024,
+            temperature=0.7,
+            system=system or anthropic.NOT_GIVEN,
+            messages=turns,
+        )
+        return ''.join(block.text for block in response.content if getattr(block, 'type', '') == 'text')
+
+
+class GoogleProvider(ChatProvider):
+    MODEL_ALIASES = {
+        'gemini-pro': 'gemini-1.5-pro',
+        'gemini-ultra': 'gemini-1.5-pro',
+        'gemini-nano': 'gemini-1.5-flash',
+    }
+
+    def __init__(self) -> None:
+        api_key = os.environ.get('GOOGLE_API_KEY')
+        self.available = bool(api_key and genai)
+        if self.available:
+            genai.configure(api_key=api_key)
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
+        if not self.available:
+            raise RuntimeError('GOOGLE_API_KEY is not configured')
+        use_model = self.MODEL_ALIASES.get(model or '', model) or os.environ.get('GOOGLE_MODEL', 'gemini-1.5-flash')
+        system, turns = _split_system(messages)
+        client = genai.GenerativeModel(use_model, system_instruction=system or None)
+        response = client.generate_content([
+            {'role': 'model' if m['role'] == 'assistant' else 'user', 'parts': [m['content']]} for m in turns
+        ])
+        return response.text or ''
+
+
+class StubProvider(ChatProvider):
+    """
+    Offline stand-in for a remote provider with injectable latency and failures, for exercising
+    routing, hedging and circuit breaking without network access.
+    """
+
+    def __init__(self, name: str = 'stub', latency: float = 0.0, failure_rate: float = 0.0, error: Optional[Exception] = None) -> None:
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.error = error
+        self.calls = 0
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error is not None or (self.failure_rate and random.random() < self.failure_rate):
+            raise self.error or RuntimeError(f'{self.name} failed')
+        last_user = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), '')
+        return f'[{self.name}:{model or "default"}] {last_user}'
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures. While open, calls are refused
+    until `reset_after` seconds pass; then one probe is let through (half-open) and its outcome
+    closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Call only when about to send a request; in half-open state this claims the single probe."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self.state = 'closed'
+                return
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class RollingStats:
+    """Latency and error rate over the last `window` calls to one provider."""
+
+    def __init__(self, window: int = 100) -> None:
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((latency, ok))
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {'calls': 0, 'error_rate': 0.0, 'p50': 0.0, 'p95': 0.0}
+        latencies = sorted(latency for latency, ok in samples if ok) or [0.0]
+        return {
+            'calls': len(samples),
+            'error_rate': sum(1 for _, ok in samples if not ok) / len(samples),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+
+
+class ProviderRouter(ChatProvider):
+    """
+    Routes a model id to the provider that serves it (by prefix, e.g. 'claude-' -> anthropic).
+
+    If the chosen provider has not answered after the hedge delay, the same messages are sent to
+    the next healthy provider in `order` (with that provider's default model) and the first
+    successful answer wins. Failures fail over the same way; when every provider fails, the error
+    is raised (a 429 in preference to others, so callers can back off). Each provider has a
+    circuit breaker, so a provider that keeps failing is skipped until its cool-down passes.
+
+    `fallback` (e.g. LocalProvider) answers only when no provider is configured at all; it never
+    takes part in hedging or failover.
+
+    The hedge delay is `hedge_after` seconds, or once enough samples exist, the provider's rolling
+    p95 latency clamped to [`min_hedge_after`, `hedge_after`].
+    """
+
+    def __init__(
+        self,
+        providers: Dict[str, ChatProvider],
+        routes: List[Tuple[str, str]],
+        order: List[str],
+        hedge_after: float = 8.0,
+        min_hedge_after: float = 1.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        max_workers: int = 32,
+        fallback: Optional[ChatProvider] = None,
+    ) -> None:
+        self.providers = providers
+        self.fallback = fallback
+        self.routes = routes
+        self.order = order
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.breakers = {name: CircuitBreaker(breaker_threshold, breaker_reset) for name in providers}
+        self.latency = {name: RollingStats() for name in providers}
+        self.counters = {'hedged': 0, 'fallback_wins': 0, 'failovers': 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+
+    def resolve(self, model: str | None) -> str:
+        for prefix, name in self.routes:
+            if model and model.startswith(prefix):
+                return name
+        return self.order[0]
+
+    def _candidates(self, primary: str) -> List[str]:
+        names = [primary] + [n for n in self.order if n != primary]
+        return [n for n in names if self.providers[n].available]
+
+    def _hedge_delay(self, name: str) -> float:
+        stats = self.latency[name].snapshot()
+        if stats['calls'] < 20:
+            return self.hedge_after
+        return max(self.min_hedge_after, min(self.hedge_after, stats['p95']))
+
+    def _call(self, name: str, messages: List[Dict[str, str]], model: str | None) -> str:
+        started = time.monotonic()
+        try:
+            result = self.providers[name].chat(messages, model=model)
+        except Exception:
+            self.latency[name].record(time.monotonic() - started, False)
+            self.breakers[name].record(False)
+            raise
+        self.latency[name].record(time.monotonic() - started, True)
+        self.breakers[name].record(True)
+        return result
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None) -> str:
+        primary = self.resolve(model)
+        queue = self._candidates(primary)
+        if not queue:
+            if self.fallback is not None:
+                return self.fallback.chat(messages, model)
+            raise RuntimeError('No AI provider is configured')
+        pending: Dict = {}
+
+        def submit_next() -> Optional[str]:
+            # The breaker is consulted only when a call is really sent, so a half-open probe is never wasted
+            while queue:
+                name = queue.pop(0)
+                if self.breakers[name].allow():
+                    # Only the routed provider understands the requested model id
+                    future = self._executor.submit(self._call, name, messages, model if name == primary else None)
+                    pending[future] = name
+                    return name
+            return None
+
+        first = submit_next()
+        if first is None:
+            raise RuntimeError('No AI provider is currently available')
+        deadline = time.monotonic() + self._hedge_delay(first)
+        errors: List[BaseException] = []
+        while pending:
+            timeout = max(0.0, deadline - time.monotonic()) if queue else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Latency threshold passed: hedge to the next provider, keep the slow call running
+                name = submit_next()
+                if name is not None:
+                    self._bump('hedged')
+                    deadline = time.monotonic() + self._hedge_delay(name)
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if name != first:
+                    self._bump('fallback_wins')
+                return result
+            if not pending:
+                name = submit_next()
+                if name is not None:
+                    self._bump('failovers')
+                    deadline = time.monotonic() + self._hedge_delay(name)
+        if errors:
+            raise next((e for e in errors if _is_rate_limited(e)), errors[-1])
+        raise RuntimeError('No AI provider is currently available')
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            snapshot: Dict[str, object] = dict(self.counters)
+        snapshot['providers'] = {
+            name: dict(self.latency[name].snapshot(), state=self.breakers[name].state, available=p.available)
+            for name, p in self.providers.items()
+        }
+        return snapshot
+
+
+def build_default_router() -> ProviderRouter:
+    return ProviderRouter(
+        providers={
+            'openai': OpenAIProvider(),
+            'anthropic': AnthropicProvider(),
+            'google': GoogleProvider(),
+        },
+        routes=[('gpt-', 'openai'), ('o1', 'openai'), ('claude-', 'anthropic'), ('gemini-', 'google')],
+        order=['openai', 'anthropic', 'google'],
+        fallback=LocalProvider(),
+        hedge_after=float(os.environ.get('PROVIDER_HEDGE_AFTER_SEC', '8')),
+        breaker_threshold=int(os.environ.get('PROVIDER_BREAKER_FAILURES', '5')),
+        breaker_reset=float(os.environ.get('PROVIDER_BREAKER_RESET_SEC', '30')),
+    )
+
+
+def provider_keys_configured() -> bool:
+    return any(os.environ.get(k) for k in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GOOGLE_API_KEY'))
+
+
+class RateLimitError(Exception):
+    """Raised when a request cannot get an upstream slot within the allowed wait."""
+
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token if available and return 0, else return seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def is_idle(self) -> bool:
+        """True once the bucket has refilled to capacity, i.e. it is no different from a new one."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= self.capacity
+
+
+class _InFlight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+def _is_rate_limited(error: BaseException) -> bool:
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+class GuardedProvider(ChatProvider):
+    """
+    Middleware around a ChatProvider for bursty traffic:
+
+    - single-flight: identical (model, messages) requests already in flight share one upstream call
+    - global and per-user token buckets (coalesced requests are not charged), with a bounded queue of
+      callers waiting for a token
+    - adaptive backoff: an upstream 429 halves the global rate and retries after a delay; successes
+      restore the configured rate gradually
+
+    `stats()` exposes counters for queue wait time and rejections.
+    """
+
+    def __init__(
+        self,
+        inner: ChatProvider,
+        rate: float = 5.0,
+        burst: float = 10.0,
+        user_rate: float = 0.5,
+        user_burst: float = 5.0,
+        max_waiters: int = 50,
+        max_wait: float = 10.0,
+        max_retries: int = 2,
+    ) -> None:
+        self.inner = inner
+        self.base_rate = rate
+        self.global_bucket = TokenBucket(rate, burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._user_buckets: Dict[object, TokenBucket] = {}
+        self._buckets_swept = time.monotonic()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._waiters = 0
+        self._stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'upstream_calls': 0,
+            'rejected_user': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'upstream_429': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _bump(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['waiting'] = self._waiters
+            snapshot['in_flight'] = len(self._in_flight)
+        snapshot['current_rate'] = self.global_bucket.rate
+        if hasattr(self.inner, 'stats'):
+            snapshot['router'] = self.inner.stats()
+        return snapshot
+
+    def _user_bucket(self, user_id: object) -> TokenBucket:
+        """Caller holds self._lock."""
+        now = time.monotonic()
+        if now - self._buckets_swept >= self.user_burst / self.user_rate:
+            # Full buckets carry no state, so dropping them bounds memory to recently active users
+            self._user_buckets = {u: b for u, b in self._user_buckets.items() if not b.is_idle()}
+            self._buckets_swept = now
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _acquire_global(self) -> None:
+        with self._lock:
+            if self._waiters >= self.max_waiters:
+                self._stats['rejected_queue_full'] += 1
+                raise RateLimitError('Provider queue is full', retry_after=self.max_wait)
+            self._waiters += 1
+        started = time.monotonic()
+        try:
+            while True:
+                wait = self.global_bucket.try_acquire()
+                if wait == 0:
+                    return
+                elapsed = time.monotonic() - started
+                if elapsed + wait > self.max_wait:
+                    self._bump('rejected_timeout')
+                    raise RateLimitError('Timed out waiting for a provider slot', retry_after=wait)
+                time.sleep(min(wait, 0.25))
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waiters -= 1
+                self._stats['wait_seconds_total'] += waited
+                self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+
+    def _call_upstream(self, messages: List[Dict[str, str]], model: str | None) -> str:
+        backoff = 1.0
+        for attempt in range(self.max_retries + 1):
+            self._acquire_global()
+            self._bump('upstream_calls')
+            try:
+                result = self.inner.chat(messages, model=model)
+            except Exception as e:
+                if not _is_rate_limited(e):
+                    raise
+                self._bump('upstream_429')
+                self.global_bucket.set_rate(max(self.base_rate / 16, self.global_bucket.rate / 2))
+                if attempt == self.max_retries:
+                    raise RateLimitError('Provider is rate limiting requests', retry_after=backoff)
+                time.sleep(backoff)
+                backoff *= 2
+                continue
+            if self.global_bucket.rate < self.base_rate:
+                self.global_bucket.set_rate(min(self.base_rate, self.global_bucket.rate + self.base_rate / 10))
+            return result
+        raise RateLimitError('Provider is rate limiting requests', retry_after=backoff)  # pragma: no cover
+
+    def chat(self, messages: List[Dict[str, str]], model: str | None = None, user_id: object = None) -> str:
+        key = hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode('utf-8')).hexdigest()
+        with self._lock:
+            self._stats['requests'] += 1
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if not leader:
+                # Shares a call already in flight, so it costs the user nothing
+                self._stats['coalesced'] += 1
+            elif user_id is not None and self._user_bucket(user_id).try_acquire() > 0:
+                self._stats['rejected_user'] += 1
+                raise RateLimitError('Too many requests for this user', retry_after=1 / self.user_rate)
+            else:
+                flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            # Bounded like a queued caller, so a hung upstream call can't hold its followers forever
+            if not flight.done.wait(self.max_wait):
+                self._bump('rejected_timeout')
+                raise RateLimitError('Timed out waiting for an identical request in flight', retry_after=self.max_wait)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result or ''
+
+        try:
+            flight.result = self._call_upstream(messages, model)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+
+_guarded_provider: Optional[GuardedProvider] = None
+_guarded_provider_lock = threading.Lock()
+
+
+def get_default_provider() -> GuardedProvider:
+    """Process-wide provider shared by all requests, so coalescing and rate limits see every call."""
+    global _guarded_provider
+    if _guarded_provider is None:
+        with _guarded_provider_lock:
+            if _guarded_provider is None:
+                _guarded_provider = GuardedProvider(
+                    build_default_router(),
+                    rate=float(os.environ.get('PROVIDER_RATE_PER_SEC', '5')),
+                    burst=float(os.environ.get('PROVIDER_BURST', '10')),
+                    user_rate=float(os.environ.get('PROVIDER_USER_RATE_PER_SEC', '0.5')),
+                    user_burst=float(os.environ.get('PROVIDER_USER_BURST', '5')),
+                    max_waiters=int(os.environ.get('PROVIDER_MAX_WAITERS', '50')),
+                    max_wait=float(os.environ.get('PROVIDER_MAX_WAIT_SEC', '10')),
+                )
+    return _guarded_provider
 
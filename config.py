@@ -1,10 +1,61 @@
 import os
 
 
+def engine_options_for(uri: str) -> dict:
+    """Engine tuning profile for the configured database backend."""
+    if uri.startswith('sqlite'):
+        # Concurrent writers wait on the lock instead of failing immediately; WAL and the other
+        # pragmas are applied per connection by db_routing.install_sqlite_pragmas
+        return {'connect_args': {'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT_SEC', '5'))}}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT_SEC', '30')),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE_SEC', '1800')),
+        'pool_pre_ping': True,
+    }
+
+
 class BaseConfig:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-change-me')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///sciweb.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options_for(SQLALCHEMY_DATABASE_URI)
+    # Optional read replica; routes marked @use_read_replica read from it, writes stay on the primary
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = (
+        {'replica': dict(engine_options_for(DATABASE_REPLICA_URL), url=DATABASE_REPLICA_URL)}
+        if DATABASE_REPLICA_URL else {}
+    )
+    # Applied to every SQLite connection (primary and replica)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -20000,  # KiB
+        'temp_store': 'MEMORY',
+        'mmap_size': 268435456,
+    }
+    # Content-addressed grader uploads (served through an authorized route, not /static)
+    UPLOAD_STORAGE_ROOT = os.environ.get(
+        'UPLOAD_STORAGE_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'uploads')
+    )
+    # Let the front-end server (nginx/Apache) send upload bodies via X-Sendfile
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+    # Outline-mode chat history: 'memory' (per process) or 'sqlite:///path' (shared by local workers)
+    OUTLINE_SESSION_BACKEND = os.environ.get('OUTLINE_SESSION_BACKEND', 'memory')
+    OUTLINE_SESSION_TTL_SEC = int(os.environ.get('OUTLINE_SESSION_TTL_SEC', '3600'))
+    OUTLINE_SESSION_MAX = int(os.environ.get('OUTLINE_SESSION_MAX', '10000'))
+    OUTLINE_HISTORY_MAX = int(os.environ.get('OUTLINE_HISTORY_MAX', '24'))
+    # Real-time fan-out for messaging/study rooms: 'memory' (per process) or 'sqlite:///path' (shared by local workers)
+    REALTIME_BACKEND = os.environ.get('REALTIME_BACKEND', 'memory')
+    REALTIME_MAX_QUEUE = int(os.environ.get('REALTIME_MAX_QUEUE', '256'))  # events buffered per connection
+    REALTIME_KEEPALIVE_SEC = float(os.environ.get('REALTIME_KEEPALIVE_SEC', '15'))
+    PRESENCE_INTERVAL_SEC = float(os.environ.get('PRESENCE_INTERVAL_SEC', '1'))
+    # Items per feed block; the feed is paged in blocks rather than scrolled endlessly
+    FEED_BLOCK_SIZE = int(os.environ.get('FEED_BLOCK_SIZE', '6'))
+    # Comma-separated emails allowed to use /admin tools (e.g. the sampling profiler)
+    ADMIN_EMAILS = [e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()]
     SESSION_COOKIE_SECURE = False
     REMEMBER_COOKIE_SECURE = False
 
@@ -17,4 +68,3 @@ class ProductionConfig(BaseConfig):
     DEBUG = False
     SESSION_COOKIE_SECURE = True
     REMEMBER_COOKIE_SECURE = True
-
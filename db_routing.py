@@ -0,0 +1,91 @@
+"""
+Read/write session routing and SQLite connection tuning.
+
+Writes and anything inside a flush always use the primary engine. A request handled by a view
+decorated with `use_read_replica` sends its SELECTs to the 'replica' bind when one is configured
+(see `DATABASE_REPLICA_URL` in config.py), as long as the session holds no pending changes and has
+not written in the current transaction (so it always reads its own uncommitted writes).
+"""
+
+import sqlite3
+from functools import wraps
+
+from flask import g, has_app_context, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set by the first write of a transaction; reads stay on the primary until it ends
+        self.wrote_to_primary = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.wrote_to_primary = True
+        if (
+            bind is None
+            and getattr(clause, 'is_select', False)
+            and not self.wrote_to_primary
+            and not (self.new or self.dirty or self.deleted)
+            and has_app_context()
+            and g.get('use_read_replica')
+        ):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _release_primary(session, transaction):
+    if transaction.parent is None:
+        session.wrote_to_primary = False
+
+
+def dialect_insert(session, model):
+    """INSERT construct with ON CONFLICT support for the primary engine's dialect (SQLite or Postgres)."""
+    dialect = session.get_bind().dialect.name
+    return (pg_insert if dialect == 'postgresql' else sqlite_insert)(model)
+
+
+def use_read_replica(view):
+    """Mark a read-only view so its queries may be served by the read replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def install_sqlite_pragmas(engine: Engine, pragmas: dict) -> None:
+    """Run `PRAGMA key=value` for each pragma on every new DB-API connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for key, value in pragmas.items():
+                cursor.execute(f'PRAGMA {key}={value}')
+        finally:
+            cursor.close()
+
+
+def configure_engines(app, db) -> None:
+    """Apply the engine profile's per-connection settings to every engine of `db`."""
+    with app.app_context():
+        for engine in db.engines.values():
+            install_sqlite_pragmas(engine, current_app.config.get('SQLITE_PRAGMAS') or {})
@@ -0,0 +1,168 @@
+"""
+Activity feed with timelines precomputed at write time.
+
+`publish` records an ActivityEvent (new lesson, new graph concepts, graded submission) and fans it
+out in the same transaction as the write that caused it: one FeedEntry row per recipient (the
+actor and everyone who shares a cohort with them; private events go to the actor only). Reading a
+feed page is then one keyset query on the reader's own rows, ordered by `score`, whatever the size
+of their network. `score` mixes recency with helpfulness (see `rank`) and is rewritten on an
+event's timeline rows when someone marks it helpful.
+"""
+
+import math
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
+from db_routing import dialect_insert
+from models import db, ActivityEvent, CohortMember, FeedEntry, FeedVote, User
+
+
+# Each 10x in helpful votes lifts an event as much as being this many hours newer
+RANK_HELPFUL_HOURS = 12.0
+DEFAULT_PAGE_SIZE = 20
+
+
+def rank(helpfulness: int, created_at: datetime) -> float:
+    """Monotonic in time, so newer events never sort below older ones with the same helpfulness."""
+    return created_at.timestamp() / 3600.0 + RANK_HELPFUL_HOURS * math.log10(1 + max(0, helpfulness))
+
+
+def audience(actor_id: int) -> List[int]:
+    """The actor plus every member of the actor's cohorts."""
+    actor_cohorts = select(CohortMember.cohort_id).where(CohortMember.user_id == actor_id)
+    peers = db.session.execute(
+        select(CohortMember.user_id).where(CohortMember.cohort_id.in_(actor_cohorts)).distinct()
+    ).scalars()
+    return sorted({actor_id, *peers})
+
+
+def publish(actor_id: int, kind: str, title: str, preview: Optional[str] = None,
+            concepts: Optional[List[str]] = None, private: bool = False, **refs) -> ActivityEvent:
+    """
+    Record an event and add it to its recipients' timelines. `refs` are the optional
+    project_id / conversation_id / submission_id it points at. The caller commits.
+    """
+    event = ActivityEvent(
+        actor_id=actor_id, kind=kind, title=title[:255], preview=(preview or '')[:500] or None,
+        concepts=concepts or None, created_at=datetime.utcnow(), **refs,
+    )
+    db.session.add(event)
+    db.session.flush()
+    score = rank(0, event.created_at)
+    recipients = [actor_id] if private else audience(actor_id)
+    db.session.execute(insert(FeedEntry), [
+        {'user_id': user_id, 'event_id': event.id, 'score': score} for user_id in recipients
+    ])
+    return event
+
+
+def mark_helpful(event_id: int, user_id: int) -> Optional[int]:
+    """
+    Count one helpful vote per user on an event in their timeline and re-rank it everywhere.
+    Returns the new helpfulness, or None if the event is not in the user's feed. The caller commits.
+    """
+    visible = db.session.execute(
+        select(FeedEntry.id).where(FeedEntry.user_id == user_id, FeedEntry.event_id == event_id)
+    ).first()
+    if visible is None:
+        return None
+    voted = db.session.execute(
+        dialect_insert(db.session, FeedVote)
+        .values(event_id=event_id, user_id=user_id)
+        .on_conflict_do_nothing(index_elements=['event_id', 'user_id'])
+    ).rowcount
+    if voted:
+        db.session.execute(
+            update(ActivityEvent).where(ActivityEvent.id == event_id)
+            .values(helpfulness=ActivityEvent.helpfulness + 1)
+        )
+    event = db.session.execute(
+        select(ActivityEvent.helpfulness, ActivityEvent.created_at).where(ActivityEvent.id == event_id)
+    ).one()
+    if voted:
+        db.session.execute(
+            update(FeedEntry).where(FeedEntry.event_id == event_id).values(score=rank(event.helpfulness, event.created_at))
+        )
+    return event.helpfulness
+
+
+def retract(**refs) -> None:
+    """Remove events pointing at a deleted object (e.g. submission_id=...) from every timeline. The caller commits."""
+    event_ids = select(ActivityEvent.id).filter_by(**refs).scalar_subquery()
+    for model in (FeedEntry, FeedVote):
+        db.session.execute(delete(model).where(model.event_id.in_(event_ids)))
+    db.session.execute(delete(ActivityEvent).filter_by(**refs))
+
+
+def _parse_cursor(cursor: Optional[str], order: str) -> Optional[Tuple]:
+    """Raises ValueError for a malformed cursor."""
+    if not cursor:
+        return None
+    if order == 'recent':
+        return (int(cursor),)
+    score, entry_id = cursor.rsplit(':', 1)
+    return float(score), int(entry_id)
+
+
+def page(user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+         order: str = 'ranked') -> Tuple[List[Dict], Optional[str]]:
+    """
+    One page of the user's timeline, `order` 'ranked' (score) or 'recent'. Returns
+    (items, next_cursor); next_cursor is None on the last page. Raises ValueError on a bad cursor.
+
+    Ranked cursors are not a snapshot: a helpful vote only ever raises an event's score, so an
+    unseen event voted above the cursor mid-paging is skipped (it shows on the next refresh),
+    while an event already shown cannot drop below the cursor and repeat.
+    """
+    position = _parse_cursor(cursor, order)
+    stmt = (
+        select(FeedEntry.id, FeedEntry.score, ActivityEvent, User.display_name, User.email)
+        .join(ActivityEvent, FeedEntry.event_id == ActivityEvent.id)
+        .join(User, ActivityEvent.actor_id == User.id)
+        .where(FeedEntry.user_id == user_id)
+    )
+    if order == 'recent':
+        if position:
+            stmt = stmt.where(FeedEntry.id < position[0])
+        stmt = stmt.order_by(FeedEntry.id.desc())
+    else:
+        if position:
+            score, entry_id = position
+            stmt = stmt.where(or_(FeedEntry.score < score, and_(FeedEntry.score == score, FeedEntry.id < entry_id)))
+        stmt = stmt.order_by(FeedEntry.score.desc(), FeedEntry.id.desc())
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+
+    items = [
+        {
+            'id': event.id,
+            'type': event.kind,
+            'author': display_name or email,
+            'actor_id': event.actor_id,
+            'title': event.title,
+            'preview': event.preview or '',
+            'concepts': event.concepts or [],
+            'helpfulness': event.helpfulness,
+            'project_id': event.project_id,
+            'conversation_id': event.conversation_id,
+            'submission_id': event.submission_id,
+            'created': event.created_at.strftime('%Y-%m-%d'),
+        }
+        for _, _, event, display_name, email in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        entry_id, score = rows[limit - 1][0], rows[limit - 1][1]
+        next_cursor = str(entry_id) if order == 'recent' else f'{score!r}:{entry_id}'
+    return items, next_cursor
+
+
+def trim_timelines(keep: int = 1000) -> int:
+    """Delete all but each user's newest `keep` timeline rows. Returns rows deleted; the caller commits."""
+    numbered = select(
+        FeedEntry.id, func.row_number().over(partition_by=FeedEntry.user_id, order_by=FeedEntry.id.desc()).label('n')
+    ).subquery()
+    return db.session.execute(
+        delete(FeedEntry).where(FeedEntry.id.in_(select(numbered.c.id).where(numbered.c.n > keep)))
+    ).rowcount
@@ -0,0 +1,181 @@
+"""
+Grading prompt construction and local answer checking for the grade scanner.
+
+An `Assignment` compiles its answer key and rubric once into a stable prompt prefix. Every
+submission for the assignment sends that prefix byte-for-byte first (as the system message) and
+only its own details afterwards, so provider-side prompt caching can reuse the prefix across a
+class set. The key is also parsed into {problem: answer}; when every problem has a simple answer
+(number, fraction or multiple-choice letter) and the student typed theirs, grading needs no model
+call. Anything else (expressions, words) is left to the model, which can judge equivalence.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+GRADER_PERSONA = "You are an expert teacher providing detailed, constructive feedback on student work."
+
+RESPONSE_FORMAT = """Please analyze the student's work and provide:
+1. Overall score (0-100)
+2. Detailed feedback on what's correct and what's incorrect
+3. Specific comments on each problem/section
+4. Constructive suggestions for improvement
+
+Format your response as JSON with these fields:
+{
+  "overall_score": <number 0-100>,
+  "earned_points": <number>,
+  "total_points": <number>,
+  "feedback": "<detailed overall feedback>",
+  "problem_feedback": [
+    {"problem": "<problem number/name>", "score": <points>, "comment": "<specific feedback>", "is_correct": <true/false>}
+  ]
+}"""
+
+# "1. 42", "2) x = 3", "Q3: B", "Problem 4 - 1/2"; the separator must be followed by whitespace,
+# so "1.5" is not read as problem 1, answer 5
+ANSWER_LINE_RE = re.compile(r'^\s*(?:q(?:uestion)?|problem|#)?\s*(\d+[a-z]?)\s*[.):\-]\s+(.+?)\s*$', re.IGNORECASE)
+NUMBER_RE = re.compile(r'^[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?$')
+FRACTION_RE = re.compile(r'^([-+]?\d+)\s*/\s*(\d+)$')
+# "B", "(b)", "c)", "D."
+CHOICE_RE = re.compile(r'^\(?([a-h])\)?\.?$', re.IGNORECASE)
+# "5 points", "2 pts", "10 marks" on a numbered rubric line
+POINTS_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:points?|pts?|marks?)\b', re.IGNORECASE)
+
+
+def compile_prompt_prefix(title: str, subject: Optional[str], answer_key: str, rubric: str) -> str:
+    """Everything about an assignment that is identical for every student, in a fixed order."""
+    parts = [
+        GRADER_PERSONA,
+        "You are grading handwritten student work.",
+        f"Subject: {subject or 'General'}",
+        f"Assignment: {title}",
+    ]
+    if answer_key:
+        parts.append(f"Answer Key:\n{answer_key.strip()}")
+    if rubric:
+        parts.append(f"Grading Rubric:\n{rubric.strip()}")
+    parts.append(RESPONSE_FORMAT)
+    return '\n\n'.join(parts)
+
+
+def _number(text: str) -> Optional[float]:
+    text = text.replace(',', '').replace(' ', '')
+    if NUMBER_RE.match(text):
+        return float(text)
+    m = FRACTION_RE.match(text)
+    if m and int(m.group(2)):
+        return int(m.group(1)) / int(m.group(2))
+    return None
+
+
+def _choice(text: str) -> Optional[str]:
+    m = CHOICE_RE.match(text.strip())
+    return m.group(1).lower() if m else None
+
+
+def parse_answers(text: str) -> Dict[str, str]:
+    """Parse numbered lines ("1. 42", "2) B") of an answer key or typed answers into {problem: answer}."""
+    answers: Dict[str, str] = {}
+    for line in (text or '').splitlines():
+        m = ANSWER_LINE_RE.match(line)
+        if m:
+            answers[m.group(1).lower()] = m.group(2)
+    return answers
+
+
+def parse_points(rubric: str) -> Dict[str, float]:
+    """{problem: points} from numbered rubric lines that state points ("2. 5 points - ...")."""
+    points: Dict[str, float] = {}
+    for line in (rubric or '').splitlines():
+        m = ANSWER_LINE_RE.match(line)
+        found = POINTS_RE.search(m.group(2)) if m else None
+        if found:
+            points[m.group(1).lower()] = float(found.group(1))
+    return points
+
+
+def is_simple_answer(answer: str) -> bool:
+    """Numbers, fractions and multiple-choice letters can be checked mechanically."""
+    return _number(answer) is not None or _choice(answer) is not None
+
+
+def reported_correct(value) -> bool:
+    """A model-reported `is_correct` as a bool; JSON strings like "false" or "0" count as incorrect."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'correct', '1')
+    if isinstance(value, (int, float)):
+        return value == 1
+    return False
+
+
+def answers_match(expected: str, given: str) -> Optional[bool]:
+    """Whether a typed answer matches a simple key answer, or None if it cannot be decided locally."""
+    a, b = _number(expected), _number(given)
+    if a is not None:
+        return abs(a - b) <= 1e-6 * max(1.0, abs(a)) if b is not None else None
+    a, b = _choice(expected), _choice(given)
+    if a is not None and b is not None:
+        return a == b
+    return None
+
+
+def check_answers(answer_map: Dict[str, str], student_answers: Dict[str, str],
+                  points: Optional[Dict[str, float]] = None) -> Tuple[List[Dict], List[str]]:
+    """
+    Check typed student answers against the parsed key, scoring each problem with its rubric
+    `points` (1 if the rubric gives none). Returns (problem_feedback for the problems that could
+    be checked locally, problems from the key left for the model).
+    """
+    checked: List[Dict] = []
+    unresolved: List[str] = []
+    for problem, expected in answer_map.items():
+        given = student_answers.get(problem)
+        correct = answers_match(expected, given) if given is not None else None
+        if correct is None:
+            unresolved.append(problem)
+            continue
+        worth = (points or {}).get(problem, 1)
+        checked.append({
+            'problem': problem,
+            'score': worth if correct else 0,
+            'points': worth,
+            'comment': 'Correct.' if correct else f'Expected {expected}, got {given}.',
+            'is_correct': correct,
+        })
+    return checked, unresolved
+
+
+def local_result(checked: List[Dict]) -> Dict:
+    earned = sum(p['score'] for p in checked)
+    total = sum(p['points'] for p in checked)
+    wrong = [p['problem'] for p in checked if not p['is_correct']]
+    feedback = (
+        f"{sum(1 for p in checked if p['is_correct'])}/{len(checked)} answers correct ({earned:g}/{total:g} points)."
+        + (f" Review problem{'s' if len(wrong) > 1 else ''} {', '.join(wrong)}." if wrong else ' Great work!')
+    )
+    return {
+        'overall_score': round(100 * earned / total, 1) if total else 0,
+        'earned_points': earned,
+        'total_points': total,
+        'feedback': feedback,
+        'problem_feedback': checked,
+    }
+
+
+def build_grading_messages(prefix: str, submission_title: str, checked: List[Dict], unresolved: List[str]) -> List[Dict[str, str]]:
+    """System message is the cacheable prefix; the per-submission part goes last."""
+    details = [f"Submission: {submission_title}"]
+    if checked:
+        verified = ', '.join(
+            f"{p['problem']} ({'correct' if p['is_correct'] else 'incorrect'}, {p['score']:g}/{p['points']:g} points)"
+            for p in checked
+        )
+        details.append(f"Already verified from typed answers (include these in your totals): {verified}.")
+        if unresolved:
+            details.append(f"Grade the remaining problems from the work: {', '.join(unresolved)}.")
+    details.append("Grade this student's work.")
+    return [
+        {"role": "system", "content": prefix},
+        {"role": "user", "content": '\n'.join(details)},
+    ]
@@ -1,15 +1,20 @@
-from typing import List, Dict, Tuple
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+
+from db_routing import dialect_insert
+from models import db, Concept, ConceptOccurrence, Conversation, KnowledgeNode, KnowledgeEdge, Project
 
 
 def extract_knowledge_graph(messages: List[Dict[str, str]]) -> Tuple[List[Dict], List[Dict]]:
     """
     Very simple heuristic extractor that turns a conversation into nodes and edges.
     This is a placeholder for a real NLP/LLM-based extraction pipeline.
-    Returns (nodes, edges) where nodes are {label, type} and edges are {source, target, relation}.
+    Returns (nodes, edges) where nodes are {label, type, count} and edges are {source, target, relation}.
     """
     # Collect candidate concepts by splitting on capitalized terms and known separators
     # Naive approach: take distinct words longer than 3 characters that appear frequently
-    from collections import Counter
     import re
 
     full_text = ' '.join([m['content'] for m in messages])
@@ -17,7 +22,7 @@ def extract_knowledge_graph(messages: List[Dict[str, str]]) -> Tuple[List[Dict],
     counts = Counter([t.lower() for t in tokens])
     common = [w for w, c in counts.most_common(30) if c >= 2]
 
-    nodes = [{"label": w.title(), "type": "concept"} for w in common[:15]]
+    nodes = [{"label": w.title(), "type": "concept", "count": counts[w]} for w in common[:15]]
     label_to_index = {n["label"]: idx for idx, n in enumerate(nodes)}
 
     # Create simple edges based on co-occurrence in the same sentence
@@ -41,3 +46,195 @@ def extract_knowledge_graph(messages: List[Dict[str, str]]) -> Tuple[List[Dict],
 
     return nodes, unique_edges[:40]
 
+
+def concept_key(label: str) -> str:
+    """Interning key: case- and whitespace-insensitive, so 'Entropy' and ' entropy' are one concept."""
+    return ' '.join((label or '').lower().split())[:255]
+
+
+def intern_concepts(user_id: int, labels: Iterable[str], created: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Return {concept_key: Concept.id} for the user's labels, creating missing concepts.
+    Keys of the concepts this call created are appended to `created` when given.
+    """
+    wanted: Dict[str, str] = {}
+    for label in labels:
+        key = concept_key(label)
+        if key:
+            wanted.setdefault(key, ' '.join(label.split())[:255])
+    if not wanted:
+        return {}
+
+    lookup = select(Concept.key, Concept.id).where(Concept.user_id == user_id)
+    ids = dict(db.session.execute(lookup.where(Concept.key.in_(list(wanted)))).all())
+    missing = [key for key in wanted if key not in ids]
+    if missing:
+        # DO NOTHING on conflict: a concurrent request may have interned the same concept
+        inserted = db.session.execute(
+            dialect_insert(db.session, Concept)
+            .values([{'user_id': user_id, 'key': key, 'label': wanted[key]} for key in missing])
+            .on_conflict_do_nothing(index_elements=['user_id', 'key'])
+            .returning(Concept.key, Concept.id)
+        ).all()
+        ids.update(inserted)
+        if created is not None:
+            created.extend(key for key, _ in inserted)
+        if len(inserted) < len(missing):
+            ids.update(db.session.execute(lookup.where(Concept.key.in_([k for k in missing if k not in ids]))).all())
+    return ids
+
+
+def add_occurrences(conversation_id: int, project_id: int, frequencies: Dict[int, int]) -> None:
+    """Add to the inverted index's per-conversation frequency of each concept id."""
+    if not frequencies:
+        return
+    stmt = dialect_insert(db.session, ConceptOccurrence).values([
+        {'concept_id': concept_id, 'project_id': project_id, 'conversation_id': conversation_id, 'frequency': freq}
+        for concept_id, freq in frequencies.items()
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['concept_id', 'conversation_id'],
+        set_={'frequency': ConceptOccurrence.frequency + stmt.excluded.frequency},
+    ))
+
+
+def replace_knowledge_graph(conversation_id: int, nodes: List[Dict], edges: List[Dict]) -> List[str]:
+    """
+    Replace a conversation's stored graph with (nodes, edges) from `extract_knowledge_graph`.
+    Returns the labels of concepts that are new to the owner. The caller owns the transaction.
+    """
+    return replace_knowledge_graphs({conversation_id: (nodes, edges)}).get(conversation_id, [])
+
+
+def replace_knowledge_graphs(graphs: Dict[int, Tuple[List[Dict], List[Dict]]]) -> Dict[int, List[str]]:
+    """
+    Replace the stored graphs of several conversations, {conversation_id: (nodes, edges)}.
+    Labels are interned into each owner's Concept catalog and nodes store only the concept id;
+    the conversations' ConceptOccurrence rows are rewritten in the same transaction.
+    Whatever the number of conversations, the writes are a fixed handful of set-based statements:
+    one DELETE per table, one batched INSERT ... RETURNING for nodes and one executemany INSERT
+    each for occurrences and edges. Returns {conversation_id: labels of concepts new to the owner}.
+    The caller owns the transaction (commit/rollback).
+    """
+    conversation_ids = list(graphs)
+    if not conversation_ids:
+        return {}
+    for model in (KnowledgeEdge, KnowledgeNode, ConceptOccurrence):
+        model.query.filter(model.conversation_id.in_(conversation_ids)).delete(synchronize_session=False)
+
+    # One node per concept; keep the first occurrence if a caller passes case variants or duplicates
+    unique_nodes: Dict[int, Dict[str, Dict]] = {}
+    for conversation_id, (nodes, _) in graphs.items():
+        per_conversation = unique_nodes[conversation_id] = {}
+        for n in nodes:
+            key = concept_key(n['label'])
+            if key:
+                per_conversation.setdefault(key, n)
+    if not any(unique_nodes.values()):
+        return {}
+
+    owners = {
+        r.id: r for r in db.session.execute(
+            select(Conversation.id, Project.id.label('project_id'), Project.owner_id)
+            .join(Project, Conversation.project_id == Project.id)
+            .where(Conversation.id.in_(conversation_ids))
+        ).all()
+    }
+    # Conversations deleted since their graph was extracted have nothing to write
+    unique_nodes = {cid: per_conversation for cid, per_conversation in unique_nodes.items() if cid in owners}
+    labels_by_owner: Dict[int, List[str]] = {}
+    for conversation_id, per_conversation in unique_nodes.items():
+        labels_by_owner.setdefault(owners[conversation_id].owner_id, []).extend(n['label'] for n in per_conversation.values())
+    created: Dict[int, List[str]] = {owner_id: [] for owner_id in labels_by_owner}
+    concept_ids = {
+        owner_id: intern_concepts(owner_id, labels, created[owner_id]) for owner_id, labels in labels_by_owner.items()
+    }
+    new_concepts: Dict[int, List[str]] = {}
+    for conversation_id, per_conversation in unique_nodes.items():
+        owner_created = created[owners[conversation_id].owner_id]
+        labels = [n['label'] for key, n in per_conversation.items() if key in owner_created]
+        if labels:
+            new_concepts[conversation_id] = labels
+            owner_created[:] = [key for key in owner_created if key not in per_conversation]
+
+    node_rows, node_keys, occurrence_rows = [], [], []
+    for conversation_id, per_conversation in unique_nodes.items():
+        owner = owners[conversation_id]
+        for key, n in per_conversation.items():
+            concept_id = concept_ids[owner.owner_id][key]
+            node_rows.append({'conversation_id': conversation_id, 'concept_id': concept_id, 'type': n.get('type')})
+            node_keys.append((conversation_id, key))
+            occurrence_rows.append({
+                'concept_id': concept_id,
+                'project_id': owner.project_id,
+                'conversation_id': conversation_id,
+                'frequency': max(1, int(n.get('count') or 1)),
+            })
+    if not node_rows:
+        # Every conversation in the batch was deleted; an empty executemany would INSERT DEFAULT VALUES
+        return new_concepts
+    node_ids = db.session.execute(
+        insert(KnowledgeNode).returning(KnowledgeNode.id, sort_by_parameter_order=True), node_rows
+    ).scalars().all()
+    key_to_id = dict(zip(node_keys, node_ids))
+    db.session.execute(insert(ConceptOccurrence), occurrence_rows)
+
+    edge_rows = []
+    for conversation_id, (_, edges) in graphs.items():
+        for e in edges:
+            src = key_to_id.get((conversation_id, concept_key(e['source'])))
+            tgt = key_to_id.get((conversation_id, concept_key(e['target'])))
+            if src and tgt and src != tgt:
+                edge_rows.append({
+                    'conversation_id': conversation_id,
+                    'source_node_id': src,
+                    'target_node_id': tgt,
+                    'relation': e.get('relation') or 'related_to',
+                })
+    if edge_rows:
+        db.session.execute(insert(KnowledgeEdge), edge_rows)
+    return new_concepts
+
+
+def node_label():
+    """Column expression for a node's display label (interned concept, or a legacy inline label)."""
+    return func.coalesce(Concept.label, KnowledgeNode.label)
+
+
+def intern_legacy_nodes(batch_size: int = 200) -> int:
+    """
+    Move up to `batch_size` conversations' worth of nodes that still store their label inline
+    onto the Concept catalog and index them. Returns the number of nodes converted; the caller
+    commits and calls again until it returns 0.
+    """
+    conversation_ids = db.session.execute(
+        select(KnowledgeNode.conversation_id)
+        .where(KnowledgeNode.concept_id.is_(None))
+        .distinct()
+        .limit(batch_size)
+    ).scalars().all()
+    converted = 0
+    for conversation_id in conversation_ids:
+        project_id, owner_id = db.session.execute(
+            select(Project.id, Project.owner_id)
+            .join(Conversation, Conversation.project_id == Project.id)
+            .where(Conversation.id == conversation_id)
+        ).one()
+        rows = db.session.execute(
+            select(KnowledgeNode.id, KnowledgeNode.label).where(
+                KnowledgeNode.conversation_id == conversation_id, KnowledgeNode.concept_id.is_(None)
+            )
+        ).all()
+        labels = [r.label if concept_key(r.label) else '(unlabeled)' for r in rows]
+        concept_ids = intern_concepts(owner_id, labels)
+        # Legacy rows have no mention counts; each node counts once
+        frequencies: Counter = Counter()
+        updates = []
+        for r, label in zip(rows, labels):
+            concept_id = concept_ids[concept_key(label)]
+            frequencies[concept_id] += 1
+            updates.append({'id': r.id, 'concept_id': concept_id, 'label': None})
+        db.session.execute(update(KnowledgeNode), updates)
+        add_occurrences(conversation_id, project_id, frequencies)
+        converted += len(updates)
+    return converted
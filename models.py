@@ -2,8 +2,10 @@ from datetime import datetime, date
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model, UserMixin):
@@ -43,10 +45,13 @@ class Conversation(db.Model):
     difficulty_level = db.Column(db.String(50), nullable=True)
     explanation_style = db.Column(db.String(50), nullable=True)
     interaction_preference = db.Column(db.String(50), nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=True)  # set while messages live in ConversationArchive
 
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    archive = db.relationship('ConversationArchive', backref='conversation', uselist=False, lazy=True, cascade='all, delete-orphan')
     graph_nodes = db.relationship('KnowledgeNode', backref='conversation', lazy=True, cascade='all, delete-orphan')
     graph_edges = db.relationship('KnowledgeEdge', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    concept_occurrences = db.relationship('ConceptOccurrence', lazy=True, cascade='all, delete-orphan')
 
 
 class Message(db.Model):
@@ -59,12 +64,61 @@ class Message(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 
+class ConversationArchive(db.Model):
+    __tablename__ = 'conversation_archives'
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), unique=True, nullable=False)
+    payload = db.deferred(db.Column(db.LargeBinary, nullable=False))  # zlib-compressed JSON list of messages
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    compressed_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Concept(db.Model):
+    """A user's interned concept label; knowledge nodes reference it instead of repeating the text."""
+    __tablename__ = 'concepts'
+    __table_args__ = (db.UniqueConstraint('user_id', 'key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)  # normalized label, see kg.concept_key
+    label = db.Column(db.String(255), nullable=False)
+
+
+class ConceptOccurrence(db.Model):
+    """Inverted index: where a concept appears and how often."""
+    __tablename__ = 'concept_occurrences'
+    __table_args__ = (db.UniqueConstraint('concept_id', 'conversation_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    concept_id = db.Column(db.Integer, db.ForeignKey('concepts.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False, index=True)
+    frequency = db.Column(db.Integer, default=1, nullable=False)
+
+
+class BackfillCheckpoint(db.Model):
+    """Progress of a resumable batch job over rows ordered by id (see backfill.py)."""
+    __tablename__ = 'backfill_checkpoints'
+
+    name = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    processed = db.Column(db.Integer, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
 class KnowledgeNode(db.Model):
     __tablename__ = 'knowledge_nodes'
 
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
-    label = db.Column(db.String(255), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False, index=True)
+    # Foreign keys added to existing tables are named so migrations can create and drop them
+    concept_id = db.Column(db.Integer, db.ForeignKey('concepts.id', name='fk_knowledge_nodes_concept_id'), nullable=True)
+    label = db.Column(db.String(255), nullable=True)  # legacy rows only; interned nodes use concept_id
     type = db.Column(db.String(100), nullable=True)  # concept, theorem, person, event, etc.
     extra = db.Column(db.JSON, nullable=True)
 
@@ -80,16 +134,50 @@ class KnowledgeEdge(db.Model):
     extra = db.Column(db.JSON, nullable=True)
 
 
+class Assignment(db.Model):
+    __tablename__ = 'assignments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)
+    title = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(120), nullable=True)
+    answer_key = db.Column(db.Text, nullable=True)
+    rubric = db.Column(db.Text, nullable=True)
+    prompt_prefix = db.Column(db.Text, nullable=False)  # compiled once, see grading.compile_prompt_prefix
+    answer_map = db.Column(db.JSON, nullable=True)  # {problem: answer} parsed from answer_key
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    owner = db.relationship('User', backref='assignments', lazy=True)
+
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+
+    digest = db.Column(db.String(64), primary_key=True)  # sha256 of the content
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(120), nullable=True)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)  # GradeSubmissions using this file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
 class GradeSubmission(db.Model):
     __tablename__ = 'grade_submissions'
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)
+    assignment_id = db.Column(
+        db.Integer, db.ForeignKey('assignments.id', name='fk_grade_submissions_assignment_id'), nullable=True
+    )
     title = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(120), nullable=True)
+    student_answers = db.Column(db.JSON, nullable=True)  # optional typed answers {problem: answer}
     image_filename = db.Column(db.String(255), nullable=False)
-    image_path = db.Column(db.String(512), nullable=False)
+    image_path = db.Column(db.String(512), nullable=False)  # legacy flat uploads; new ones use file_digest
+    file_digest = db.Column(
+        db.String(64), db.ForeignKey('stored_files.digest', name='fk_grade_submissions_file_digest'), nullable=True
+    )
     status = db.Column(db.String(50), default='pending', nullable=False)  # pending, graded, error
     overall_score = db.Column(db.Float, nullable=True)  # 0-100
     total_points = db.Column(db.Float, nullable=True)
@@ -102,4 +190,146 @@ class GradeSubmission(db.Model):
 
     user = db.relationship('User', backref='grade_submissions', lazy=True)
     project = db.relationship('Project', backref='grade_submissions', lazy=True)
+    assignment = db.relationship('Assignment', backref='submissions', lazy=True)
+    stored_file = db.relationship('StoredFile', lazy=True)
+
+
+class GradeWeeklyRollup(db.Model):
+    """Per user/subject/week grading aggregates, maintained incrementally by analytics.py."""
+    __tablename__ = 'grade_weekly_rollups'
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', 'week_start'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    subject = db.Column(db.String(120), nullable=False)  # '' when the submission had none
+    week_start = db.Column(db.Date, nullable=False)  # Monday
+    submissions = db.Column(db.Integer, default=0, nullable=False)
+    score_sum = db.Column(db.Float, default=0, nullable=False)
+    earned_sum = db.Column(db.Float, default=0, nullable=False)
+    total_sum = db.Column(db.Float, default=0, nullable=False)
+
+
+class ProblemMissRollup(db.Model):
+    """How often each problem of an assignment was attempted and missed, per user."""
+    __tablename__ = 'problem_miss_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'assignment', 'problem'),
+        db.Index('ix_problem_miss_rollups_user_misses', 'user_id', 'misses'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    subject = db.Column(db.String(120), nullable=False)
+    assignment = db.Column(db.String(255), nullable=False)  # Assignment title, else submission title
+    problem = db.Column(db.String(255), nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    misses = db.Column(db.Integer, default=0, nullable=False)
 
+
+class Cohort(db.Model):
+    __tablename__ = 'cohorts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    topics = db.Column(db.JSON, nullable=True)  # list of tag strings
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    member_count = db.Column(db.Integer, default=0, nullable=False)  # denormalized for the cohort list
+
+    room = db.relationship('ChatThread', uselist=False, lazy=True,
+                           primaryjoin="and_(ChatThread.cohort_id == Cohort.id, ChatThread.kind == 'room')")
+
+
+class CohortMember(db.Model):
+    __tablename__ = 'cohort_members'
+    __table_args__ = (db.UniqueConstraint('cohort_id', 'user_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    cohort_id = db.Column(db.Integer, db.ForeignKey('cohorts.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ChatThread(db.Model):
+    """A messaging thread between users; kind 'room' is a cohort's study room (chat plus presence)."""
+    __tablename__ = 'chat_threads'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    kind = db.Column(db.String(20), default='thread', nullable=False)  # 'thread' | 'room'
+    cohort_id = db.Column(db.Integer, db.ForeignKey('cohorts.id'), nullable=True, index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Denormalized so the thread list needs no per-thread message query
+    last_message_id = db.Column(db.Integer, default=0, nullable=False)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_message_preview = db.Column(db.String(255), nullable=True)
+
+
+class ThreadMember(db.Model):
+    __tablename__ = 'thread_members'
+    __table_args__ = (db.UniqueConstraint('thread_id', 'user_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.Integer, db.ForeignKey('chat_threads.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
+
+    thread = db.relationship('ChatThread', lazy=True)
+
+
+class ThreadMessage(db.Model):
+    __tablename__ = 'thread_messages'
+    __table_args__ = (db.Index('ix_thread_messages_thread_id_id', 'thread_id', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.Integer, db.ForeignKey('chat_threads.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    sender = db.relationship('User', lazy='joined')
+
+
+class ActivityEvent(db.Model):
+    """Something worth showing in feeds; fanned out to FeedEntry rows when it is written (see feed.py)."""
+    __tablename__ = 'activity_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'lesson' | 'concepts' | 'graded'
+    title = db.Column(db.String(255), nullable=False)
+    preview = db.Column(db.String(500), nullable=True)
+    concepts = db.Column(db.JSON, nullable=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('grade_submissions.id'), nullable=True)
+    helpfulness = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    actor = db.relationship('User', lazy='joined')
+
+
+class FeedEntry(db.Model):
+    """One event in one user's precomputed timeline."""
+    __tablename__ = 'feed_entries'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'event_id'),
+        db.Index('ix_feed_entries_user_score', 'user_id', 'score', 'id'),
+        db.Index('ix_feed_entries_user_recent', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey('activity_events.id'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)  # feed.rank(helpfulness, created_at)
+
+
+class FeedVote(db.Model):
+    __tablename__ = 'feed_votes'
+    __table_args__ = (db.UniqueConstraint('event_id', 'user_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('activity_events.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
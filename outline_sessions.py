@@ -0,0 +1,141 @@
+"""
+Ephemeral storage for outline-mode chat history.
+
+Outline sessions belong to a project that does not exist yet, so their turns are kept out of the
+`messages` table: each session holds a bounded history that expires after `ttl` seconds without
+use, and the least recently used sessions are evicted past `max_sessions`. When the learner
+creates the project, the history is written to real Conversation/Message rows in one batch.
+
+`MemorySessionStore` is per process. `SqliteSessionStore` keeps sessions in a local SQLite file
+so several worker processes on one host share them (a stand-in for Redis/Memcached).
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+
+class SessionStore:
+    def __init__(self, ttl: float = 3600.0, max_sessions: int = 10000, max_history: int = 24) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+
+    def get(self, key: str) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    def append(self, key: str, messages: List[Dict[str, str]]) -> None:
+        """Append turns, keeping only the newest `max_history` messages."""
+        raise NotImplementedError
+
+    def pop(self, key: str) -> List[Dict[str, str]]:
+        """Return and delete a session's history."""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._sessions: 'OrderedDict[str, Tuple[float, List[Dict[str, str]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float):
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] > self.ttl:
+            del self._sessions[key]
+            return None
+        return entry
+
+    def _evict(self, now: float) -> None:
+        # Oldest-first order means expired sessions sit at the front
+        while self._sessions:
+            key, (touched, _) = next(iter(self._sessions.items()))
+            if now - touched <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[key]
+
+    def get(self, key: str) -> List[Dict[str, str]]:
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return list(entry[1]) if entry else []
+
+    def append(self, key: str, messages: List[Dict[str, str]]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            history = (entry[1] if entry else []) + list(messages)
+            self._sessions[key] = (now, history[-self.max_history:])
+            self._sessions.move_to_end(key)
+            self._evict(now)
+
+    def pop(self, key: str) -> List[Dict[str, str]]:
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            self._sessions.pop(key, None)
+            return entry[1] if entry else []
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS outline_sessions ('
+                ' key TEXT PRIMARY KEY, touched REAL NOT NULL, history TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_outline_sessions_touched ON outline_sessions (touched)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _load(self, conn: sqlite3.Connection, key: str, now: float) -> List[Dict[str, str]]:
+        row = conn.execute(
+            'SELECT history FROM outline_sessions WHERE key = ? AND touched >= ?', (key, now - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def get(self, key: str) -> List[Dict[str, str]]:
+        return self._load(self._conn(), key, time.time())
+
+    def append(self, key: str, messages: List[Dict[str, str]]) -> None:
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            history = (self._load(conn, key, now) + list(messages))[-self.max_history:]
+            conn.execute(
+                'INSERT OR REPLACE INTO outline_sessions (key, touched, history) VALUES (?, ?, ?)',
+                (key, now, json.dumps(history)),
+            )
+            conn.execute('DELETE FROM outline_sessions WHERE touched < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM outline_sessions WHERE key IN ('
+                ' SELECT key FROM outline_sessions ORDER BY touched DESC LIMIT -1 OFFSET ?)',
+                (self.max_sessions,),
+            )
+
+    def pop(self, key: str) -> List[Dict[str, str]]:
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            history = self._load(conn, key, now)
+            conn.execute('DELETE FROM outline_sessions WHERE key = ?', (key,))
+        return history
+
+
+def create_store(backend: str, **kwargs) -> SessionStore:
+    """'memory' or 'sqlite:///path/to/file.db'."""
+    if backend.startswith('sqlite:///'):
+        return SqliteSessionStore(backend[len('sqlite:///'):], **kwargs)
+    return MemorySessionStore(**kwargs)
@@ -0,0 +1,171 @@
+"""
+Statistical sampling profiler for live workers.
+
+A background thread snapshots the Python stacks of the worker's threads (`sys._current_frames`)
+every `interval` seconds and counts identical stacks. Output is in the collapsed-stack format used
+by flamegraph.pl / speedscope / inferno: one `frame;frame;frame count` line per distinct stack,
+root first.
+
+Two modes:
+- `profile_window(seconds)`: sample every thread except the caller for a fixed window.
+- `arm_route(endpoint, requests)`: sample only threads while they serve the next N requests to
+  one endpoint; the request hooks in app.py call `request_started` / `request_finished`.
+
+Nothing runs while no profile is active: the request hooks only check one attribute.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional, Set
+
+
+MAX_WINDOW_SECONDS = 60.0
+MAX_ROUTE_SECONDS = 300.0
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def _collapse(frame, thread_name: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(';', ':'))
+    return ';'.join(reversed(labels))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float, threads: Optional[Set[int]], exclude: Set[int],
+                 deadline: Optional[float] = None, on_expire: Optional[Callable[[], None]] = None) -> None:
+        super().__init__(name='sciweb-profiler', daemon=True)
+        self.interval = max(MIN_INTERVAL, interval)
+        # None = every thread; otherwise the (live-updated) set of thread idents to sample
+        self.threads = threads
+        self.exclude = set(exclude)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # Monotonic time after which the sampler stops itself and calls `on_expire`
+        self.deadline = deadline
+        self.on_expire = on_expire
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        self.exclude.add(threading.get_ident())
+        while not self._stop_event.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in self.exclude or (self.threads is not None and ident not in self.threads):
+                    continue
+                self.stacks[_collapse(frame, names.get(ident, str(ident)))] += 1
+            self.samples += 1
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                if self.on_expire:
+                    self.on_expire()
+                return
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> str:
+        self._stop_event.set()
+        if threading.current_thread() is not self:
+            self.join()
+        return collapsed_output(self.stacks)
+
+
+def collapsed_output(stacks: Counter) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._busy = False
+        # Route mode state; `armed_endpoint` is the only thing request hooks look at when idle
+        self.armed_endpoint: Optional[str] = None
+        self._remaining = 0
+        self._active: Set[int] = set()
+        self._sampler: Optional[_Sampler] = None
+        self._deadline = 0.0
+        self.last_route_result: Optional[Dict] = None
+
+    def _claim(self) -> None:
+        with self._lock:
+            if self._busy:
+                raise ProfilerBusy('A profile is already running on this worker')
+            self._busy = True
+
+    def profile_window(self, seconds: float, interval: float = 0.005) -> str:
+        """Sample all other threads for `seconds` (capped) and return collapsed stacks."""
+        self._claim()
+        try:
+            sampler = _Sampler(interval, threads=None, exclude={threading.get_ident()})
+            sampler.start()
+            time.sleep(min(max(seconds, 0.1), MAX_WINDOW_SECONDS))
+            return sampler.stop()
+        finally:
+            with self._lock:
+                self._busy = False
+
+    def arm_route(self, endpoint: str, requests: int, interval: float = 0.005) -> None:
+        """Sample the threads serving the next `requests` requests to `endpoint`."""
+        self._claim()
+        with self._lock:
+            self._remaining = max(1, requests)
+            self._active = set()
+            self._deadline = time.monotonic() + MAX_ROUTE_SECONDS
+            # Ends the profile even if fewer than `requests` matching requests ever arrive
+            self._sampler = _Sampler(interval, threads=self._active, exclude=set(),
+                                     deadline=self._deadline, on_expire=self.cancel_route)
+            self.last_route_result = {'endpoint': endpoint, 'requests': self._remaining, 'done': False, 'output': ''}
+            self._sampler.start()
+            self.armed_endpoint = endpoint
+
+    def request_started(self, endpoint: Optional[str]) -> bool:
+        if self.armed_endpoint is None or endpoint != self.armed_endpoint:
+            return False
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            self._active.add(threading.get_ident())
+        return True
+
+    def request_finished(self) -> None:
+        finished = False
+        with self._lock:
+            self._active.discard(threading.get_ident())
+            if self.armed_endpoint is not None and (
+                (self._remaining <= 0 and not self._active) or time.monotonic() > self._deadline
+            ):
+                self.armed_endpoint = None
+                finished = True
+        if finished:
+            self._finish_route()
+
+    def _finish_route(self) -> None:
+        sampler, self._sampler = self._sampler, None
+        output = sampler.stop() if sampler else ''
+        with self._lock:
+            result = self.last_route_result or {}
+            result.update(done=True, output=output, samples=sampler.samples if sampler else 0)
+            self._busy = False
+
+    def cancel_route(self) -> None:
+        with self._lock:
+            if self.armed_endpoint is None:
+                return
+            self.armed_endpoint = None
+        self._finish_route()
+
+
+profiler = Profiler()
@@ -0,0 +1,247 @@
+"""
+Publish/subscribe fan-out for messaging threads and study-room presence.
+
+Clients hold one Server-Sent Events connection per open thread (see `/api/realtime/stream` in
+app.py); a message is written to the database once and then published to the thread's channel,
+so connected clients get it without polling. Each connection owns a bounded queue: a client
+that stops reading is disconnected instead of buffering without limit (it reconnects and
+replays what it missed from the database via `Last-Event-ID`).
+
+`LocalBroker` fans out within one process. `SqliteBroker` is a stand-in for Redis pub/sub on a
+single host: publishers append to a shared SQLite log and one background thread per process
+tails it and fans out locally, so several worker processes see each other's events at the cost
+of one query per poll interval per process, not per client.
+
+`PresenceTracker` counts connections per room and user in memory and publishes at most one
+presence event per room per `interval`, however many joins and leaves happened in between.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class Subscription:
+    def __init__(self, broker: 'LocalBroker', channels: Iterable[str], max_queue: int) -> None:
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.queue: 'queue.Queue[Optional[Dict]]' = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def deliver(self, event: Dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: drop the connection rather than grow the queue
+            self.overflowed = True
+            self.broker.unsubscribe(self)
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self, max_queue: int = 256) -> None:
+        self.max_queue = max_queue
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        sub = Subscription(self, channels, self.max_queue)
+        with self._lock:
+            for channel in sub.channels:
+                self._channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._channels.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._channels[channel]
+
+    def publish(self, channel: str, event: Dict) -> int:
+        """Deliver to this process's subscribers; returns how many received it."""
+        return self._fan_out(channel, event)
+
+    def _fan_out(self, channel: str, event: Dict) -> int:
+        with self._lock:
+            subs = list(self._channels.get(channel, ()))
+        for sub in subs:
+            sub.deliver(event)
+        with self._lock:
+            self.published += 1
+            self.delivered += len(subs)
+        return len(subs)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            connections = len({sub for subs in self._channels.values() for sub in subs})
+            channels = len(self._channels)
+        return {'backend': type(self).__name__, 'pid': os.getpid(), 'connections': connections,
+                'channels': channels, 'published': self.published, 'delivered': self.delivered}
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBroker(LocalBroker):
+    def __init__(self, path: str, poll_interval: float = 0.05, retention: float = 60.0, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS realtime_events ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, channel TEXT NOT NULL, event TEXT NOT NULL)'
+            )
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM realtime_events').fetchone()[0]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._tail, name='sciweb-realtime', daemon=True)
+        self._thread.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def publish(self, channel: str, event: Dict) -> int:
+        """Append to the shared log; every process (this one included) delivers it on its next poll."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT INTO realtime_events (created, channel, event) VALUES (?, ?, ?)',
+                (now, channel, json.dumps(event)),
+            )
+        return 0
+
+    def _tail(self) -> None:
+        last_trim = 0.0
+        while not self._stop.wait(self.poll_interval):
+            try:
+                conn = self._conn()
+                rows = conn.execute(
+                    'SELECT id, channel, event FROM realtime_events WHERE id > ? ORDER BY id', (self._last_id,)
+                ).fetchall()
+                for event_id, channel, payload in rows:
+                    self._last_id = event_id
+                    self._fan_out(channel, json.loads(payload))
+                now = time.time()
+                if now - last_trim > self.retention:
+                    with conn:
+                        conn.execute('DELETE FROM realtime_events WHERE created < ?', (now - self.retention,))
+                    last_trim = now
+            except sqlite3.Error:
+                continue  # locked or busy; retry next poll
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def create_broker(backend: str, **kwargs) -> LocalBroker:
+    """'memory' or 'sqlite:///path/to/file.db'."""
+    if backend.startswith('sqlite:///'):
+        return SqliteBroker(backend[len('sqlite:///'):], **kwargs)
+    return LocalBroker(**kwargs)
+
+
+class PresenceTracker:
+    """
+    Who is connected to which room, published as batched `presence` events on the room's channel.
+
+    Each process reports only its own connections, tagged with `node`; clients merge the member
+    lists of all nodes and drop nodes they have not heard from within `3 * heartbeat` seconds.
+    """
+
+    def __init__(self, broker: LocalBroker, channel_for, interval: float = 1.0, heartbeat: float = 15.0) -> None:
+        self.broker = broker
+        self.channel_for = channel_for
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.node = uuid.uuid4().hex[:12]
+        self._counts: Dict[int, Dict[Tuple[int, str], int]] = {}
+        self._dirty: Set[int] = set()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self.events_published = 0
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, name='sciweb-presence', daemon=True)
+            self._flusher.start()
+
+    def join(self, room_id: int, user_id: int, name: str) -> None:
+        with self._lock:
+            members = self._counts.setdefault(room_id, {})
+            key = (user_id, name)
+            members[key] = members.get(key, 0) + 1
+            if members[key] == 1:
+                self._dirty.add(room_id)
+            self._ensure_flusher()
+
+    def leave(self, room_id: int, user_id: int, name: str) -> None:
+        with self._lock:
+            members = self._counts.get(room_id, {})
+            key = (user_id, name)
+            if key not in members:
+                return
+            members[key] -= 1
+            if members[key] <= 0:
+                del members[key]
+                self._dirty.add(room_id)
+
+    def members(self, room_id: int) -> List[Dict]:
+        with self._lock:
+            return [{'id': user_id, 'name': name} for user_id, name in sorted(self._counts.get(room_id, {}))]
+
+    def flush(self, rooms: Optional[Iterable[int]] = None) -> int:
+        """Publish the current member list of dirty rooms (or of `rooms`); returns events published."""
+        with self._lock:
+            if rooms is None:
+                rooms, self._dirty = self._dirty, set()
+            snapshot = {
+                room_id: [{'id': u, 'name': n} for u, n in sorted(self._counts.get(room_id, {}))]
+                for room_id in rooms
+            }
+            for room_id, members in snapshot.items():
+                if not members:
+                    self._counts.pop(room_id, None)
+        for room_id, members in snapshot.items():
+            self.broker.publish(self.channel_for(room_id), {
+                'type': 'presence', 'room': room_id, 'node': self.node, 'members': members, 'ts': time.time(),
+            })
+        self.events_published += len(snapshot)
+        return len(snapshot)
+
+    def _run(self) -> None:
+        last_heartbeat = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+            if time.monotonic() - last_heartbeat >= self.heartbeat:
+                with self._lock:
+                    occupied = [room_id for room_id, members in self._counts.items() if members]
+                self.flush(occupied)
+                last_heartbeat = time.monotonic()
@@ -0,0 +1,237 @@
+"""
+Project-wide retrieval of relevant past messages.
+
+Messages are embedded locally with a signed feature-hashing embedder (no model download, no
+external service) and kept in a per-project NumPy matrix. Indexes are built lazily from the
+database and caught up with newer messages (by id, re-scanning a trailing window of ids for rows
+that committed late) on every search, so every write path (chat, import, rehydration) is picked up
+without hooks. Each search embeds a bounded number of rows, newest first, so a large project is
+backfilled over several searches rather than inside one request; messages that have been archived
+or deleted are dropped from the index when a search runs into them. Only a bounded number of
+projects is kept in memory.
+"""
+
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, Conversation, Message
+
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9\-']+")
+STOPWORDS = frozenset(
+    'the and for are but not you your with this that from have has was were what when where which who why how'
+    ' can could would should will about into than then them they there their its it\'s our out all any also'
+    ' just like more most some such only very let\'s lets'.split()
+)
+
+
+class HashingEmbedder:
+    """Unigrams and bigrams hashed into `dim` signed buckets, log-scaled and L2-normalized."""
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        tokens = [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+        return tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+
+class ProjectIndex:
+    """Embeddings of one project's messages, stored row-wise in a growable float32 matrix."""
+
+    def __init__(self, dim: int) -> None:
+        self.vectors = np.zeros((64, dim), dtype=np.float32)
+        self.message_ids = np.zeros(64, dtype=np.int64)
+        self.positions: Dict[int, int] = {}
+        self.size = 0
+        self.max_message_id = 0
+        # Older messages below this id still to be embedded; None until the index is first built
+        self.backfill_below: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def add(self, message_id: int, vector: np.ndarray) -> None:
+        if self.size == len(self.message_ids):
+            self.vectors = np.resize(self.vectors, (self.size * 2, self.vectors.shape[1]))
+            self.message_ids = np.resize(self.message_ids, self.size * 2)
+        self.vectors[self.size] = vector
+        self.message_ids[self.size] = message_id
+        self.positions[message_id] = self.size
+        self.size += 1
+        self.max_message_id = max(self.max_message_id, message_id)
+
+    def remove(self, message_id: int) -> None:
+        i = self.positions.pop(message_id, None)
+        if i is None:
+            return
+        # Move the last row into the gap
+        last = self.size - 1
+        if i != last:
+            self.vectors[i] = self.vectors[last]
+            self.message_ids[i] = self.message_ids[last]
+            self.positions[int(self.message_ids[i])] = i
+        self.size = last
+
+    def top(self, query: np.ndarray, k: int, exclude: Set[int], min_score: float) -> List[tuple]:
+        if self.size == 0:
+            return []
+        scores = self.vectors[:self.size] @ query
+        # Over-fetch so excluded or deleted (archived) messages don't starve the result
+        n = min(self.size, k + len(exclude) + k)
+        candidates = np.argpartition(-scores, n - 1)[:n] if n < self.size else np.arange(self.size)
+        ranked = candidates[np.argsort(-scores[candidates])]
+        results = []
+        for i in ranked:
+            if scores[i] < min_score:
+                break
+            message_id = int(self.message_ids[i])
+            if message_id not in exclude:
+                results.append((message_id, float(scores[i])))
+        return results
+
+
+class VectorIndexRegistry:
+    def __init__(
+        self,
+        embedder: Optional[HashingEmbedder] = None,
+        max_projects: int = 64,
+        chunk_size: int = 2000,
+        rescan_window: int = 256,
+    ) -> None:
+        self.embedder = embedder or HashingEmbedder()
+        self.max_projects = max_projects
+        self.chunk_size = chunk_size  # most messages embedded by a single search
+        self.rescan_window = rescan_window
+        self._indexes: 'OrderedDict[int, ProjectIndex]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, project_id: int) -> ProjectIndex:
+        with self._lock:
+            index = self._indexes.get(project_id)
+            if index is None:
+                index = self._indexes[project_id] = ProjectIndex(self.embedder.dim)
+                while len(self._indexes) > self.max_projects:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(project_id)
+            return index
+
+    def _catch_up(self, project_id: int, index: ProjectIndex) -> None:
+        in_project = (
+            select(Message.id, Message.content)
+            .join(Conversation, Message.conversation_id == Conversation.id)
+            .where(Conversation.project_id == project_id)
+        )
+        if index.backfill_below is None:
+            newest = db.session.scalar(
+                select(func.max(Message.id))
+                .join(Conversation, Message.conversation_id == Conversation.id)
+                .where(Conversation.project_id == project_id)
+            ) or 0
+            index.max_message_id = newest
+            index.backfill_below = max(newest - self.rescan_window, 0) + 1
+        budget = self.chunk_size
+
+        # Newer messages. Ids are assigned before commit, so a row can appear below the highest id
+        # already indexed; the trailing window picks those up
+        rows = db.session.execute(
+            in_project.where(Message.id > index.max_message_id - self.rescan_window)
+            .order_by(Message.id)
+            .limit(budget + self.rescan_window)
+        ).all()
+        for r in rows:
+            if r.id in index.positions:
+                continue
+            if budget == 0:
+                break
+            index.add(r.id, self.embedder.embed(r.content))
+            budget -= 1
+
+        # Older messages, newest first, until the whole project is indexed
+        if budget and index.backfill_below > 1:
+            rows = db.session.execute(
+                in_project.where(Message.id < index.backfill_below).order_by(Message.id.desc()).limit(budget)
+            ).all()
+            for r in rows:
+                if r.id not in index.positions:
+                    index.add(r.id, self.embedder.embed(r.content))
+            index.backfill_below = rows[-1].id if len(rows) == budget else 1
+
+    def search(
+        self,
+        project_id: int,
+        query: str,
+        k: int = 4,
+        exclude_message_ids: Iterable[int] = (),
+        min_score: float = 0.2,
+    ) -> List[Dict]:
+        """Top-k messages of the project most similar to `query`: [{message_id, conversation_id, conversation_title, role, content, score}]."""
+        index = self._index(project_id)
+        exclude = set(exclude_message_ids)
+        vector = self.embedder.embed(query)
+        with index.lock:
+            self._catch_up(project_id, index)
+        while True:
+            with index.lock:
+                hits = index.top(vector, k, exclude, min_score)
+            if not hits:
+                return []
+            rows = {
+                r.id: r for r in db.session.execute(
+                    select(Message.id, Message.role, Message.content, Message.conversation_id, Conversation.title)
+                    .join(Conversation, Message.conversation_id == Conversation.id)
+                    .where(Message.id.in_([message_id for message_id, _ in hits]))
+                ).all()
+            }
+            results = []
+            dead = []
+            for message_id, score in hits:
+                row = rows.get(message_id)
+                if row is None:
+                    dead.append(message_id)  # archived or deleted since it was indexed
+                    continue
+                results.append({
+                    'message_id': message_id,
+                    'conversation_id': row.conversation_id,
+                    'conversation_title': row.title,
+                    'role': row.role,
+                    'content': row.content,
+                    'score': score,
+                })
+                if len(results) == k:
+                    break
+            if dead:
+                with index.lock:
+                    for message_id in dead:
+                        index.remove(message_id)
+            # Rank again without the dead rows if they crowded out live ones
+            if len(results) == k or not dead:
+                return results
+
+
+def format_snippets(hits: List[Dict], max_chars: int = 300) -> str:
+    """Render search hits as a compact context block for the system prompt."""
+    lines = ['Relevant excerpts from earlier in this learning project (use only if helpful):']
+    for h in hits:
+        text = ' '.join(h['content'].split())
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(' ', 1)[0] + '…'
+        lines.append(f"- [{h['conversation_title']}, {h['role']}] {text}")
+    return '\n'.join(lines)
+
+
+vector_indexes = VectorIndexRegistry()
@@ -0,0 +1,189 @@
+"""
+Upload storage for the grade scanner.
+
+`LocalContentStore` keeps each distinct file once, named by its SHA-256 digest and sharded into
+two levels of subdirectories (`ab/cd/abcd...`), so identical re-uploads cost no extra disk and no
+directory grows without bound. `StoredFile` rows track how many submissions reference each
+digest; `collect_garbage` removes unreferenced files and files that never got a row.
+
+Uploads and GC are ordered through the digest's StoredFile row. An upload first spools and hashes
+into a staging file, then upserts the row (taking the row's write lock), and only then moves the
+content into place. GC deletes a row and unlinks its file in the same transaction. So either GC
+sees the new reference and keeps the file, or it finished unlinking before the upload's row
+write, which then puts the file back.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+from flask import current_app
+
+from db_routing import dialect_insert
+from models import db, StoredFile
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StorageBackend:
+    def stage(self, stream: BinaryIO) -> Tuple[str, int, str]:
+        """Spool and hash the stream without publishing it; returns (digest, size, staged handle)."""
+        raise NotImplementedError
+
+    def publish(self, digest: str, staged: str) -> None:
+        """Make staged content readable under its digest, replacing any existing copy."""
+        raise NotImplementedError
+
+    def discard(self, staged: str) -> None:
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, digest: str) -> str:
+        """Filesystem path for zero-copy serving."""
+        raise NotImplementedError
+
+    def delete(self, digest: str) -> None:
+        raise NotImplementedError
+
+    def iter_digests(self) -> Iterator[Tuple[str, float]]:
+        """Yield (digest, modified time) of every stored file."""
+        raise NotImplementedError
+
+    def cleanup_partial(self, older_than: float) -> None:
+        """Remove leftovers of interrupted writes older than the given timestamp."""
+
+
+class LocalContentStore(StorageBackend):
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+
+    def local_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.local_path(digest))
+
+    def stage(self, stream: BinaryIO) -> Tuple[str, int, str]:
+        hasher = hashlib.sha256()
+        size = 0
+        # Hash while spooling to a temp file on the same filesystem so the final move is atomic
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+        return hasher.hexdigest(), size, tmp_path
+
+    def publish(self, digest: str, staged: str) -> None:
+        # Always replace: same bytes, fresh mtime, so an orphan sweep cannot take a file being re-referenced
+        path = self.local_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged, path)
+
+    def discard(self, staged: str) -> None:
+        try:
+            os.remove(staged)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.remove(self.local_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def iter_digests(self) -> Iterator[Tuple[str, float]]:
+        for shard in os.listdir(self.root):
+            if len(shard) != 2:
+                continue  # skips tmp/
+            for sub in os.listdir(os.path.join(self.root, shard)):
+                directory = os.path.join(self.root, shard, sub)
+                for name in os.listdir(directory):
+                    yield name, os.path.getmtime(os.path.join(directory, name))
+
+    def cleanup_partial(self, older_than: float) -> None:
+        tmp_dir = os.path.join(self.root, 'tmp')
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if os.path.getmtime(path) < older_than:
+                os.remove(path)
+
+
+def get_storage() -> StorageBackend:
+    store = current_app.extensions.get('sciweb_storage')
+    if store is None:
+        store = current_app.extensions['sciweb_storage'] = LocalContentStore(current_app.config['UPLOAD_STORAGE_ROOT'])
+    return store
+
+
+def store_upload(stream: BinaryIO, content_type: str) -> StoredFile:
+    """Store an upload and add a reference to it. The caller commits."""
+    store = get_storage()
+    digest, size, staged = store.stage(stream)
+    try:
+        # One statement for first and repeat uploads, so concurrent first uploads can't both insert
+        db.session.execute(
+            dialect_insert(db.session, StoredFile)
+            .values(digest=digest, size=size, content_type=content_type, ref_count=1)
+            .on_conflict_do_update(index_elements=['digest'], set_={'ref_count': StoredFile.ref_count + 1})
+        )
+        # Published only after the row write, see the module docstring
+        store.publish(digest, staged)
+    except BaseException:
+        store.discard(staged)
+        raise
+    return db.session.get(StoredFile, digest, populate_existing=True)
+
+
+def release(digest: str) -> None:
+    """Drop one reference; the file itself is removed by `collect_garbage`. The caller commits."""
+    db.session.query(StoredFile).filter_by(digest=digest).update({StoredFile.ref_count: StoredFile.ref_count - 1})
+
+
+def collect_garbage(grace_seconds: int = 3600) -> Dict[str, int]:
+    """
+    Delete files whose reference count dropped to zero, and files on disk with no StoredFile row
+    that are older than `grace_seconds` (left by uploads that failed before commit).
+    """
+    store = get_storage()
+    report = {'released': 0, 'orphans': 0, 'bytes_freed': 0}
+    for digest, size in db.session.query(StoredFile.digest, StoredFile.size).filter(StoredFile.ref_count <= 0).all():
+        # Re-check the count in the DELETE itself: a concurrent upload may have re-referenced it.
+        # The file is unlinked before commit, while the DELETE still locks out uploads of this digest.
+        try:
+            deleted = db.session.query(StoredFile).filter(
+                StoredFile.digest == digest, StoredFile.ref_count <= 0
+            ).delete(synchronize_session=False)
+            if deleted:
+                store.delete(digest)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if deleted:
+            report['released'] += 1
+            report['bytes_freed'] += size
+
+    cutoff = time.time() - grace_seconds
+    known = {digest for (digest,) in db.session.query(StoredFile.digest)}
+    for digest, mtime in list(store.iter_digests()):
+        if digest not in known and mtime < cutoff:
+            report['bytes_freed'] += os.path.getsize(store.local_path(digest))
+            store.delete(digest)
+            report['orphans'] += 1
+    store.cleanup_partial(cutoff)
+    return report
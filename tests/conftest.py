@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its configuration at import time, so point it at scratch storage first
+_scratch = tempfile.mkdtemp(prefix='sciweb-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ['ADMIN_EMAILS'] = 'admin@example.com'
+for key in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GOOGLE_API_KEY'):
+    os.environ.pop(key, None)
+
+from app import app as flask_app  # noqa: E402
+from models import db, User, Project, Conversation  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    flask_app.config['TESTING'] = True
+    flask_app.config['UPLOAD_STORAGE_ROOT'] = str(tmp_path / 'uploads')
+    flask_app.extensions.pop('sciweb_storage', None)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    user = User(email='student@example.com', password_hash='x', display_name='Student')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def conversation(user):
+    project = Project(owner_id=user.id, title='Thermodynamics')
+    db.session.add(project)
+    db.session.flush()
+    conversation = Conversation(project_id=project.id, title='Entropy')
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import analytics
+from models import db, GradeSubmission, GradeWeeklyRollup, ProblemMissRollup
+
+
+def _graded(user, title, score, rubric, graded_at):
+    submission = GradeSubmission(
+        user_id=user.id, title=title, subject='Physics', image_filename='page.png', image_path='page.png',
+        status='graded', overall_score=score, earned_points=score / 10, total_points=10.0,
+        grading_rubric=rubric, graded_at=graded_at,
+    )
+    db.session.add(submission)
+    db.session.flush()
+    analytics.apply(analytics.snapshot(submission))
+    db.session.commit()
+    return submission
+
+
+def _rollups():
+    weekly = {
+        (r.subject, r.week_start): (r.submissions, round(r.score_sum, 6), round(r.earned_sum, 6), round(r.total_sum, 6))
+        for r in GradeWeeklyRollup.query.all() if r.submissions
+    }
+    missed = {(r.assignment, r.problem): (r.attempts, r.misses) for r in ProblemMissRollup.query.all() if r.attempts}
+    return weekly, missed
+
+
+def test_string_false_counts_as_a_miss(user):
+    submission = GradeSubmission(
+        user_id=user.id, title='Quiz', status='graded', graded_at=datetime(2024, 3, 6),
+        grading_rubric=[
+            {'problem': '1', 'is_correct': 'false'},
+            {'problem': '2', 'is_correct': 'True'},
+            {'problem': '3', 'is_correct': 0},
+            {'problem': '4'},
+        ],
+    )
+    assert analytics.snapshot(submission)['problems'] == [('1', True), ('2', False), ('3', True), ('4', True)]
+
+
+def test_incremental_rollups_match_a_rebuild_after_regrade_and_delete(user):
+    monday = datetime(2024, 3, 4, 10)
+    first = _graded(user, 'Kinematics', 60.0, [{'problem': '1', 'is_correct': False}, {'problem': '2', 'is_correct': True}], monday)
+    _graded(user, 'Kinematics', 80.0, [{'problem': '1', 'is_correct': 'false'}], monday + timedelta(days=2))
+    doomed = _graded(user, 'Energy', 40.0, [{'problem': '3', 'is_correct': 'no'}], monday + timedelta(days=8))
+
+    # Re-grade into a different week with a different outcome, as api_grader_grade does
+    previous = analytics.snapshot(first)
+    first.overall_score, first.earned_points = 95.0, 9.5
+    first.grading_rubric = [{'problem': '1', 'is_correct': 'true'}, {'problem': '2', 'is_correct': True}]
+    first.graded_at = monday + timedelta(days=9)
+    analytics.apply(previous, sign=-1)
+    analytics.apply(analytics.snapshot(first))
+    db.session.commit()
+
+    # Delete, as api_grader_delete does
+    analytics.apply(analytics.snapshot(doomed), sign=-1)
+    db.session.delete(doomed)
+    db.session.commit()
+
+    incremental = _rollups()
+    assert incremental[1] == {('Kinematics', '1'): (2, 1), ('Kinematics', '2'): (1, 0)}
+    assert analytics.rebuild(user.id) == 2
+    assert _rollups() == incremental
@@ -0,0 +1,106 @@
+import json
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from archive import archive_conversation, compact, ensure_hydrated, iter_archived_messages
+from models import db, Conversation, ConversationArchive, Message
+
+
+def _add(conversation_id, content, created_at):
+    db.session.execute(insert(Message), [{
+        'conversation_id': conversation_id, 'role': 'user', 'content': content, 'created_at': created_at,
+    }])
+
+
+def test_archive_removes_rows_whose_ids_are_out_of_time_order(conversation):
+    old = datetime.utcnow() - timedelta(days=200)
+    # Higher id, earlier timestamp: e.g. an imported message
+    _add(conversation.id, 'second', old + timedelta(minutes=1))
+    _add(conversation.id, 'first', old)
+    db.session.commit()
+
+    archive_conversation(conversation.id)
+    db.session.commit()
+    assert Message.query.count() == 0
+    assert [m['content'] for m in iter_archived_messages(conversation.id)] == ['first', 'second']
+
+
+def test_rearchive_after_hydration_does_not_duplicate(conversation):
+    old = datetime.utcnow() - timedelta(days=200)
+    for n in range(3):
+        _add(conversation.id, f'message {n}', old + timedelta(minutes=n))
+    db.session.commit()
+    assert compact(idle_days=90)['messages'] == 3
+
+    ensure_hydrated(db.session.get(Conversation, conversation.id))
+    assert Message.query.count() == 3
+    _add(conversation.id, 'late reply', old + timedelta(minutes=10))
+    db.session.commit()
+    assert compact(idle_days=90)['messages'] == 4
+
+    archive = ConversationArchive.query.filter_by(conversation_id=conversation.id).one()
+    contents = [m['content'] for m in json.loads(zlib.decompress(archive.payload))]
+    assert contents == ['message 0', 'message 1', 'message 2', 'late reply']
+    assert archive.message_count == 4 and Message.query.count() == 0
+
+
+def test_message_written_after_read_stays_hot(conversation):
+    old = datetime.utcnow() - timedelta(days=200)
+    _add(conversation.id, 'archived', old)
+    db.session.commit()
+    archive_conversation(conversation.id)
+    # A message that lands before the commit is not in this archive pass and must not be deleted
+    _add(conversation.id, 'raced in', datetime.utcnow())
+    db.session.commit()
+    assert [m.content for m in Message.query.all()] == ['raced in']
+
+
+def _archived(conversation, count=3):
+    old = datetime.utcnow() - timedelta(days=200)
+    for n in range(count):
+        _add(conversation.id, f'message {n}', old + timedelta(minutes=n))
+    db.session.commit()
+    assert compact(idle_days=90)['messages'] == count
+
+
+def test_hydrating_a_stale_conversation_twice_does_not_duplicate(app, conversation):
+    _archived(conversation)
+    stale = db.session.get(Conversation, conversation.id)
+    assert stale.archived_at is not None
+
+    # Another request hydrates first; this session still holds the archived row
+    def other_request():
+        with app.app_context():
+            assert ensure_hydrated(db.session.get(Conversation, conversation.id))
+    worker = threading.Thread(target=other_request)
+    worker.start()
+    worker.join()
+
+    assert stale.archived_at is not None
+    assert not ensure_hydrated(stale)
+    assert stale.archived_at is None
+    assert Message.query.count() == 3
+    assert ConversationArchive.query.count() == 0
+
+
+def test_concurrent_hydration_inserts_messages_once(app, conversation):
+    _archived(conversation)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def request():
+        with app.app_context():
+            loaded = db.session.get(Conversation, conversation.id)
+            barrier.wait()
+            results.append(ensure_hydrated(loaded))
+    workers = [threading.Thread(target=request) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(results) == [False, False, False, True]
+    assert sorted(m.content for m in Message.query.all()) == ['message 0', 'message 1', 'message 2']
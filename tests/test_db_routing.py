@@ -0,0 +1,83 @@
+import pytest
+from flask import Flask, g
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+
+from db_routing import configure_engines, RoutingSession, use_read_replica
+
+
+@pytest.fixture
+def routed(tmp_path):
+    """A separate app with a primary and a 'replica' SQLite bind holding different rows."""
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+        SQLALCHEMY_BINDS={'replica': f"sqlite:///{tmp_path / 'replica.db'}"},
+        SQLITE_PRAGMAS={'journal_mode': 'WAL', 'busy_timeout': 4321},
+    )
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+    class Note(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        body = db.Column(db.String(50))
+
+    configure_engines(app, db)
+    with app.app_context():
+        for engine, body in ((db.engines[None], 'primary'), (db.engines['replica'], 'replica')):
+            Note.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(Note.__table__.insert().values(id=1, body=body))
+        yield app, db, Note
+
+
+def test_selects_use_the_primary_by_default(routed):
+    app, db, Note = routed
+    with app.test_request_context():
+        assert db.session.get(Note, 1).body == 'primary'
+
+
+def test_read_replica_views_select_from_the_replica(routed):
+    app, db, Note = routed
+
+    @use_read_replica
+    def view():
+        return db.session.execute(db.select(Note.body)).scalar()
+
+    with app.test_request_context():
+        assert view() == 'replica'
+        assert g.use_read_replica
+
+
+def test_writes_and_pending_changes_stay_on_the_primary(routed):
+    app, db, Note = routed
+    with app.test_request_context():
+        g.use_read_replica = True
+        db.session.add(Note(id=2, body='new'))
+        # Pending changes pin reads to the primary (autoflush writes them there first)
+        assert db.session.execute(db.select(Note.body).where(Note.id == 2)).scalar() == 'new'
+        db.session.commit()
+        replica = db.engines['replica']
+        with replica.connect() as conn:
+            assert conn.execute(text('SELECT count(*) FROM note')).scalar() == 1
+        with db.engines[None].connect() as conn:
+            assert conn.execute(text('SELECT count(*) FROM note')).scalar() == 2
+        # After the commit, reads go back to the replica
+        assert db.session.execute(db.select(Note.body).where(Note.id == 1)).scalar() == 'replica'
+
+
+def test_reads_after_a_core_write_stay_on_the_primary(routed):
+    app, db, Note = routed
+    with app.test_request_context():
+        g.use_read_replica = True
+        db.session.execute(Note.__table__.update().values(body='edited'))
+        assert db.session.execute(db.select(Note.body)).scalar() == 'edited'
+        db.session.rollback()
+        assert db.session.execute(db.select(Note.body)).scalar() == 'replica'
+
+
+def test_sqlite_pragmas_are_applied_to_every_engine(routed):
+    app, db, Note = routed
+    for engine in db.engines.values():
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 4321
@@ -0,0 +1,73 @@
+import io
+import json
+
+import pytest
+
+import app as app_module
+from models import db, ActivityEvent, FeedEntry, GradeSubmission, StoredFile
+
+
+class _Provider:
+    def __init__(self, reply):
+        self.reply = reply
+
+    def chat(self, messages, model=None, user_id=None):
+        return json.dumps(self.reply)
+
+
+@pytest.fixture
+def submission(user, tmp_path):
+    image = tmp_path / 'page.png'
+    image.write_bytes(b'not really a png')
+    submission = GradeSubmission(user_id=user.id, title='Kinematics quiz', image_filename='page.png',
+                                 image_path=str(image))
+    db.session.add(submission)
+    db.session.commit()
+    return submission
+
+
+@pytest.mark.parametrize('score, stored', [(None, 0.0), ('85', 85.0), ('n/a', 0.0), (92.5, 92.5)])
+def test_grading_tolerates_null_and_string_scores(client, submission, monkeypatch, score, stored):
+    reply = {'overall_score': score, 'earned_points': '17', 'total_points': None, 'feedback': 'Solid work.'}
+    monkeypatch.setattr(app_module, 'get_default_provider', lambda: _Provider(reply))
+    response = client.post(f'/api/grader/grade/{submission.id}', json={'answer_key': '', 'rubric': ''})
+    assert response.status_code == 200
+    db.session.expire_all()
+    graded = db.session.get(GradeSubmission, submission.id)
+    assert graded.status == 'graded'
+    assert (graded.overall_score, graded.earned_points, graded.total_points) == (stored, 17.0, 100.0)
+    assert ActivityEvent.query.one().preview.startswith(f'{stored:g}%')
+
+
+def test_regrading_replaces_the_feed_event(client, submission, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_default_provider', lambda: _Provider({'overall_score': 70, 'feedback': 'Ok'}))
+    client.post(f'/api/grader/grade/{submission.id}', json={})
+    monkeypatch.setattr(app_module, 'get_default_provider', lambda: _Provider({'overall_score': 90, 'feedback': 'Better'}))
+    client.post(f'/api/grader/grade/{submission.id}', json={})
+    event = ActivityEvent.query.filter_by(submission_id=submission.id).one()
+    assert event.preview.startswith('90%')
+    assert FeedEntry.query.count() == 1
+
+
+def _upload(client, filename, mimetype):
+    data = {'file': (io.BytesIO(b'%PDF-1.4 <script>alert(1)</script>'), filename, mimetype)}
+    response = client.post('/api/grader/submit', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['submission_id']
+
+
+def test_served_type_comes_from_the_filename_not_the_client(client):
+    # Same bytes twice: the first client claims text/html, the second a PDF claims to be an image
+    html_id = _upload(client, 'answers.png', 'text/html')
+    pdf_id = _upload(client, 'answers.pdf', 'image/png')
+    assert StoredFile.query.one().content_type == 'image/png'
+
+    response = client.get(f'/grader/file/{html_id}')
+    assert response.mimetype == 'image/png'
+    assert 'attachment' not in response.headers.get('Content-Disposition', '')
+    response.close()
+
+    response = client.get(f'/grader/file/{pdf_id}')
+    assert response.mimetype == 'application/pdf'
+    assert response.headers['Content-Disposition'].startswith('attachment')
+    response.close()
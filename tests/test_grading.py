@@ -0,0 +1,43 @@
+import pytest
+
+from grading import build_grading_messages, check_answers, is_simple_answer, local_result, parse_answers, parse_points
+
+
+def test_parse_answers_requires_whitespace_after_separator():
+    assert parse_answers('1. 42\n2) B\nQ3: 1/2\nProblem 4 - -3\n1.5\n') == {
+        '1': '42', '2': 'B', '3': '1/2', '4': '-3',
+    }
+    assert parse_answers('1. 1.5') == {'1': '1.5'}
+
+
+@pytest.mark.parametrize('answer, simple', [
+    ('42', True), ('-0.5', True), ('3/4', True), ('1,000', True), ('B', True), ('(c)', True),
+    ('x^2+2x+1', False), ('mitochondria', False), ('x = 3', False), ('the mitochondria', False),
+])
+def test_is_simple_answer(answer, simple):
+    assert is_simple_answer(answer) is simple
+
+
+def test_free_text_and_algebra_go_to_the_model():
+    key = {'1': 'x^2+2x+1', '2': 'mitochondria', '3': '0.75', '4': 'C'}
+    typed = {'1': '(x+1)^2', '2': 'the mitochondria', '3': '3/4', '4': '(c)'}
+    checked, unresolved = check_answers(key, typed)
+    assert unresolved == ['1', '2']
+    assert [(p['problem'], p['is_correct']) for p in checked] == [('3', True), ('4', True)]
+
+
+def test_non_numeric_reply_to_numeric_question_goes_to_the_model():
+    checked, unresolved = check_answers({'1': '42'}, {'1': 'forty-two'})
+    assert checked == [] and unresolved == ['1']
+
+
+def test_local_scores_use_rubric_points():
+    points = parse_points('1. 5 points - exact value\nProblem 2: 2 pts\n3) show work')
+    assert points == {'1': 5.0, '2': 2.0}
+    checked, unresolved = check_answers({'1': '42', '2': 'A', '3': '7'}, {'1': '42', '2': 'B', '3': '7'}, points)
+    assert unresolved == []
+    result = local_result(checked)
+    assert (result['earned_points'], result['total_points']) == (6.0, 8.0)
+    assert result['overall_score'] == 75.0
+    content = build_grading_messages('prefix', 'Quiz', checked, ['4'])[1]['content']
+    assert '1 (correct, 5/5 points)' in content and '2 (incorrect, 0/2 points)' in content
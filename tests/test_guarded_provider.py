@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from chat_providers import GuardedProvider, RateLimitError, StubProvider
+
+
+MESSAGES = [{'role': 'user', 'content': 'Explain entropy'}]
+
+
+def test_coalesced_requests_do_not_charge_the_user_bucket():
+    inner = StubProvider(latency=0.2)
+    guarded = GuardedProvider(inner, rate=100, burst=100, user_rate=0.01, user_burst=1)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(guarded.chat(MESSAGES, user_id='leader')))
+    leader.start()
+    time.sleep(0.05)
+    # The follower's only token is untouched because its request shares the leader's call
+    results.append(guarded.chat(MESSAGES, user_id='follower'))
+    leader.join()
+    assert inner.calls == 1 and len(results) == 2
+    assert guarded.stats()['coalesced'] == 1
+    guarded.chat([{'role': 'user', 'content': 'Something else'}], user_id='follower')
+    with pytest.raises(RateLimitError):
+        guarded.chat([{'role': 'user', 'content': 'A third question'}], user_id='follower')
+
+
+def test_idle_user_buckets_are_evicted():
+    guarded = GuardedProvider(StubProvider(), rate=1000, burst=1000, user_rate=100, user_burst=1)
+    for n in range(50):
+        guarded.chat([{'role': 'user', 'content': str(n)}], user_id=n)
+    assert len(guarded._user_buckets) == 50
+    time.sleep(0.02)  # every bucket refills to capacity
+    guarded.chat(MESSAGES, user_id='new')
+    assert list(guarded._user_buckets) == ['new']
+
+
+def test_provider_stats_are_admin_only(app, client):
+    assert client.get('/api/provider/stats').status_code == 403
+
+
+def test_follower_of_a_hung_call_times_out():
+    inner = StubProvider(latency=0.5)
+    guarded = GuardedProvider(inner, rate=100, burst=100, max_wait=0.1)
+    leader = threading.Thread(target=guarded.chat, args=(MESSAGES,))
+    leader.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    with pytest.raises(RateLimitError):
+        guarded.chat(MESSAGES)
+    assert time.monotonic() - started < 0.4
+    assert guarded.stats()['rejected_timeout'] == 1
+    leader.join()
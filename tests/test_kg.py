@@ -0,0 +1,101 @@
+import warnings
+
+from kg import add_occurrences, concept_key, intern_concepts, replace_knowledge_graphs
+from models import db, Concept, ConceptOccurrence, Conversation, KnowledgeEdge, KnowledgeNode, Project, User
+
+
+NODES = [{'label': 'Entropy', 'type': 'concept', 'count': 2}, {'label': 'Heat', 'type': 'concept', 'count': 1}]
+EDGES = [{'source': 'Entropy', 'target': 'Heat', 'relation': 'related_to'}]
+
+
+def test_chunk_of_deleted_conversations_writes_nothing(app):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert replace_knowledge_graphs({998: (NODES, EDGES), 999: (NODES, [])}) == {}
+    db.session.commit()
+    assert KnowledgeNode.query.count() == 0 and ConceptOccurrence.query.count() == 0
+
+
+def test_chunk_with_some_deleted_conversations(conversation):
+    new = replace_knowledge_graphs({conversation.id: (NODES, EDGES), 999: (NODES, EDGES)})
+    db.session.commit()
+    assert new == {conversation.id: ['Entropy', 'Heat']}
+    assert KnowledgeNode.query.count() == 2 and KnowledgeEdge.query.count() == 1
+    assert {o.frequency for o in ConceptOccurrence.query} == {1, 2}
+
+
+def test_replacing_a_graph_reuses_concepts(conversation):
+    replace_knowledge_graphs({conversation.id: (NODES, EDGES)})
+    new = replace_knowledge_graphs({conversation.id: (NODES[:1], [])})
+    db.session.commit()
+    assert new == {}
+    assert Concept.query.count() == 2 and KnowledgeNode.query.count() == 1 and KnowledgeEdge.query.count() == 0
+
+
+def test_concepts_are_interned_per_user_by_normalized_key(user):
+    other = User(email='other@example.com', password_hash='x', display_name='Other')
+    db.session.add(other)
+    db.session.flush()
+    assert concept_key('  Specific   HEAT ') == 'specific heat'
+
+    created = []
+    ids = intern_concepts(user.id, ['Entropy', ' entropy', 'Specific heat'], created)
+    assert sorted(ids) == ['entropy', 'specific heat'] and sorted(created) == ['entropy', 'specific heat']
+    created = []
+    assert intern_concepts(user.id, ['ENTROPY'], created) == {'entropy': ids['entropy']} and created == []
+    assert intern_concepts(other.id, ['Entropy'])['entropy'] != ids['entropy']
+    assert Concept.query.filter_by(user_id=user.id, key='entropy').one().label == 'Entropy'
+
+
+def test_occurrences_accumulate_per_conversation(conversation):
+    concept_id = intern_concepts(conversation.project.owner_id, ['Entropy'])['entropy']
+    add_occurrences(conversation.id, conversation.project_id, {concept_id: 2})
+    add_occurrences(conversation.id, conversation.project_id, {concept_id: 3})
+    db.session.commit()
+    assert ConceptOccurrence.query.one().frequency == 5
+
+
+def test_concept_lookup_lists_occurrences_across_projects(client, user, conversation):
+    project = Project(owner_id=user.id, title='Engines')
+    db.session.add(project)
+    db.session.flush()
+    carnot = Conversation(project_id=project.id, title='Carnot cycle')
+    db.session.add(carnot)
+    db.session.flush()
+    replace_knowledge_graphs({
+        conversation.id: (NODES, EDGES),
+        carnot.id: ([{'label': 'entropy', 'type': 'concept', 'count': 5}], []),
+    })
+    db.session.commit()
+
+    body = client.get('/api/concepts/lookup?q=%20ENTROPY%20').get_json()
+    assert body['concept']['label'] == 'Entropy' and body['total_frequency'] == 7
+    assert [(o['project_title'], o['conversation_title'], o['frequency']) for o in body['occurrences']] == [
+        ('Engines', 'Carnot cycle', 5),
+        ('Thermodynamics', 'Entropy', 2),
+    ]
+
+    # Re-extracting a conversation without the concept drops it from the index
+    replace_knowledge_graphs({carnot.id: ([{'label': 'Work', 'type': 'concept', 'count': 1}], [])})
+    db.session.commit()
+    body = client.get('/api/concepts/lookup?q=entropy').get_json()
+    assert [o['conversation_id'] for o in body['occurrences']] == [conversation.id]
+
+    assert client.get('/api/concepts/lookup?q=enthalpy').get_json() == {'concept': None, 'occurrences': []}
+    assert client.get('/api/concepts/lookup?q=%20').status_code == 400
+
+
+def test_concept_lookup_only_sees_the_current_users_concepts(client, app):
+    other = User(email='other@example.com', password_hash='x', display_name='Other')
+    db.session.add(other)
+    db.session.flush()
+    project = Project(owner_id=other.id, title='Private')
+    db.session.add(project)
+    db.session.flush()
+    private = Conversation(project_id=project.id, title='Notes')
+    db.session.add(private)
+    db.session.flush()
+    replace_knowledge_graphs({private.id: (NODES, [])})
+    db.session.commit()
+
+    assert client.get('/api/concepts/lookup?q=entropy').get_json()['concept'] is None
@@ -0,0 +1,104 @@
+import pytest
+
+import app as app_module
+import outline_sessions
+from models import Message, Project
+from outline_sessions import MemorySessionStore, create_store
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(outline_sessions, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    backend = 'memory' if request.param == 'memory' else f"sqlite:///{tmp_path / 'outline.db'}"
+    return lambda **kwargs: create_store(backend, **kwargs)
+
+
+def _turn(n):
+    return {'role': 'user', 'content': f'turn {n}'}
+
+
+def test_sessions_expire_after_ttl_without_use(make_store, clock):
+    store = make_store(ttl=60, max_sessions=10, max_history=24)
+    store.append('a', [_turn(1)])
+    clock.now += 50
+    store.append('a', [_turn(2)])  # use refreshes the session
+    clock.now += 50
+    assert store.get('a') == [_turn(1), _turn(2)]
+
+    clock.now += 61
+    assert store.get('a') == []
+    store.append('a', [_turn(3)])
+    assert store.get('a') == [_turn(3)]
+
+
+def test_least_recently_used_session_is_evicted_at_capacity(make_store, clock):
+    store = make_store(ttl=3600, max_sessions=2, max_history=24)
+    for key in ('a', 'b'):
+        clock.now += 1
+        store.append(key, [_turn(key)])
+    clock.now += 1
+    store.append('a', [_turn('a again')])
+    clock.now += 1
+    store.append('c', [_turn('c')])
+
+    assert store.get('b') == []
+    assert store.get('a') == [_turn('a'), _turn('a again')]
+    assert store.get('c') == [_turn('c')]
+
+
+def test_history_keeps_the_newest_turns_and_pop_clears_it(make_store, clock):
+    store = make_store(ttl=3600, max_sessions=10, max_history=3)
+    store.append('a', [_turn(n) for n in range(5)])
+    assert store.get('a') == [_turn(2), _turn(3), _turn(4)]
+    assert store.pop('a') == [_turn(2), _turn(3), _turn(4)]
+    assert store.get('a') == []
+
+
+class _RecordingProvider:
+    def __init__(self):
+        self.calls = []
+
+    def chat(self, messages, model=None, user_id=None):
+        self.calls.append(messages)
+        return f'reply {len(self.calls)}'
+
+
+def test_outline_chat_history_round_trips_into_the_new_project(client, monkeypatch):
+    provider = _RecordingProvider()
+    monkeypatch.setattr(app_module, 'get_default_provider', lambda: provider)
+    monkeypatch.setattr(app_module, 'outline_store', MemorySessionStore())
+
+    for text in ('I want to learn optics', 'Mostly lenses'):
+        response = client.post('/api/send-message', json={'message': text, 'outline_mode': True, 'project_id': 0})
+        assert response.status_code == 200
+    assert response.get_json()['response'] == 'reply 2'
+    # The second call sees the first exchange between the system prompt and the new turn
+    assert provider.calls[1][1:] == [
+        {'role': 'user', 'content': 'I want to learn optics'},
+        {'role': 'assistant', 'content': 'reply 1'},
+        {'role': 'user', 'content': 'Mostly lenses'},
+    ]
+
+    response = client.post('/api/create-project-from-outline', json={'topic': 'Optics'})
+    project = Project.query.filter_by(title='Optics').one()
+    assert response.get_json()['project_id'] == project.id
+    messages = Message.query.filter_by(conversation_id=project.conversations[0].id).order_by(Message.created_at).all()
+    assert [m.content for m in messages] == ['I want to learn optics', 'reply 1', 'Mostly lenses', 'reply 2']
+    assert not app_module.outline_store._sessions
@@ -0,0 +1,30 @@
+import time
+
+import pytest
+
+import profiler as profiler_module
+from profiler import Profiler, ProfilerBusy
+
+
+def test_armed_route_expires_without_matching_requests(monkeypatch):
+    monkeypatch.setattr(profiler_module, 'MAX_ROUTE_SECONDS', 0.1)
+    profiler = Profiler()
+    profiler.arm_route('send_message', requests=5)
+    with pytest.raises(ProfilerBusy):
+        profiler.arm_route('send_message', requests=5)
+    time.sleep(0.3)
+    assert profiler.armed_endpoint is None
+    assert profiler.last_route_result['done']
+    # The worker is free to profile again
+    profiler.arm_route('feed', requests=1)
+    profiler.cancel_route()
+
+
+def test_route_profile_finishes_after_requested_count():
+    profiler = Profiler()
+    profiler.arm_route('feed', requests=1)
+    assert profiler.request_started('feed')
+    time.sleep(0.02)
+    profiler.request_finished()
+    assert profiler.armed_endpoint is None and profiler.last_route_result['done']
+    assert 'test_route_profile_finishes_after_requested_count' in profiler.last_route_result['output']
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from chat_providers import CircuitBreaker, GuardedProvider, LocalProvider, ProviderRouter, RateLimitError, StubProvider
+
+
+MESSAGES = [{'role': 'user', 'content': 'Why is the sky blue?'}]
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def _router(primary, fallback_provider, **kwargs):
+    return ProviderRouter(
+        providers={'primary': primary, 'secondary': fallback_provider},
+        routes=[('gpt-', 'primary')],
+        order=['primary', 'secondary'],
+        fallback=LocalProvider(),
+        **kwargs,
+    )
+
+
+def test_half_open_breaker_admits_one_probe_then_closes():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    breaker.record(False)
+    assert breaker.state == 'open' and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == 'half_open' and not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_unused_fallback_breaker_is_not_moved_to_half_open():
+    secondary = StubProvider('secondary')
+    router = _router(StubProvider('primary'), secondary, breaker_threshold=1, breaker_reset=0.05)
+    router.breakers['secondary'].record(False)
+    time.sleep(0.06)
+    for _ in range(3):
+        assert router.chat(MESSAGES, model='gpt-4').startswith('[primary:gpt-4]')
+    assert router.breakers['secondary'].state == 'open'
+    # Once the primary fails, the cooled-down secondary still gets its probe
+    router.providers['primary'].error = RuntimeError('down')
+    assert router.chat(MESSAGES, model='gpt-4').startswith('[secondary:default]')
+    assert secondary.calls == 1 and router.breakers['secondary'].state == 'closed'
+
+
+def test_slow_provider_is_not_answered_by_local_mode():
+    router = ProviderRouter(
+        providers={'openai': StubProvider('openai', latency=0.5)}, routes=[], order=['openai'],
+        hedge_after=0.1, min_hedge_after=0.1, fallback=LocalProvider(),
+    )
+    answer = router.chat(MESSAGES)
+    assert answer.startswith('[openai:default]') and router.counters['hedged'] == 0
+
+
+def test_all_providers_failing_raises_rate_limit_first():
+    router = _router(StubProvider('primary', error=RateLimited()), StubProvider('secondary', error=RuntimeError('500')))
+    with pytest.raises(RateLimited):
+        router.chat(MESSAGES, model='gpt-4')
+
+
+def test_guarded_provider_sees_upstream_429():
+    router = _router(StubProvider('primary', error=RateLimited()), StubProvider('secondary', error=RuntimeError('500')))
+    guarded = GuardedProvider(router, rate=100, burst=100, max_retries=0)
+    with pytest.raises(RateLimitError):
+        guarded.chat(MESSAGES, model='gpt-4')
+    assert guarded.stats()['upstream_429'] == 1
+
+
+def test_local_provider_answers_only_when_nothing_is_configured():
+    unconfigured = StubProvider('primary')
+    unconfigured.available = False
+    router = ProviderRouter(providers={'openai': unconfigured}, routes=[], order=['openai'], fallback=LocalProvider())
+    assert router.chat(MESSAGES).startswith('(Local mode)')
+    router.fallback = None
+    with pytest.raises(RuntimeError):
+        router.chat(MESSAGES)
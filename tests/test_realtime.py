@@ -0,0 +1,73 @@
+import json
+import threading
+
+from models import db, ChatThread, Cohort, CohortMember, ThreadMember, ThreadMessage, User
+
+
+def _thread_with_messages(user, bodies):
+    thread = ChatThread(name='Lab partners', kind='thread', created_by=user.id)
+    db.session.add(thread)
+    db.session.flush()
+    db.session.add(ThreadMember(thread_id=thread.id, user_id=user.id))
+    messages = [ThreadMessage(thread_id=thread.id, sender_id=user.id, body=body) for body in bodies]
+    db.session.add_all(messages)
+    db.session.commit()
+    return thread, [m.id for m in messages]
+
+
+def _first_message_event(response):
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith('event: message'):
+            return json.loads(text.split('data: ', 1)[1])
+    return None
+
+
+def test_first_connect_replays_messages_after_rendered_cursor(client, user):
+    thread, (rendered, posted_before_connect) = _thread_with_messages(user, ['rendered', 'posted before connect'])
+    response = client.get(f'/api/realtime/stream/{thread.id}?after={rendered}', buffered=False)
+    try:
+        event = _first_message_event(response)
+    finally:
+        response.close()
+    assert event['id'] == posted_before_connect and event['body'] == 'posted before connect'
+
+
+def test_last_event_id_takes_precedence_over_cursor(client, user):
+    thread, ids = _thread_with_messages(user, ['one', 'two', 'three'])
+    response = client.get(f'/api/realtime/stream/{thread.id}?after={ids[0]}', headers={'Last-Event-ID': str(ids[1])},
+                          buffered=False)
+    try:
+        assert _first_message_event(response)['id'] == ids[2]
+    finally:
+        response.close()
+
+
+def test_joining_a_cohort_is_idempotent_under_concurrency(app, client, user):
+    owner = User(email='owner@example.com', password_hash='x', display_name='Owner')
+    db.session.add(owner)
+    db.session.commit()
+    owner_client = app.test_client()
+    with owner_client.session_transaction() as session:
+        session['_user_id'] = str(owner.id)
+    cohort_id = owner_client.post('/api/cohorts', json={'name': 'Organic Chemistry'}).get_json()['cohort_id']
+
+    statuses = []
+    barrier = threading.Barrier(4)
+
+    def join():
+        barrier.wait()
+        statuses.append(client.post(f'/api/cohorts/{cohort_id}/join').status_code)
+
+    threads = [threading.Thread(target=join) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    client.post(f'/api/cohorts/{cohort_id}/join')
+
+    db.session.expire_all()
+    assert statuses == [200] * 4
+    assert CohortMember.query.filter_by(cohort_id=cohort_id).count() == 2
+    assert db.session.get(Cohort, cohort_id).member_count == 2
+    assert ThreadMember.query.filter_by(user_id=user.id).count() == 1
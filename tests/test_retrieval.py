@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from sqlalchemy import delete, insert
+
+from models import db, Message
+from retrieval import VectorIndexRegistry
+
+
+def _add(conversation_id, content, message_id=None):
+    row = {'conversation_id': conversation_id, 'role': 'user', 'content': content, 'created_at': datetime.utcnow()}
+    if message_id is not None:
+        row['id'] = message_id
+    db.session.execute(insert(Message), [row])
+    db.session.commit()
+
+
+def _ids(hits):
+    return [h['message_id'] for h in hits]
+
+
+def test_catch_up_indexes_a_message_that_committed_below_the_watermark(conversation):
+    registry = VectorIndexRegistry()
+    _add(conversation.id, 'carnot engine efficiency', message_id=10)
+    assert _ids(registry.search(conversation.project_id, 'carnot engine efficiency')) == [10]
+
+    # Allocated id 5 before id 10 but committed after the index had moved past it
+    _add(conversation.id, 'entropy of an ideal gas', message_id=5)
+    _add(conversation.id, 'entropy of mixing gas', message_id=11)
+    assert sorted(_ids(registry.search(conversation.project_id, 'entropy gas'))) == [5, 11]
+
+
+def test_excluded_messages_do_not_starve_the_result(conversation):
+    registry = VectorIndexRegistry()
+    for n in range(6):
+        _add(conversation.id, f'heat capacity of water sample {n}')
+    everything = _ids(registry.search(conversation.project_id, 'heat capacity water', k=6))
+    assert len(everything) == 6
+
+    hits = registry.search(conversation.project_id, 'heat capacity water', k=3, exclude_message_ids=everything[:3])
+    assert sorted(_ids(hits)) == sorted(everything[3:])
+
+
+def test_dead_messages_are_dropped_from_the_index(conversation):
+    registry = VectorIndexRegistry()
+    for n in range(6):
+        _add(conversation.id, f'second law of thermodynamics note {n}')
+    ids = _ids(registry.search(conversation.project_id, 'second law thermodynamics', k=6))
+    index = registry._index(conversation.project_id)
+    assert index.size == 6
+
+    # Archived or deleted elsewhere: the best matches vanish from the table
+    db.session.execute(delete(Message).where(Message.id.in_(ids[:4])))
+    db.session.commit()
+    hits = registry.search(conversation.project_id, 'second law thermodynamics', k=2)
+    assert sorted(_ids(hits)) == sorted(ids[4:])
+    assert index.size == 2 and set(index.positions) == set(ids[4:])
+    assert sorted(int(i) for i in index.message_ids[:index.size]) == sorted(ids[4:])
+
+
+def test_first_search_embeds_a_bounded_chunk_newest_first(conversation):
+    registry = VectorIndexRegistry(chunk_size=2, rescan_window=1)
+    for n in range(5):
+        _add(conversation.id, f'phase diagram of water {n}', message_id=n + 1)
+    index = registry._index(conversation.project_id)
+
+    registry.search(conversation.project_id, 'phase diagram water', k=5)
+    assert sorted(index.positions) == [4, 5]
+    registry.search(conversation.project_id, 'phase diagram water', k=5)
+    assert sorted(index.positions) == [2, 3, 4, 5]
+    hits = registry.search(conversation.project_id, 'phase diagram water', k=5)
+    assert sorted(_ids(hits)) == [1, 2, 3, 4, 5]
@@ -0,0 +1,86 @@
+import io
+import os
+import threading
+import time
+
+from models import db, StoredFile
+from storage import collect_garbage, get_storage, release, store_upload
+
+
+class _BarrierStream(io.BytesIO):
+    """Blocks at end of stream until every concurrent uploader has read its content."""
+
+    def __init__(self, data, barrier):
+        super().__init__(data)
+        self.barrier = barrier
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        if not chunk:
+            self.barrier.wait()
+        return chunk
+
+
+def _upload_in_thread(app, stream, errors):
+    with app.app_context():
+        try:
+            store_upload(stream, 'image/png')
+            db.session.commit()
+        except Exception as e:
+            errors.append(e)
+
+
+def test_concurrent_first_uploads_of_one_file(app):
+    barrier = threading.Barrier(6)
+    errors = []
+    threads = [
+        threading.Thread(target=_upload_in_thread, args=(app, _BarrierStream(b'same page', barrier), errors))
+        for _ in range(6)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    stored = StoredFile.query.one()
+    assert stored.ref_count == 6
+    assert get_storage().exists(stored.digest)
+
+
+def test_upload_racing_gc_keeps_its_file(app, monkeypatch):
+    stored = store_upload(io.BytesIO(b'scanned homework'), 'image/png')
+    db.session.commit()
+    digest = stored.digest
+    release(digest)
+    db.session.commit()
+
+    store = get_storage()
+    unlink = store.delete
+    errors = []
+    uploader = threading.Thread(target=_upload_in_thread, args=(app, io.BytesIO(b'scanned homework'), errors))
+
+    def delete_while_uploading(d):
+        # The re-upload arrives after GC deleted the row but before it unlinks the file
+        if d == digest and uploader.ident is None:
+            uploader.start()
+            time.sleep(0.2)
+        unlink(d)
+
+    monkeypatch.setattr(store, 'delete', delete_while_uploading)
+    report = collect_garbage()
+    uploader.join()
+    db.session.expire_all()
+
+    assert errors == [] and report['released'] == 1
+    assert db.session.get(StoredFile, digest).ref_count == 1
+    assert os.path.exists(store.local_path(digest))
+
+
+def test_gc_removes_unreferenced_files(app):
+    stored = store_upload(io.BytesIO(b'old upload'), 'image/png')
+    db.session.commit()
+    release(stored.digest)
+    db.session.commit()
+    path = get_storage().local_path(stored.digest)
+    assert collect_garbage(grace_seconds=3600)['released'] == 1
+    assert not os.path.exists(path) and StoredFile.query.count() == 0
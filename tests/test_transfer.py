@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from models import Conversation, Message, Project
+from transfer import export_jsonl, import_jsonl, TransferError
+
+
+def _lines(*records):
+    return [json.dumps(r) + '\n' for r in records]
+
+
+PROJECT = {'type': 'project', 'ref': 1, 'title': 'Optics'}
+CONVERSATION = {'type': 'conversation', 'ref': 2, 'project_ref': 1, 'title': 'Lenses'}
+
+
+def test_round_trip(conversation, user):
+    from models import db
+    db.session.add(Message(conversation_id=conversation.id, role='user', content='What is refraction?'))
+    db.session.commit()
+    counts = import_jsonl(list(export_jsonl(owner_id=user.id)), owner_id=user.id)
+    assert counts['projects'] == 1 and counts['messages'] == 1
+    assert Project.query.count() == 2
+
+
+@pytest.mark.parametrize('bad, error', [
+    ({'type': 'project', 'title': 'No ref'}, "line 1: project record is missing 'ref'"),
+    (dict(PROJECT, created_date='15/01/2024'), "line 1: invalid created_date '15/01/2024'"),
+    ('[1, 2]', 'line 1: expected a JSON object'),
+])
+def test_malformed_project_line(user, bad, error):
+    line = bad if isinstance(bad, str) else json.dumps(bad)
+    with pytest.raises(TransferError, match=error.replace('(', r'\(')):
+        import_jsonl([line], owner_id=user.id)
+
+
+@pytest.mark.parametrize('bad, error', [
+    ({'type': 'conversation', 'project_ref': 1}, "line 2: conversation record is missing 'ref'"),
+    (dict(CONVERSATION, created_at='yesterday'), "line 2: invalid created_at 'yesterday'"),
+])
+def test_malformed_conversation_line(user, bad, error):
+    with pytest.raises(TransferError, match=error):
+        import_jsonl(_lines(PROJECT, bad), owner_id=user.id)
+
+
+@pytest.mark.parametrize('bad, error', [
+    ({'type': 'message', 'content': 'hi'}, 'line 3: unknown conversation_ref None'),
+    ({'type': 'message', 'conversation_ref': 2, 'created_at': 12}, 'line 3: invalid created_at 12'),
+    ({'type': 'node', 'conversation_ref': 2, 'label': 'lens'}, "line 3: node record is missing 'ref'"),
+    ({'type': 'node', 'ref': 5, 'label': 'lens'}, 'line 3: unknown conversation_ref None'),
+])
+def test_malformed_child_line(user, bad, error):
+    with pytest.raises(TransferError, match=error):
+        import_jsonl(_lines(PROJECT, CONVERSATION, bad), owner_id=user.id)
+    # Everything before the failing project's commit is rolled back
+    assert Conversation.query.count() == 0
+
+
+def test_api_reports_malformed_line_as_400(client):
+    body = ''.join(_lines(PROJECT, dict(CONVERSATION, created_at='not a date')))
+    response = client.post('/api/conversations/import', data=body)
+    assert response.status_code == 400
+    assert 'line 2' in response.get_json()['error']
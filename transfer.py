@@ -0,0 +1,324 @@
+"""
+Streaming JSONL import/export of projects, conversations, messages and knowledge graphs.
+
+The stream is a sequence of typed records, one JSON object per line, in parent-before-child order:
+
+    {"type": "project", "ref": 3, "title": ..., "description": ..., "created_date": "2024-01-15"}
+    {"type": "conversation", "ref": 7, "project_ref": 3, "title": ..., "ai_model": ..., ...}
+    {"type": "message", "conversation_ref": 7, "role": "user", "content": ..., "created_at": ...}
+    {"type": "node", "ref": 11, "conversation_ref": 7, "label": ..., "type_": ..., "extra": ...}
+    {"type": "edge", "conversation_ref": 7, "source_ref": 11, "target_ref": 12, "relation": ..., "extra": ...}
+
+`ref` values are the ids on the exporting instance; the importer maps them to fresh ids so streams
+can be moved between databases. Reads use keyset pagination in chunks and writes use executemany
+INSERT batches, so memory stays flat regardless of how many messages are transferred.
+"""
+
+import json
+from collections import Counter
+from datetime import datetime, date
+from typing import Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import insert, select
+
+from archive import iter_archived_messages
+from kg import add_occurrences, concept_key, intern_concepts, node_label
+from models import db, Concept, Project, Conversation, Message, KnowledgeNode, KnowledgeEdge
+
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_BATCH_SIZE = 1000
+
+CONVERSATION_FIELDS = (
+    'title',
+    'ai_model',
+    'interaction_style',
+    'learning_pace',
+    'difficulty_level',
+    'explanation_style',
+    'interaction_preference',
+)
+
+
+def _dumps(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _keyset(stmt, id_column, chunk_size: int) -> Iterator:
+    """Yield rows of `stmt` ordered by `id_column`, fetching `chunk_size` rows per query."""
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            stmt.where(id_column > last_id).order_by(id_column).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def export_jsonl(owner_id: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield JSONL lines for every project (optionally only `owner_id`'s) and its children."""
+    project_stmt = select(Project.id, Project.title, Project.description, Project.created_date)
+    if owner_id is not None:
+        project_stmt = project_stmt.where(Project.owner_id == owner_id)
+
+    for project in _keyset(project_stmt, Project.id, chunk_size):
+        yield _dumps({
+            'type': 'project',
+            'ref': project.id,
+            'title': project.title,
+            'description': project.description,
+            'created_date': _iso(project.created_date),
+        })
+
+        conversation_stmt = select(
+            Conversation.id, Conversation.created_at, Conversation.archived_at, *[getattr(Conversation, f) for f in CONVERSATION_FIELDS]
+        ).where(Conversation.project_id == project.id)
+        for conv in _keyset(conversation_stmt, Conversation.id, chunk_size):
+            record = {'type': 'conversation', 'ref': conv.id, 'project_ref': project.id, 'created_at': _iso(conv.created_at)}
+            record.update({f: getattr(conv, f) for f in CONVERSATION_FIELDS})
+            yield _dumps(record)
+
+            if conv.archived_at is not None:
+                for m in iter_archived_messages(conv.id):
+                    yield _dumps({
+                        'type': 'message',
+                        'conversation_ref': conv.id,
+                        'role': m['role'],
+                        'content': m['content'],
+                        'created_at': _iso(m['created_at']),
+                    })
+            message_stmt = select(Message.id, Message.role, Message.content, Message.created_at).where(
+                Message.conversation_id == conv.id
+            )
+            for m in _keyset(message_stmt, Message.id, chunk_size):
+                yield _dumps({
+                    'type': 'message',
+                    'conversation_ref': conv.id,
+                    'role': m.role,
+                    'content': m.content,
+                    'created_at': _iso(m.created_at),
+                })
+
+            node_stmt = (
+                select(KnowledgeNode.id, node_label().label('label'), KnowledgeNode.type, KnowledgeNode.extra)
+                .outerjoin(Concept, KnowledgeNode.concept_id == Concept.id)
+                .where(KnowledgeNode.conversation_id == conv.id)
+            )
+            for n in _keyset(node_stmt, KnowledgeNode.id, chunk_size):
+                yield _dumps({
+                    'type': 'node',
+                    'ref': n.id,
+                    'conversation_ref': conv.id,
+                    'label': n.label,
+                    'type_': n.type,
+                    'extra': n.extra,
+                })
+
+            edge_stmt = select(
+                KnowledgeEdge.id, KnowledgeEdge.source_node_id, KnowledgeEdge.target_node_id,
+                KnowledgeEdge.relation, KnowledgeEdge.extra,
+            ).where(KnowledgeEdge.conversation_id == conv.id)
+            for e in _keyset(edge_stmt, KnowledgeEdge.id, chunk_size):
+                yield _dumps({
+                    'type': 'edge',
+                    'conversation_ref': conv.id,
+                    'source_ref': e.source_node_id,
+                    'target_ref': e.target_node_id,
+                    'relation': e.relation,
+                    'extra': e.extra,
+                })
+
+
+class TransferError(ValueError):
+    """Raised when the import stream is malformed (bad JSON, unknown reference, unknown type)."""
+
+
+def _required(record: Dict, field: str):
+    if record.get(field) is None:
+        raise TransferError(f'{record.get("type")} record is missing {field!r}')
+    return record[field]
+
+
+def _timestamp(record: Dict, field: str, parse, default):
+    """Parse an ISO date/datetime field with `parse`, or return `default()` when it is absent."""
+    value = record.get(field)
+    if not value:
+        return default()
+    try:
+        return parse(value)
+    except (TypeError, ValueError):
+        raise TransferError(f'invalid {field} {value!r}')
+
+
+class _Importer:
+    def __init__(self, owner_id: int, batch_size: int) -> None:
+        self.owner_id = owner_id
+        self.batch_size = batch_size
+        self.project_ids: Dict[int, int] = {}
+        self.conversation_ids: Dict[int, int] = {}
+        # Node refs are only needed until the owning conversation's edges are written
+        self.node_ids: Dict[int, int] = {}
+        self.node_conversation_ref: Optional[int] = None
+        self.pending_messages: list = []
+        self.pending_nodes: list = []
+        self.pending_node_refs: list = []
+        self.pending_node_keys: list = []
+        self.conversation_projects: Dict[int, int] = {}
+        self.pending_edges: list = []
+        self.counts = {'projects': 0, 'conversations': 0, 'messages': 0, 'nodes': 0, 'edges': 0}
+
+    def _flush_messages(self) -> None:
+        if self.pending_messages:
+            db.session.execute(insert(Message), self.pending_messages)
+            self.counts['messages'] += len(self.pending_messages)
+            self.pending_messages = []
+
+    def _flush_nodes(self) -> None:
+        if self.pending_nodes:
+            # Labels are interned into the owner's concept catalog and indexed like chat-built graphs
+            concept_ids = intern_concepts(self.owner_id, (n.pop('label') for n in self.pending_nodes))
+            frequencies: Counter = Counter()
+            for n, key in zip(self.pending_nodes, self.pending_node_keys):
+                n['concept_id'] = concept_ids.get(key)
+                frequencies[n['concept_id']] += 1
+            conversation_id = self.pending_nodes[0]['conversation_id']
+            add_occurrences(conversation_id, self.conversation_projects[conversation_id], frequencies)
+            # Edges need the new node ids, so the batch INSERT returns them in parameter order
+            new_ids = db.session.execute(
+                insert(KnowledgeNode).returning(KnowledgeNode.id, sort_by_parameter_order=True),
+                self.pending_nodes,
+            ).scalars().all()
+            self.node_ids.update(zip(self.pending_node_refs, new_ids))
+            self.counts['nodes'] += len(new_ids)
+            self.pending_nodes = []
+            self.pending_node_refs = []
+            self.pending_node_keys = []
+
+    def _flush_edges(self) -> None:
+        if self.pending_edges:
+            db.session.execute(insert(KnowledgeEdge), self.pending_edges)
+            self.counts['edges'] += len(self.pending_edges)
+            self.pending_edges = []
+
+    def flush(self) -> None:
+        self._flush_messages()
+        self._flush_nodes()
+        self._flush_edges()
+
+    def _conversation_id(self, record: Dict) -> int:
+        try:
+            return self.conversation_ids[record['conversation_ref']]
+        except KeyError:
+            raise TransferError(f"unknown conversation_ref {record.get('conversation_ref')!r}")
+
+    def add(self, record: Dict) -> None:
+        kind = record.get('type')
+        if kind == 'project':
+            self.flush()
+            db.session.commit()
+            project = Project(
+                owner_id=self.owner_id,
+                title=record.get('title') or 'Imported Project',
+                description=record.get('description'),
+                created_date=_timestamp(record, 'created_date', date.fromisoformat, date.today),
+            )
+            db.session.add(project)
+            db.session.flush()
+            self.project_ids[_required(record, 'ref')] = project.id
+            self.counts['projects'] += 1
+        elif kind == 'conversation':
+            self.flush()
+            try:
+                project_id = self.project_ids[record['project_ref']]
+            except KeyError:
+                raise TransferError(f"unknown project_ref {record.get('project_ref')!r}")
+            conv = Conversation(
+                project_id=project_id,
+                created_at=_timestamp(record, 'created_at', datetime.fromisoformat, datetime.utcnow),
+                **{f: record.get(f) for f in CONVERSATION_FIELDS},
+            )
+            conv.title = conv.title or 'Imported Conversation'
+            db.session.add(conv)
+            db.session.flush()
+            self.conversation_ids[_required(record, 'ref')] = conv.id
+            self.conversation_projects[conv.id] = project_id
+            self.counts['conversations'] += 1
+        elif kind == 'message':
+            self.pending_messages.append({
+                'conversation_id': self._conversation_id(record),
+                'role': record.get('role') or 'user',
+                'content': record.get('content') or '',
+                'created_at': _timestamp(record, 'created_at', datetime.fromisoformat, datetime.utcnow),
+            })
+            if len(self.pending_messages) >= self.batch_size:
+                self._flush_messages()
+        elif kind == 'node':
+            conversation_id = self._conversation_id(record)
+            if record['conversation_ref'] != self.node_conversation_ref:
+                self.flush()
+                self.node_ids = {}
+                self.node_conversation_ref = record['conversation_ref']
+            label = record.get('label') if concept_key(record.get('label') or '') else '(unlabeled)'
+            self.pending_node_refs.append(_required(record, 'ref'))
+            self.pending_node_keys.append(concept_key(label))
+            self.pending_nodes.append({
+                'conversation_id': conversation_id,
+                'label': label,
+                'type': record.get('type_'),
+                'extra': record.get('extra'),
+            })
+            if len(self.pending_nodes) >= self.batch_size:
+                self._flush_nodes()
+        elif kind == 'edge':
+            conversation_id = self._conversation_id(record)
+            self._flush_nodes()
+            src = self.node_ids.get(record.get('source_ref'))
+            tgt = self.node_ids.get(record.get('target_ref'))
+            if src is None or tgt is None:
+                raise TransferError('edge references a node that was not imported before it')
+            self.pending_edges.append({
+                'conversation_id': conversation_id,
+                'source_node_id': src,
+                'target_node_id': tgt,
+                'relation': record.get('relation') or 'related_to',
+                'extra': record.get('extra'),
+            })
+            if len(self.pending_edges) >= self.batch_size:
+                self._flush_edges()
+        else:
+            raise TransferError(f'unknown record type {kind!r}')
+
+
+def import_jsonl(lines: Iterable, owner_id: int, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Import a JSONL stream (str or bytes lines) produced by `export_jsonl` under `owner_id`.
+    Commits once per project so a failed import keeps everything before the failing project.
+    Returns counts of imported records by kind.
+    """
+    importer = _Importer(owner_id, batch_size)
+    try:
+        for lineno, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise TransferError(f'line {lineno}: invalid JSON')
+            if not isinstance(record, dict):
+                raise TransferError(f'line {lineno}: expected a JSON object')
+            try:
+                importer.add(record)
+            except TransferError as e:
+                raise TransferError(f'line {lineno}: {e}')
+        importer.flush()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return importer.counts